@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+# python module to read & write Acorn DFS disk images (.ssd single sided, .dsd interleaved double sided)
+# Released under MIT license
+#
+# Catalogue layout (sectors 0 & 1 of track 0):
+# sector 0	[0-7]		first 8 characters of the title
+#			[8+8n]		file n: 7 character name padded with spaces, directory (bit 7 = locked)
+# sector 1	[0-3]		last 4 characters of the title
+#			[4]			cycle number (BCD)
+#			[5]			number of files * 8
+#			[6]			boot option in bits 4-5, total sectors bits 8-9 in bits 0-1
+#			[7]			total sectors bits 0-7
+#			[8+8n]		file n: load lo, load mid, exec lo, exec mid, length lo, length mid,
+#						high bits (exec 7-6, length 5-4, load 3-2, start sector 1-0), start sector lo
+# Files are listed in descending order of start sector.
+
+
+DFS_SECTOR_SIZE = 256
+DFS_SECTORS_PER_TRACK = 10
+DFS_TRACK_SIZE = DFS_SECTOR_SIZE * DFS_SECTORS_PER_TRACK
+DFS_TRACKS = 80
+DFS_MAX_FILES = 31
+DFS_CATALOGUE_SECTORS = 2
+
+
+class DfsError(Exception):
+	pass
+
+
+class DfsFile:
+
+	def __init__(self, name, data, load = 0, execute = 0, locked = False, directory = '$', sector = 0):
+		self.name = name
+		self.data = bytearray(data)
+		self.load = load
+		self.execute = execute
+		self.locked = locked
+		self.directory = directory
+		self.sector = sector
+
+	def sectors(self):
+		return (len(self.data) + DFS_SECTOR_SIZE - 1) // DFS_SECTOR_SIZE
+
+	def end_sector(self):
+		return self.sector + self.sectors()
+
+
+class DfsDisk:
+
+	def __init__(self, title = "", boot = 0, tracks = DFS_TRACKS):
+		self.title = title
+		self.boot = boot
+		self.tracks = tracks
+		self.cycle = 0
+		self.files = []
+
+
+	def total_sectors(self):
+		return self.tracks * DFS_SECTORS_PER_TRACK
+
+
+	# first sector after the last file
+	def next_free_sector(self):
+		end = DFS_CATALOGUE_SECTORS
+		for f in self.files:
+			end = max(end, f.end_sector())
+		return end
+
+
+	# add a file at the end of the disk, or at a given sector (e.g. a track boundary) leaving a gap before it
+	def add_file(self, name, data, load = 0, execute = 0, locked = False, directory = '$', sector = None):
+		if len(self.files) >= DFS_MAX_FILES:
+			raise DfsError("Catalogue full adding " + name)
+
+		if len(name) < 1 or len(name) > 7:
+			raise DfsError("Bad filename '" + name + "'")
+
+		for f in self.files:
+			if f.name.upper() == name.upper() and f.directory.upper() == directory.upper():
+				raise DfsError("File " + directory + "." + name + " already on disk")
+
+		free = self.next_free_sector()
+		if sector is None:
+			sector = free
+		elif sector < free:
+			raise DfsError("Can't place " + name + " at sector " + str(sector) + ", the disk is used up to sector " + str(free))
+
+		f = DfsFile(name, data, load, execute, locked, directory, sector)
+		if f.end_sector() > self.total_sectors():
+			raise DfsError("Disk full adding " + name + " (" + str(len(f.data)) + " bytes at sector " + str(sector) + ")")
+
+		self.files.append(f)
+		return f
+
+
+	def find_file(self, name, directory = '$'):
+		for f in self.files:
+			if f.name.upper() == name.upper() and f.directory.upper() == directory.upper():
+				return f
+		return None
+
+
+	def remove_file(self, name, directory = '$'):
+		f = self.find_file(name, directory)
+		if f is not None:
+			self.files.remove(f)
+		return f
+
+
+	#-----------------------------------------------------------------------------
+
+	def catalogue(self):
+		cat = bytearray(DFS_SECTOR_SIZE * DFS_CATALOGUE_SECTORS)
+
+		title = (self.title + "\0" * 12)[:12]
+		cat[0:8] = bytearray(title[:8], 'ascii')
+		cat[256:260] = bytearray(title[8:], 'ascii')
+
+		files = sorted(self.files, key = lambda f: f.sector, reverse = True)
+		sectors = self.total_sectors()
+
+		cat[256 + 4] = self.cycle
+		cat[256 + 5] = len(files) * 8
+		cat[256 + 6] = ((self.boot & 3) << 4) | ((sectors >> 8) & 3)
+		cat[256 + 7] = sectors & 255
+
+		for i, f in enumerate(files):
+			p = 8 + i * 8
+			name = (f.name + " " * 7)[:7]
+			cat[p:p+7] = bytearray(name, 'ascii')
+			cat[p+7] = ord(f.directory) | (128 if f.locked else 0)
+
+			length = len(f.data)
+			p += 256
+			cat[p+0] = f.load & 255
+			cat[p+1] = (f.load >> 8) & 255
+			cat[p+2] = f.execute & 255
+			cat[p+3] = (f.execute >> 8) & 255
+			cat[p+4] = length & 255
+			cat[p+5] = (length >> 8) & 255
+			cat[p+6] = (((f.execute >> 16) & 3) << 6) | (((length >> 16) & 3) << 4) | (((f.load >> 16) & 3) << 2) | ((f.sector >> 8) & 3)
+			cat[p+7] = f.sector & 255
+
+		return cat
+
+
+	# the whole disk side as a flat image, trimmed to the last used sector (as bbcim writes them) unless full is set
+	def image(self, full = False):
+		if full:
+			sectors = self.total_sectors()
+		else:
+			sectors = self.next_free_sector()
+
+		img = bytearray(sectors * DFS_SECTOR_SIZE)
+		img[0:DFS_SECTOR_SIZE * DFS_CATALOGUE_SECTORS] = self.catalogue()
+
+		for f in self.files:
+			p = f.sector * DFS_SECTOR_SIZE
+			img[p:p+len(f.data)] = f.data
+
+		return img
+
+
+	def write_ssd(self, filename, full = False):
+		fh = open(filename, 'wb')
+		fh.write(self.image(full))
+		fh.close()
+
+
+	#-----------------------------------------------------------------------------
+
+	@staticmethod
+	def from_image(img):
+		img = bytearray(img)
+		if len(img) < DFS_SECTOR_SIZE * DFS_CATALOGUE_SECTORS:
+			raise DfsError("Image too small for a catalogue")
+
+		title = img[0:8] + img[256:260]
+		title = title.decode('ascii', 'replace').rstrip(' \0')
+		info = img[256 + 6]
+		sectors = ((info & 3) << 8) | img[256 + 7]
+
+		disk = DfsDisk(title, (info >> 4) & 3, max(1, sectors // DFS_SECTORS_PER_TRACK))
+		disk.cycle = img[256 + 4]
+
+		count = img[256 + 5] // 8
+		if count > DFS_MAX_FILES:
+			raise DfsError("Bad catalogue, " + str(count) + " files")
+
+		for i in range(count):
+			p = 8 + i * 8
+			name = img[p:p+7].decode('ascii', 'replace').rstrip(' ')
+			directory = chr(img[p+7] & 127)
+			locked = (img[p+7] & 128) != 0
+
+			p += 256
+			hi = img[p+6]
+			load = img[p+0] | (img[p+1] << 8) | (((hi >> 2) & 3) << 16)
+			execute = img[p+2] | (img[p+3] << 8) | (((hi >> 6) & 3) << 16)
+			length = img[p+4] | (img[p+5] << 8) | (((hi >> 4) & 3) << 16)
+			sector = img[p+7] | ((hi & 3) << 8)
+
+			start = sector * DFS_SECTOR_SIZE
+			if start + length > len(img):
+				raise DfsError("File " + directory + "." + name + " runs past the end of the image")
+
+			f = DfsFile(name, img[start:start+length], load, execute, locked, directory, sector)
+			disk.files.append(f)
+
+		return disk
+
+
+	@staticmethod
+	def read_ssd(filename):
+		fh = open(filename, 'rb')
+		img = fh.read()
+		fh.close()
+		return DfsDisk.from_image(img)
+
+
+#-----------------------------------------------------------------------------
+
+# interleave two sides track by track into a .dsd image
+def dsd_image(side0, side1):
+	img0 = side0.image()
+	img1 = side1.image()
+	tracks = (max(len(img0), len(img1)) + DFS_TRACK_SIZE - 1) // DFS_TRACK_SIZE
+
+	img0 += bytearray(tracks * DFS_TRACK_SIZE - len(img0))
+	img1 += bytearray(tracks * DFS_TRACK_SIZE - len(img1))
+
+	out = bytearray()
+	for t in range(tracks):
+		p = t * DFS_TRACK_SIZE
+		out += img0[p:p+DFS_TRACK_SIZE]
+		out += img1[p:p+DFS_TRACK_SIZE]
+	return out
+
+
+def write_dsd(filename, side0, side1):
+	fh = open(filename, 'wb')
+	fh.write(dsd_image(side0, side1))
+	fh.close()
+
+
+# parse the load & exec addresses from a .inf file (as written by beebasm / bbcim)
+def read_inf(filename):
+	fh = open(filename, 'r')
+	fields = fh.read().split()
+	fh.close()
+
+	load = 0
+	execute = 0
+	if len(fields) > 1:
+		load = int(fields[1], 16) & 0x3FFFF
+	if len(fields) > 2:
+		execute = int(fields[2], 16) & 0x3FFFF
+	return load, execute
@@ -0,0 +1,695 @@
+#!/usr/bin/env python
+# python implementation of the Exomizer raw format, as decrunched by exomiser.asm / m7vplay.6502
+# Released under MIT license
+#
+# Crunches files the same way as 'exomizer raw -c -m <window>' so the build doesn't need exomizer.exe,
+# checks every result by decrunching it again, and can search several windows in parallel.
+#
+# Stream format (forward, no literal sequences - the 6502 decruncher has no support for them so always -c):
+# - the first byte is the initial bit buffer, bits are read LSB first and the highest set bit is a sentinel,
+#   every following bit buffer byte is read when the previous one runs out and holds 8 bits
+# - bits are assembled MSB first into values
+# - 52 x 4 bit table entries: bits[i], with base[i] = 1 at the start of each group of 16 (and at 48)
+#   and base[i] = base[i-1] + (1 << bits[i-1]) otherwise
+#   entries 0-15 = match lengths, 16-31 = offsets for length 3+, 32-47 = length 2, 48-51 = length 1
+# - then for each token:
+#   1 [byte]					= literal, the byte comes straight from the stream at that point
+#   0, 0 x n, 1				= match, n = 0-15 is the length entry (n = 16 is the end of stream)
+#     [bits[n] bits]			= length - base[n]
+#     [2 or 4 bits]				= offset entry - 48 (length 1), 32 (length 2) or 16 (length 3+)
+#     [bits[entry] bits]		= offset - base[entry], copying from offset bytes back in the output
+#
+# The decruncher keeps the output in a circular buffer so no offset may be larger than its size (the window).
+# A stream can also be crunched against a history, output the decruncher's buffer still holds from an earlier
+# stream, so its matches can copy from that as well.
+
+
+import sys
+import os
+import time
+
+
+#-----------------------------------------------------------------------------
+
+
+class FatalError(Exception):
+	pass
+
+
+TABLE_SIZE = 52
+GROUP_SIZE = 16
+
+LENGTH_TABLE = 0
+OFFSET_TABLE_3 = 16			# offsets for matches of length 3 or more
+OFFSET_TABLE_2 = 32			# offsets for matches of length 2
+OFFSET_TABLE_1 = 48			# offsets for matches of length 1
+
+# (first entry, entries, bits to select an entry) of each offset table indexed by min(length, 3)
+OFFSET_TABLES = [ None, (OFFSET_TABLE_1, 4, 2), (OFFSET_TABLE_2, 16, 4), (OFFSET_TABLE_3, 16, 4) ]
+
+MAX_BITS = 15
+MAX_LENGTH = 65535
+END_OF_STREAM_ENTRY = 16
+
+
+# base values of each table entry from the bit counts, as the decruncher's init does
+def table_bases(bits):
+	base = [0] * TABLE_SIZE
+	for i in range(TABLE_SIZE):
+		if i % GROUP_SIZE == 0:
+			base[i] = 1
+		else:
+			base[i] = (base[i-1] + (1 << bits[i-1])) & 0xFFFF
+	return base
+
+
+#-----------------------------------------------------------------------------
+# Decrunch
+
+class BitReader:
+
+	def __init__(self, data):
+		self.data = data
+		self.pos = 1
+		self.bitbuf = data[0]
+
+
+	def get_bits(self, count):
+		data = self.data
+		bitbuf = self.bitbuf
+		value = 0
+		for i in range(count):
+			c = bitbuf & 1
+			bitbuf >>= 1
+			if bitbuf == 0:
+				b = data[self.pos]
+				self.pos += 1
+				bitbuf = (c << 7) | (b >> 1)
+				c = b & 1
+			value = (value << 1) | c
+		self.bitbuf = bitbuf
+		return value
+
+
+	def get_byte(self):
+		b = self.data[self.pos]
+		self.pos += 1
+		return b
+
+
+# with trace set also returns, for every output byte, how many input bytes the decruncher has read by the time
+# that byte is available, i.e. the part of the stream that must be in memory to get that far
+# history = output already in the decruncher's buffer, not returned
+def decrunch(data, window = None, trace = False, history = None):
+	data = bytearray(data)
+	if len(data) == 0:
+		raise FatalError("Empty stream")
+
+	reader = BitReader(data)
+	get_bits = reader.get_bits
+	out = bytearray()
+	if history is not None:
+		out += bytearray(history)
+	start = len(out)
+	positions = []
+
+	try:
+		bits = [0] * TABLE_SIZE
+		base = [0] * TABLE_SIZE
+		for i in range(TABLE_SIZE):
+			if i % GROUP_SIZE == 0:
+				base[i] = 1
+			else:
+				base[i] = (base[i-1] + (1 << bits[i-1])) & 0xFFFF
+			bits[i] = get_bits(4)
+
+		while True:
+			if get_bits(1):
+				out.append(reader.get_byte())
+				if trace:
+					positions.append(reader.pos)
+				continue
+
+			n = 0
+			while get_bits(1) == 0:
+				n += 1
+			if n >= END_OF_STREAM_ENTRY:
+				break
+
+			length = (base[n] + get_bits(bits[n])) & 0xFFFF
+			if length == 0:
+				raise FatalError("Zero length match at stream offset " + str(reader.pos))
+
+			first, entries, select = OFFSET_TABLES[min(length, 3)]
+			i = first + get_bits(select)
+			offset = (base[i] + get_bits(bits[i])) & 0xFFFF
+
+			p = len(out) - offset
+			if offset == 0 or p < 0:
+				raise FatalError("Match offset " + str(offset) + " outside the output at stream offset " + str(reader.pos))
+			if window is not None and offset > window:
+				raise FatalError("Match offset " + str(offset) + " larger than the " + str(window) + " byte window")
+
+			if offset >= length:
+				out += out[p:p+length]
+			else:
+				for j in range(length):
+					out.append(out[p + j])
+
+			if trace:
+				positions += [reader.pos] * length
+
+	except IndexError:
+		raise FatalError("Stream truncated at offset " + str(reader.pos))
+
+	if start > 0:
+		out = out[start:]
+	if trace:
+		return out, positions
+	return out
+
+
+# input bytes needed to decrunch up to each of the given output ends (exclusive offsets),
+# e.g. the end of every video frame or music packet
+def input_ends(positions, output_ends):
+	ends = []
+	for end in output_ends:
+		if end <= 0:
+			ends.append(0)
+		else:
+			ends.append(positions[min(end, len(positions)) - 1])
+	return ends
+
+
+#-----------------------------------------------------------------------------
+# Crunch
+
+class BitWriter:
+
+	def __init__(self):
+		# the first bit buffer byte holds 7 bits under its sentinel
+		self.out = bytearray([0x80])
+		self.group = 0
+		self.bit = 0
+		self.left = 7
+
+
+	def put_bits(self, value, count):
+		out = self.out
+		for i in range(count - 1, -1, -1):
+			if self.left == 0:
+				# the decruncher reads the next bit buffer byte only when it needs its first bit
+				out.append(0)
+				self.group = len(out) - 1
+				self.bit = 0
+				self.left = 8
+			out[self.group] |= ((value >> i) & 1) << self.bit
+			self.bit += 1
+			self.left -= 1
+
+
+	def put_byte(self, b):
+		self.out.append(b)
+
+
+# bits needed to encode a value in each entry of a table group, None where it can't be encoded
+def entry_for_values(bits, base, first, entries, maxvalue):
+	lookup = [None] * (maxvalue + 1)
+	for e in range(first, first + entries):
+		lo = base[e]
+		hi = min(lo + (1 << bits[e]), maxvalue + 1)
+		for v in range(lo, hi):
+			if lookup[v] is None:
+				lookup[v] = e
+	return lookup
+
+
+# choose the bit counts for one table group that minimise the bits for the values used (histogram)
+# entry_cost[e] = bits to select entry e
+def optimise_group(histogram, entry_cost):
+	entries = len(entry_cost)
+	if len(histogram) == 0:
+		return [0] * entries
+
+	maxvalue = max(histogram.keys())
+	counts = [0] * (maxvalue + 2)
+	for v, c in histogram.items():
+		counts[v] = c
+	cumulative = [0] * (maxvalue + 3)
+	for v in range(maxvalue + 2):
+		cumulative[v + 1] = cumulative[v] + counts[v]
+	end = maxvalue + 1
+
+	# states: next uncovered value -> (cost, bits so far)
+	states = { 1: (0, []) }
+	best = None
+
+	for e in range(entries):
+		next_states = {}
+		for start, (cost, chosen) in states.items():
+			for b in range(MAX_BITS + 1):
+				stop = start + (1 << b)
+				if stop > end:
+					stop = end
+				c = cost + (cumulative[stop] - cumulative[start]) * (entry_cost[e] + b)
+				if stop == end:
+					if best is None or c < best[0]:
+						best = (c, chosen + [b])
+					break
+				s = next_states.get(stop)
+				if s is None or c < s[0]:
+					next_states[stop] = (c, chosen + [b])
+		states = next_states
+		if len(states) == 0:
+			break
+
+	if best is None:
+		raise FatalError("Values up to " + str(maxvalue) + " can't be covered by " + str(entries) + " table entries")
+
+	bits = best[1]
+	return bits + [0] * (entries - len(bits))
+
+
+# longest length up to limit for which data[i:] matches data[j:]
+def match_length(data, i, j, limit):
+	lo = 0
+	step = 16
+	while lo < limit:
+		t = min(lo + step, limit)
+		if data[i + lo:i + t] != data[j + lo:j + t]:
+			hi = t - 1
+			while lo < hi:
+				mid = (lo + hi + 1) // 2
+				if data[i + lo:i + mid] == data[j + lo:j + mid]:
+					lo = mid
+				else:
+					hi = mid - 1
+			return lo
+		lo = t
+		step *= 2
+	return lo
+
+
+class Cruncher:
+
+	# window = largest offset allowed, i.e. the decruncher's circular buffer size (-m)
+	# history = output already in the decruncher's buffer, matches may copy from it but it isn't crunched
+	def __init__(self, data, window, max_length = MAX_LENGTH, max_chain = 64, long_match = 256, history = None):
+		self.data = bytearray(history or b'') + bytearray(data)
+		self.start = len(self.data) - len(data)
+		self.window = window
+		self.max_length = max_length
+		self.max_chain = max_chain
+		self.long_match = long_match
+		self.find_matches()
+
+
+	# candidate matches at every position: lists of (offset, longest length) in order of increasing
+	# offset and length, so any shorter length is better taken from an earlier (nearer) candidate
+	def find_matches(self):
+		data = self.data
+		n = len(data)
+		window = self.window
+		max_chain = self.max_chain
+
+		matches = [None] * n
+		nearest = [0] * n			# offset of the nearest identical byte (for length 1 matches)
+		last_byte = [-1] * 256
+		head = {}
+		prev = [-1] * n
+
+		skip_offset = 0
+		skip_length = 0
+
+		for i in range(n):
+			b = data[i]
+			j = last_byte[b]
+			if j >= 0 and i - j <= window:
+				nearest[i] = i - j
+			last_byte[b] = i
+
+			if i + 1 >= n:
+				continue
+
+			key = (b << 8) | data[i + 1]
+			chain = head.get(key, -1)
+			prev[i] = chain
+			head[key] = i
+
+			if i < self.start:
+				continue
+
+			limit = min(self.max_length, n - i)
+
+			# inside a long match just carry on with it rather than searching again
+			if skip_length > 1:
+				skip_length -= 1
+				matches[i] = [(skip_offset, min(skip_length, limit))]
+				continue
+
+			found = []
+			best = 1
+			j = chain
+			steps = 0
+			while j >= 0 and i - j <= window and steps < max_chain:
+				steps += 1
+				if data[j + best] == data[i + best]:
+					length = match_length(data, i, j, limit)
+					if length > best:
+						best = length
+						found.append((i - j, best))
+						if best >= limit:
+							break
+				j = prev[j]
+
+			if len(found) > 0:
+				matches[i] = found
+				if best >= self.long_match:
+					skip_offset, skip_length = found[-1]
+
+		self.matches = matches
+		self.nearest = nearest
+
+
+	# longest match at every position - used to get the first set of tables
+	def greedy_parse(self):
+		matches = self.matches
+		n = len(self.data)
+		tokens = []
+		i = self.start
+		while i < n:
+			m = matches[i]
+			if m is not None:
+				offset, length = m[-1]
+				tokens.append((length, offset))
+				i += length
+			else:
+				tokens.append((0, 0))
+				i += 1
+		return tokens
+
+
+	# best table bit counts for the lengths & offsets used by a parse
+	def optimise_tables(self, tokens):
+		lengths = {}
+		offsets = [ None, {}, {}, {} ]
+		for length, offset in tokens:
+			if length:
+				lengths[length] = lengths.get(length, 0) + 1
+				g = offsets[min(length, 3)]
+				g[offset] = g.get(offset, 0) + 1
+
+		bits = [0] * TABLE_SIZE
+		bits[LENGTH_TABLE:LENGTH_TABLE + GROUP_SIZE] = optimise_group(lengths, [ e + 2 for e in range(GROUP_SIZE) ])
+		for g in range(1, 4):
+			first, entries, select = OFFSET_TABLES[g]
+			bits[first:first + entries] = optimise_group(offsets[g], [select] * entries)
+		return bits
+
+
+	# cheapest parse in bits for the given tables
+	def optimal_parse(self, bits):
+		data = self.data
+		n = len(data)
+		matches = self.matches
+		nearest = self.nearest
+		base = table_bases(bits)
+
+		# bit costs of every length & offset, None where the tables can't encode it
+		length_entry = entry_for_values(bits, base, LENGTH_TABLE, GROUP_SIZE, self.max_length)
+		length_cost = [ None if e is None else e + 2 + bits[e] for e in length_entry ]
+		max_length = 1
+		while max_length < self.max_length and length_entry[max_length + 1] is not None:
+			max_length += 1
+
+		offset_cost = [None]
+		for g in range(1, 4):
+			first, entries, select = OFFSET_TABLES[g]
+			lookup = entry_for_values(bits, base, first, entries, self.window)
+			offset_cost.append([ None if e is None else select + bits[e] for e in lookup ])
+		offset_cost_1, offset_cost_2, offset_cost_3 = offset_cost[1:]
+
+		# within one length entry every length costs the same so only the longest of each is worth trying
+		ends = sorted(set([ min(base[e] + (1 << bits[e]) - 1, max_length) for e in range(GROUP_SIZE) if length_cost[base[e]] is not None ] + [2, 3]))
+
+		INFINITE = 1 << 60
+		cost = [INFINITE] * (n + 1)
+		chosen_length = [0] * (n + 1)
+		chosen_offset = [0] * (n + 1)
+		cost[self.start] = 0
+
+		literal_cost = 1 + 8
+		length_1_cost = length_cost[1]
+
+		for i in range(self.start, n):
+			c = cost[i]
+
+			t = c + literal_cost
+			if t < cost[i + 1]:
+				cost[i + 1] = t
+				chosen_length[i + 1] = 0
+
+			o = nearest[i]
+			if o and length_1_cost is not None and offset_cost_1[o] is not None:
+				t = c + length_1_cost + offset_cost_1[o]
+				if t < cost[i + 1]:
+					cost[i + 1] = t
+					chosen_length[i + 1] = 1
+					chosen_offset[i + 1] = o
+
+			m = matches[i]
+			if m is None:
+				continue
+
+			shortest = 2
+			for o, longest in m:
+				if longest > max_length:
+					longest = max_length
+				if longest < shortest:
+					continue
+				for l in ends:
+					if l < shortest:
+						continue
+					if l > longest:
+						l = longest
+					if l == 2:
+						oc = offset_cost_2[o]
+					else:
+						oc = offset_cost_3[o]
+					if oc is not None:
+						t = c + length_cost[l] + oc
+						if t < cost[i + l]:
+							cost[i + l] = t
+							chosen_length[i + l] = l
+							chosen_offset[i + l] = o
+					if l == longest:
+						break
+				shortest = longest + 1
+
+		tokens = []
+		i = n
+		while i > self.start:
+			l = chosen_length[i]
+			if l == 0:
+				tokens.append((0, 0))
+				i -= 1
+			else:
+				tokens.append((l, chosen_offset[i]))
+				i -= l
+		tokens.reverse()
+		return tokens
+
+
+	def encode(self, tokens, bits):
+		data = self.data
+		base = table_bases(bits)
+		length_entry = entry_for_values(bits, base, LENGTH_TABLE, GROUP_SIZE, max([ l for l, o in tokens ] + [1]))
+		offset_entry = [None]
+		for g in range(1, 4):
+			first, entries, select = OFFSET_TABLES[g]
+			offset_entry.append(entry_for_values(bits, base, first, entries, self.window))
+
+		w = BitWriter()
+		for e in range(TABLE_SIZE):
+			w.put_bits(bits[e], 4)
+
+		i = self.start
+		for length, offset in tokens:
+			if length == 0:
+				w.put_bits(1, 1)
+				w.put_byte(data[i])
+				i += 1
+				continue
+
+			e = length_entry[length]
+			w.put_bits(1, e + 2)
+			w.put_bits(length - base[e], bits[e])
+
+			g = min(length, 3)
+			first, entries, select = OFFSET_TABLES[g]
+			e = offset_entry[g][offset]
+			w.put_bits(e - first, select)
+			w.put_bits(offset - base[e], bits[e])
+			i += length
+
+		# end of stream
+		w.put_bits(1, END_OF_STREAM_ENTRY + 2)
+		return w.out
+
+
+	# returns the smallest crunched stream over a few rounds of parsing & fitting the tables to the parse
+	def crunch(self, passes = 4):
+		tokens = self.greedy_parse()
+		bits = self.optimise_tables(tokens)
+		best = self.encode(tokens, bits)
+
+		for p in range(passes):
+			tokens = self.optimal_parse(bits)
+			bits = self.optimise_tables(tokens)
+			out = self.encode(tokens, bits)
+			if len(out) >= len(best):
+				break
+			best = out
+
+		return best
+
+
+def crunch(data, window, passes = 4, max_chain = 64, history = None):
+	return Cruncher(data, window, max_chain = max_chain, history = history).crunch(passes)
+
+
+# crunch with one window and check the result decrunches back to the input - runs in the worker processes
+def crunch_and_check(args):
+	data, window, passes, max_chain = args
+	t0 = time.time()
+	out = crunch(data, window, passes, max_chain)
+	if decrunch(out, window) != bytearray(data):
+		raise FatalError("Crunched stream with window " + str(window) + " doesn't decrunch to the input")
+	return window, out, time.time() - t0
+
+
+# windows to try for a buffer of max_window bytes, the largest isn't always the smallest output
+# as a smaller window needs fewer offset bits
+def default_windows(max_window):
+	windows = [max_window]
+	w = 256
+	while w < max_window:
+		windows.append(w)
+		windows.append(w * 3 // 2)
+		w *= 2
+	return sorted(set([ w for w in windows if w <= max_window ]))
+
+
+def search_windows(data, windows, passes = 4, max_chain = 64, jobs = None):
+	work = [ (data, w, passes, max_chain) for w in windows ]
+	if jobs == 1 or len(work) == 1:
+		return map(crunch_and_check, work)
+
+	import multiprocessing
+	pool = multiprocessing.Pool(jobs)
+	try:
+		results = pool.map(crunch_and_check, work)
+	finally:
+		pool.close()
+		pool.join()
+	return results
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) < 2 or sys.argv[1][0] == '-':
+		print "exoraw.py <input> [-o <output>] [-m <window>] [-search <w1,w2,..>] [-p <passes>] [-chain <n>] [-j <jobs>] [-d]"
+		print "  -o       output file (default <input>.exo)"
+		print "  -m       decruncher buffer size, the largest offset allowed (default 3072, as exomizer raw -m)"
+		print "  -search  windows to try, all up to -m (default " + ",".join([ str(w) for w in default_windows(3072) ]) + " for 3072)"
+		print "  -p       optimal parse passes (default 4)"
+		print "  -chain   match candidates searched at each position (default 64)"
+		print "  -j       parallel jobs (default one per core)"
+		print "  -d       decrunch <input> to <output> instead"
+		exit()
+
+	argv = sys.argv
+	source_filename = argv[1]
+	option_output = None
+	option_window = 3072
+	option_search = None
+	option_passes = 4
+	option_chain = 64
+	option_jobs = None
+	option_decrunch = False
+
+	for i in range(2, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 'o':
+				option_output = argv[i+1]
+			elif option == 'm':
+				option_window = int(argv[i+1])
+			elif option == 'search':
+				option_search = [ int(w) for w in argv[i+1].split(',') ]
+			elif option == 'p':
+				option_passes = int(argv[i+1])
+			elif option == 'chain':
+				option_chain = int(argv[i+1])
+			elif option == 'j':
+				option_jobs = int(argv[i+1])
+			elif option == 'd':
+				option_decrunch = True
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	if option_output is None:
+		option_output = source_filename + ".exo"
+
+	fh = open(source_filename, 'rb')
+	data = fh.read()
+	fh.close()
+
+	t0 = time.time()
+
+	if option_decrunch:
+		try:
+			out = decrunch(data)
+		except FatalError as e:
+			print "ERROR: " + str(e)
+			sys.exit(1)
+		fh = open(option_output, 'wb')
+		fh.write(out)
+		fh.close()
+		print "decrunched " + str(len(data)) + " bytes to " + str(len(out)) + " bytes in " + str(int((time.time() - t0) * 1000)) + " ms"
+		sys.exit(0)
+
+	windows = option_search
+	if windows is None:
+		windows = default_windows(option_window)
+	for w in windows:
+		if w < 1 or w > option_window:
+			print "ERROR: Window " + str(w) + " must be from 1 to the -m buffer size " + str(option_window)
+			sys.exit(1)
+
+	try:
+		results = search_windows(data, windows, option_passes, option_chain, option_jobs)
+	except FatalError as e:
+		print "ERROR: " + str(e)
+		sys.exit(1)
+
+	# smallest output that fits each buffer size, i.e. with a window no larger than it
+	results.sort(key = lambda r: r[0])
+	best = None
+	print "window     size  best fit    time"
+	for window, out, seconds in results:
+		if best is None or len(out) < len(best[1]):
+			best = (window, out)
+		print str(window).rjust(6) + " " + str(len(out)).rjust(8) + " " + str(len(best[1])).rjust(9) + " " + ("%6.1fs" % seconds)
+
+	window, out = best
+	fh = open(option_output, 'wb')
+	fh.write(out)
+	fh.close()
+
+	print "input = " + str(len(data)) + " bytes"
+	print "output = " + str(len(out)) + " bytes with window " + str(window) + " (" + str(100 * len(out) // max(1, len(data))) + "%), checked by decrunching"
+	print "total time = " + ("%.1f" % (time.time() - t0)) + "s"
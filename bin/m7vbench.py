@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+# python script to benchmark the mode7video encoder on generated test clips
+# Released under MIT license
+#
+# Generates black & white test clips as raw 8-bit greyscale frames (the encoder's -raw input):
+#   shapes	circles & a bar moving over a white background, like the silhouettes in the video
+#   fade	a radial gradient fading black to white and back, where the threshold & dithering flicker
+#   noise	random pixels every frame, the worst case
+#   cuts	hard cuts between different shape scenes every second
+# then runs the encoder on each, decodes the stream with m7vcodec.py and records frames / second, bytes / second
+# and the number & bytes of each frame type.
+#
+# Results can be saved as a JSON baseline and later runs compared against it, exiting with 1 if any clip got
+# bigger or slower than the tolerances allow.
+
+
+import sys
+import os
+import json
+import time
+import tempfile
+import shutil
+import platform
+import subprocess
+
+import numpy
+
+from m7vcodec import M7VideoStream, FatalError, frame_type_names
+
+
+#-----------------------------------------------------------------------------
+
+WIDTH = 76		# 2 pixels per MODE 7 cell, less the 2 control columns
+HEIGHT = 66		# 3 pixels per cell
+VIDEO_FPS = 25
+
+CLIPS = [ "shapes", "fade", "noise", "cuts" ]
+
+DEFAULT_FRAMES = 1000		# long enough that the encoder start up doesn't dominate the speed
+DEFAULT_BYTES_TOLERANCE = 0.005		# 0.5% bigger
+DEFAULT_SPEED_TOLERANCE = 1.5		# 1.5x slower
+
+
+def shapes_frame(n, seed):
+	rng = numpy.random.RandomState(seed)
+	y, x = numpy.mgrid[0:HEIGHT, 0:WIDTH]
+	frame = numpy.full((HEIGHT, WIDTH), 255, dtype = numpy.uint8)
+
+	for i in range(4):
+		cx, cy, vx, vy = rng.uniform(0, WIDTH), rng.uniform(0, HEIGHT), rng.uniform(-1.5, 1.5), rng.uniform(-1, 1)
+		r = rng.uniform(5, 14)
+		# bounce off the edges
+		px = abs((cx + vx * n) % (2 * WIDTH) - WIDTH)
+		py = abs((cy + vy * n) % (2 * HEIGHT) - HEIGHT)
+		frame[(x - px) ** 2 + (y - py) ** 2 < r * r] = 0
+
+	bar = int(n * 0.7) % (WIDTH + 20) - 10
+	frame[HEIGHT // 3:HEIGHT // 3 + 6, max(0, bar):max(0, bar + 10)] = 0
+	return frame
+
+
+def fade_frame(n, seed):
+	y, x = numpy.mgrid[0:HEIGHT, 0:WIDTH]
+	d = numpy.sqrt((x - WIDTH / 2.0) ** 2 + ((y - HEIGHT / 2.0) * 1.2) ** 2) / (WIDTH / 2.0)
+	level = abs((n % 100) - 50) / 50.0
+	return numpy.clip((level * 1.5 - d * 0.5) * 255, 0, 255).astype(numpy.uint8)
+
+
+def noise_frame(n, seed):
+	rng = numpy.random.RandomState(seed + n)
+	return (rng.randint(0, 2, (HEIGHT, WIDTH)) * 255).astype(numpy.uint8)
+
+
+def cuts_frame(n, seed):
+	scene = n // VIDEO_FPS
+	frame = shapes_frame(n % VIDEO_FPS, seed + scene * 7)
+	if scene & 1:
+		frame = 255 - frame
+	return frame
+
+
+def generate_clip(filename, clip, frames, seed = 1):
+	make_frame = { 'shapes': shapes_frame, 'fade': fade_frame, 'noise': noise_frame, 'cuts': cuts_frame }[clip]
+	fh = open(filename, 'wb')
+	for n in range(frames):
+		fh.write(make_frame(n, seed).tostring())
+	fh.close()
+
+
+#-----------------------------------------------------------------------------
+
+# encode one clip, best time of repeat runs
+def run_clip(encoder, encoder_args, clip, frames, scratch, repeat = 1):
+	raw_filename = os.path.join(scratch, clip + ".raw")
+	stream_filename = os.path.join(scratch, clip + "_beeb.bin")
+	generate_clip(raw_filename, clip, frames)
+
+	command = [ encoder, "-i", clip, "-raw", raw_filename, "-o", stream_filename ] + encoder_args
+	best = None
+	for r in range(repeat):
+		t0 = time.time()
+		process = subprocess.Popen(command, cwd = scratch, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+		output = process.communicate()[0]
+		seconds = time.time() - t0
+		if process.returncode != 0:
+			raise FatalError("Encoder failed on " + clip + ":\n" + output)
+		if best is None or seconds < best:
+			best = seconds
+
+	# the encoder's own "name = value" stats
+	stats = {}
+	for line in output.splitlines():
+		if " = " in line:
+			key, value = line.split(" = ", 1)
+			stats[key.strip()] = value.strip()
+
+	fh = open(stream_filename, 'rb')
+	data = fh.read()
+	fh.close()
+
+	types = {}
+	count = 0
+	stream = M7VideoStream(data)
+	for frame_type, offset, size, screen in stream.frames():
+		name = frame_type_names[frame_type]
+		t = types.setdefault(name, { 'frames': 0, 'bytes': 0 })
+		t['frames'] += 1
+		t['bytes'] += size
+		count += 1
+
+	if count != frames:
+		raise FatalError(clip + " stream has " + str(count) + " frames, expected " + str(frames))
+
+	return {
+		'clip': clip,
+		'frames': frames,
+		'seconds': best,
+		'fps': frames / max(best, 1e-6),
+		'bytes': len(data),
+		'bytes_per_second': VIDEO_FPS * len(data) / float(frames),
+		'frame_types': types,
+		'theoretical_minimum': int(stats.get('theoretical minimum', '0').split()[0]),
+	}
+
+
+def print_result(result):
+	line = result['clip'].ljust(8) + str(result['bytes']).rjust(8) + " bytes" + ("%10.1f" % result['bytes_per_second']) + " bytes/s" + ("%9.1f" % result['fps']) + " fps "
+	line += " ".join([ name + " " + str(t['frames']) + "/" + str(t['bytes']) for name, t in sorted(result['frame_types'].items()) ])
+	print line
+
+
+# list of regressions against a baseline, matching clips by name - the size & speed, and any change in the
+# number of frames of a type or growth in their bytes, as the same size from different frames still changes
+# what the player has to do
+def compare(results, baseline, bytes_tolerance = DEFAULT_BYTES_TOLERANCE, speed_tolerance = DEFAULT_SPEED_TOLERANCE):
+	previous = {}
+	for result in baseline['clips']:
+		previous[result['clip']] = result
+
+	regressions = []
+	for result in results:
+		old = previous.get(result['clip'])
+		if old is None:
+			print "WARNING: " + result['clip'] + " isn't in the baseline"
+			continue
+		if old['frames'] != result['frames']:
+			print "WARNING: " + result['clip'] + " has " + str(old['frames']) + " frames in the baseline, not " + str(result['frames'])
+			continue
+		if result['bytes'] > old['bytes'] * (1.0 + bytes_tolerance):
+			regressions.append((result['clip'], "bytes", old['bytes'], result['bytes']))
+		if result['fps'] * speed_tolerance < old['fps']:
+			regressions.append((result['clip'], "fps", old['fps'], result['fps']))
+
+		no_frames = { 'frames': 0, 'bytes': 0 }
+		for name in sorted(set(old['frame_types'].keys()) | set(result['frame_types'].keys())):
+			t_old = old['frame_types'].get(name, no_frames)
+			t = result['frame_types'].get(name, no_frames)
+			if t['frames'] != t_old['frames']:
+				regressions.append((result['clip'], name + " frames", t_old['frames'], t['frames']))
+			if t['bytes'] > t_old['bytes'] * (1.0 + bytes_tolerance):
+				regressions.append((result['clip'], name + " bytes", t_old['bytes'], t['bytes']))
+	return regressions
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) > 1 and sys.argv[1] in [ '-h', '-help', '/?' ]:
+		print "m7vbench.py [-encoder <path>] [-args \"<encoder options>\"] [-clips <c1,c2..>] [-n <frames>] [-repeat <n>]"
+		print "            [-o <baseline.json>] [-compare <baseline.json>] [-bytes <fraction>] [-speed <factor>] [-keep <dir>]"
+		print "  -encoder  mode7video executable (default mode7video.exe)"
+		print "  -args     extra encoder options, e.g. \"-d 1 -hyst 8\""
+		print "  -clips    clips to run (default " + ",".join(CLIPS) + ")"
+		print "  -n        frames per clip (default " + str(DEFAULT_FRAMES) + ")"
+		print "  -repeat   encoder runs per clip, the fastest is kept (default 3)"
+		print "  -o        write the results as a JSON baseline"
+		print "  -compare  compare with a JSON baseline made with the same -args, exit 1 if a clip is bigger or slower than"
+		print "            the tolerances or its frame types changed"
+		print "  -bytes    allowed size growth against the baseline (default " + str(DEFAULT_BYTES_TOLERANCE) + ")"
+		print "  -speed    allowed slow down against the baseline (default " + str(DEFAULT_SPEED_TOLERANCE) + ")"
+		print "  -keep     keep the clips & streams in this directory"
+		exit()
+
+	argv = sys.argv
+	option_encoder = "mode7video.exe"
+	option_args = []
+	option_clips = CLIPS
+	option_frames = DEFAULT_FRAMES
+	option_repeat = 3
+	option_output = None
+	option_compare = None
+	option_bytes = DEFAULT_BYTES_TOLERANCE
+	option_speed = DEFAULT_SPEED_TOLERANCE
+	option_keep = None
+
+	for i in range(1, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-' and i > 1 and argv[i-1].lower() == '-args':
+			continue
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 'encoder':
+				option_encoder = argv[i+1]
+			elif option == 'args':
+				option_args = argv[i+1].split()
+			elif option == 'clips':
+				option_clips = argv[i+1].split(',')
+			elif option == 'n':
+				option_frames = int(argv[i+1])
+			elif option == 'repeat':
+				option_repeat = int(argv[i+1])
+			elif option == 'o':
+				option_output = argv[i+1]
+			elif option == 'compare':
+				option_compare = argv[i+1]
+			elif option == 'bytes':
+				option_bytes = float(argv[i+1])
+			elif option == 'speed':
+				option_speed = float(argv[i+1])
+			elif option == 'keep':
+				option_keep = argv[i+1]
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	for clip in option_clips:
+		if clip not in CLIPS:
+			print "ERROR: Unknown clip '" + clip + "'"
+			sys.exit(2)
+
+	encoder = os.path.abspath(option_encoder)
+	if option_keep is not None:
+		scratch = option_keep
+		if not os.path.isdir(scratch):
+			os.makedirs(scratch)
+	else:
+		scratch = tempfile.mkdtemp(prefix = "m7vbench")
+
+	results = []
+	try:
+		for clip in option_clips:
+			result = run_clip(encoder, option_args, clip, option_frames, scratch, option_repeat)
+			print_result(result)
+			results.append(result)
+	except (FatalError, OSError) as e:
+		print "ERROR: " + str(e)
+		sys.exit(2)
+	finally:
+		if option_keep is None:
+			shutil.rmtree(scratch, True)
+
+	if option_output is not None:
+		baseline = { 'created': time.strftime("%Y-%m-%d %H:%M:%S"), 'platform': platform.platform(), 'encoder_args': " ".join(option_args), 'clips': results }
+		fh = open(option_output, 'w')
+		json.dump(baseline, fh, indent = 1, sort_keys = True)
+		fh.close()
+		print "baseline written to '" + option_output + "'"
+
+	if option_compare is not None:
+		fh = open(option_compare, 'r')
+		baseline = json.load(fh)
+		fh.close()
+
+		# results from other encoder options aren't comparable
+		if baseline.get('encoder_args', "") != " ".join(option_args):
+			print "ERROR: '" + option_compare + "' was recorded with -args \"" + baseline.get('encoder_args', "") + "\", not \"" + " ".join(option_args) + "\""
+			sys.exit(2)
+
+		regressions = compare(results, baseline, option_bytes, option_speed)
+		if len(regressions) > 0:
+			print "regressions against '" + option_compare + "':"
+			for clip, what, old, new in regressions:
+				print "  " + clip + " " + what + ": " + ("%.1f" % old) + " -> " + ("%.1f" % new)
+			sys.exit(1)
+		print "no regressions against '" + option_compare + "'"
@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# python script to decode & verify MODE 7 video streams written by mode7video
+# Released under MIT license
+#
+# Decodes a <name>_beeb.bin stream exactly as the 6502 player (m7vplay.6502) does and compares every
+# rebuilt frame against the per-frame dumps mode7video writes to <dir>/bin/<name>-<n>.bin with -save.
+# M7VideoEncoder writes the same format from a sequence of screens, for tools other than mode7video.
+#
+# Stream format:
+# [lo][hi]				= frame size in bytes (40 * frame height), once at the start of the stream
+# 0x00					= blank frame (no change)
+# 0x01 - 0xFC [n]		= delta frame, followed by n 16-bit little endian packs of (data << 10) | offset
+#						  offset is relative to the previous delta (first from the start of the frame)
+#						  data is the 6 bit character with bit 5 implied and bit 6 moved down to bit 5
+# 0xFE					= RLE ("steve") frame, one run of bytes per row
+# 0xFD					= RLE frame of the changes only (not supported by the player)
+# 0xFF					= end of stream
+#
+# RLE rows start at the first frame column and end when they reach column 40:
+# 0x00					= row unchanged (only as the first byte of a row)
+# 0x01 - 0x3F			= run of n spaces (or n unchanged cells in a 0xFD frame)
+# 0x40 - 0x7F			= run of n-64 solid blocks (127)
+# 0x80 - 0xFF			= literal character with bit 7 set
+
+
+import sys
+import os
+import time
+
+
+#-----------------------------------------------------------------------------
+
+
+class FatalError(Exception):
+	pass
+
+
+MODE7_WIDTH = 40
+MODE7_COL0 = 151
+MODE7_SEP = 154
+MODE7_BLANK = 32
+MODE7_BLOCK = 127
+
+FRAME_BLANK = 0
+FRAME_DELTA = 1
+FRAME_STEVE = 2
+FRAME_STEVE_DELTA = 3
+FRAME_END = 4
+
+frame_type_names = [ "blank", "delta", "steve", "steve delta", "end" ]
+
+# data bits from a delta pack back to a MODE 7 graphic character, as the player does
+delta_chars = bytearray([ (d & 31) | 32 | ((d & 32) << 1) for d in range(64) ])
+
+# and the other way, None for characters a delta can't write
+delta_data = [None] * 256
+for d in range(64):
+	delta_data[delta_chars[d]] = d
+	delta_data[delta_chars[d] | 128] = d
+
+DELTA_MAX_COUNT = 0xFC
+DELTA_MAX_OFFSET = 1023
+RLE_MAX_RUN = 63
+
+
+class M7VideoStream:
+
+	# first_column is where RLE rows start - the player has this fixed at 2
+	def __init__(self, data, first_column = 2, sep = False):
+		self.data = bytearray(data)
+		self.first_column = first_column
+		self.sep = sep
+
+		if len(self.data) < 3:
+			raise FatalError("Stream too short")
+
+		self.frame_size = self.data[0] | (self.data[1] << 8)
+
+		if self.frame_size == 0 or self.frame_size % MODE7_WIDTH != 0:
+			raise FatalError("Bad frame size " + str(self.frame_size))
+
+		self.frame_height = self.frame_size // MODE7_WIDTH
+
+
+	# the screen the player sets up before the first frame
+	def initial_screen(self):
+		row = bytearray([MODE7_BLANK] * MODE7_WIDTH)
+		row[0] = MODE7_COL0
+		if self.sep:
+			row[1] = MODE7_SEP
+		return row * self.frame_height
+
+
+	# decode one delta frame into screen, returns the stream offset after it
+	def decode_delta(self, screen, pos):
+		data = self.data
+		count = data[pos]
+		pos += 1
+		i = 0
+		for p in range(pos, pos + count * 2, 2):
+			pack = data[p] | (data[p+1] << 8)
+			i += pack & 1023
+			if i >= self.frame_size:
+				raise FatalError("Delta offset " + str(i) + " outside frame at stream offset " + str(p))
+			screen[i] = delta_chars[pack >> 10]
+		return pos + count * 2
+
+
+	# decode one RLE frame into screen, returns the stream offset after it
+	def decode_steve(self, screen, pos, changes_only):
+		data = self.data
+		blank = bytearray([MODE7_BLANK]) * MODE7_WIDTH
+		block = bytearray([MODE7_BLOCK]) * MODE7_WIDTH
+		for y in range(self.frame_height):
+			x = self.first_column
+			row = y * MODE7_WIDTH
+			if data[pos] == 0:
+				pos += 1
+				continue
+			while x < MODE7_WIDTH:
+				b = data[pos]
+				pos += 1
+				if b >= 128:
+					screen[row + x] = b
+					x += 1
+				elif b >= 64:
+					n = b - 64
+					screen[row + x:row + x + n] = block[:n]
+					x += n
+				elif b > 0:
+					if not changes_only:
+						screen[row + x:row + x + b] = blank[:b]
+					x += b
+				else:
+					raise FatalError("Zero run inside row " + str(y) + " at stream offset " + str(pos - 1))
+			if x != MODE7_WIDTH:
+				raise FatalError("Row " + str(y) + " overruns the screen at stream offset " + str(pos - 1))
+		return pos
+
+
+	# generator of (frame type, stream offset, frame bytes, screen) for every frame
+	# the same screen bytearray is updated in place and yielded each time, copy it to keep it
+	def frames(self, screen = None):
+		if screen is None:
+			screen = self.initial_screen()
+		data = self.data
+		size = len(data)
+		pos = 2
+
+		while True:
+			if pos >= size:
+				raise FatalError("Stream ends without 0xFF terminator")
+
+			start = pos
+			code = data[pos]
+
+			if code == 0xFF:
+				return
+
+			try:
+				if code == 0x00:
+					frame_type = FRAME_BLANK
+					pos += 1
+				elif code == 0xFE:
+					frame_type = FRAME_STEVE
+					pos = self.decode_steve(screen, pos + 1, False)
+				elif code == 0xFD:
+					frame_type = FRAME_STEVE_DELTA
+					pos = self.decode_steve(screen, pos + 1, True)
+				else:
+					frame_type = FRAME_DELTA
+					pos = self.decode_delta(screen, pos)
+			except IndexError:
+				raise FatalError("Stream truncated inside frame at stream offset " + str(start))
+
+			if pos > size:
+				raise FatalError("Stream truncated inside frame at stream offset " + str(start))
+
+			yield frame_type, start, pos - start, screen
+
+
+#-----------------------------------------------------------------------------
+
+# encodes screens as frames the player decodes, choosing the smaller of a delta or an RLE frame each time.
+# Screens are compared without bit 7, which the teletext chip ignores.
+class M7VideoEncoder:
+
+	# screen is what's there before the first frame, by default what the player sets up
+	def __init__(self, frame_size, first_column = 2, sep = False, screen = None):
+		if frame_size == 0 or frame_size % MODE7_WIDTH != 0 or frame_size > DELTA_MAX_OFFSET + 1:
+			raise FatalError("Bad frame size " + str(frame_size))
+		self.frame_size = frame_size
+		self.frame_height = frame_size // MODE7_WIDTH
+		self.first_column = first_column
+		self.sep = sep
+		self.data = bytearray([ frame_size & 255, frame_size >> 8 ])
+		if screen is None:
+			screen = M7VideoStream(self.data + bytearray([0xFF]), first_column, sep).initial_screen()
+		elif len(screen) != frame_size:
+			raise FatalError("Screen is " + str(len(screen)) + " bytes, not the frame size " + str(frame_size))
+		self.screen = bytearray(screen)
+		self.counts = [0] * FRAME_END
+
+
+	# delta frame bytes for the changes (offset, character), None if a delta frame can't hold them
+	def delta_frame(self, changes):
+		if len(changes) > DELTA_MAX_COUNT:
+			return None
+		frame = bytearray([len(changes)])
+		last = 0
+		for i, c in changes:
+			d = delta_data[c]
+			if d is None:
+				return None
+			pack = (d << 10) | (i - last)
+			frame.append(pack & 255)
+			frame.append(pack >> 8)
+			last = i
+		return frame
+
+
+	# RLE frame bytes for the whole screen, rows without changes are a single 0
+	def steve_frame(self, screen, changes):
+		changed_rows = set([ i // MODE7_WIDTH for i, c in changes ])
+		frame = bytearray([0xFE])
+		for y in range(self.frame_height):
+			if y not in changed_rows:
+				frame.append(0)
+				continue
+			row = screen[y * MODE7_WIDTH:(y + 1) * MODE7_WIDTH]
+			x = self.first_column
+			while x < MODE7_WIDTH:
+				c = row[x] & 0x7F
+				if c == MODE7_BLANK or c == MODE7_BLOCK:
+					n = 1
+					while x + n < MODE7_WIDTH and n < RLE_MAX_RUN and (row[x + n] & 0x7F) == c:
+						n += 1
+					frame.append(n if c == MODE7_BLANK else 64 + n)
+					x += n
+				else:
+					frame.append(c | 128)
+					x += 1
+		return frame
+
+
+	# appends one frame taking the screen from the last one to this one, returns (frame type, frame bytes)
+	# cells an RLE frame can't reach keep what they had, self.screen is what the player shows after it
+	def add_frame(self, screen):
+		screen = bytearray(screen)
+		if len(screen) != self.frame_size:
+			raise FatalError("Screen is " + str(len(screen)) + " bytes, not the frame size " + str(self.frame_size))
+
+		changes = [ (i, screen[i]) for i in range(self.frame_size) if (screen[i] ^ self.screen[i]) & 0x7F ]
+		if len(changes) == 0:
+			frame_type, frame = FRAME_BLANK, bytearray([0])
+		else:
+			delta = self.delta_frame(changes)
+			reachable = [ (i, c) for i, c in changes if i % MODE7_WIDTH >= self.first_column ]
+			steve = None
+			if len(reachable) > 0:
+				steve = self.steve_frame(screen, reachable)
+
+			if delta is not None and (steve is None or len(delta) <= len(steve)):
+				frame_type, frame = FRAME_DELTA, delta
+			else:
+				for i, c in changes:
+					if i % MODE7_WIDTH < self.first_column:
+						screen[i] = self.screen[i]
+				if steve is None:
+					frame_type, frame = FRAME_BLANK, bytearray([0])
+				else:
+					frame_type, frame = FRAME_STEVE, steve
+
+		self.screen = screen
+		self.data += frame
+		self.counts[frame_type] += 1
+		return frame_type, frame
+
+
+	# appends the changes to the screen as delta frames only, as many as it takes, returns the frames.
+	# Every frame but the last holds DELTA_MAX_COUNT deltas, so a player can tell which frames go together.
+	def add_delta_frames(self, screen):
+		screen = bytearray(screen)
+		if len(screen) != self.frame_size:
+			raise FatalError("Screen is " + str(len(screen)) + " bytes, not the frame size " + str(self.frame_size))
+
+		changes = [ (i, screen[i]) for i in range(self.frame_size) if (screen[i] ^ self.screen[i]) & 0x7F ]
+		for i, c in changes:
+			if delta_data[c] is None:
+				raise FatalError("Delta frames can't write character " + str(c) + " at offset " + str(i))
+
+		if len(changes) == 0:
+			frames = [ bytearray([0]) ]
+		else:
+			# a last frame that's full too would run into the next one
+			sizes = [DELTA_MAX_COUNT] * ((len(changes) - 1) // DELTA_MAX_COUNT) + [ (len(changes) - 1) % DELTA_MAX_COUNT + 1 ]
+			if sizes[-1] == DELTA_MAX_COUNT:
+				sizes[-1:] = [DELTA_MAX_COUNT - 1, 1]
+			frames = []
+			for size in sizes:
+				frames.append(self.delta_frame(changes[:size]))
+				changes = changes[size:]
+
+		for frame in frames:
+			self.data += frame
+			self.counts[FRAME_DELTA if frame[0] else FRAME_BLANK] += 1
+		self.screen = screen
+		return frames
+
+
+	def stream(self):
+		return self.data + bytearray([0xFF])
+
+
+#-----------------------------------------------------------------------------
+
+# decode a stream and optionally check each frame against the encoder's dumps
+# returns the number of mismatched frames
+def verify_stream(stream, dump_dir, dump_name, start_frame, verbose):
+
+	# bit 7 is ignored by the teletext chip and RLE literals always have it set
+	mask = bytearray(range(128)) * 2
+	mask = bytes(mask)
+
+	counts = [0] * FRAME_END
+	frame_bytes = [0] * FRAME_END
+	bad_frames = 0
+	missing = 0
+	n = start_frame
+
+	t0 = time.time()
+
+	for frame_type, offset, size, screen in stream.frames():
+		counts[frame_type] += 1
+		frame_bytes[frame_type] += size
+
+		if verbose:
+			print "Frame " + str(n) + ": " + frame_type_names[frame_type] + " at " + hex(offset) + " (" + str(size) + " bytes)"
+
+		if dump_dir != None:
+			filename = os.path.join(dump_dir, "bin", dump_name + "-" + str(n) + ".bin")
+			if os.path.isfile(filename):
+				fh = open(filename, 'rb')
+				expected = fh.read()
+				fh.close()
+
+				got = bytes(screen).translate(mask)
+				expected = expected.translate(mask)
+				if got != expected:
+					bad_frames += 1
+					for i in range(min(len(got), len(expected))):
+						if got[i] != expected[i]:
+							break
+					print "MISMATCH frame " + str(n) + " (" + frame_type_names[frame_type] + " at stream offset " + hex(offset) + ") first difference at row " + str(i // MODE7_WIDTH) + " column " + str(i % MODE7_WIDTH)
+			else:
+				missing += 1
+
+		n += 1
+
+	elapsed = time.time() - t0
+	total = n - start_frame
+
+	print "frame size = " + str(stream.frame_size) + " (" + str(stream.frame_height) + " rows)"
+	print "total frames = " + str(total)
+	for t in range(FRAME_END):
+		print frame_type_names[t] + " frames = " + str(counts[t]) + " (" + str(frame_bytes[t]) + " bytes)"
+	if elapsed > 0:
+		print "decoded at " + str(int(total / elapsed)) + " frames / second"
+
+	if dump_dir != None:
+		print "verified frames = " + str(total - missing)
+		if missing > 0:
+			print "missing dumps = " + str(missing)
+		print "mismatched frames = " + str(bad_frames)
+
+	return bad_frames
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) < 2 or sys.argv[1][0] == '-':
+		print "m7vcodec.py <stream_beeb.bin> [-i <dir/short name>] [-s <start frame>] [-c <first column>] [-sep] [-v]"
+		print "  -i   compare each frame against the mode7video -save dumps in <dir>/bin/<short name>-<n>.bin"
+		print "  -s   frame number of the first frame in the stream (default 1)"
+		print "  -c   first column of RLE rows (default 2, as the player)"
+		print "  -sep stream was encoded with separated graphics"
+		print "  -v   verbose, list every frame"
+		exit()
+
+	source_filename = sys.argv[1]
+	option_dump = None
+	option_start = 1
+	option_column = 2
+	option_sep = False
+	option_verbose = False
+
+	argv = sys.argv
+	for i in range(2, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 'i':
+				option_dump = argv[i+1]
+			elif option == 's':
+				option_start = int(argv[i+1])
+			elif option == 'c':
+				option_column = int(argv[i+1])
+			elif option == 'sep':
+				option_sep = True
+			elif option == 'v' or option == 'verbose':
+				option_verbose = True
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	dump_dir = None
+	dump_name = None
+	if option_dump != None:
+		dump_dir = option_dump
+		dump_name = os.path.basename(os.path.normpath(option_dump))
+
+	fh = open(source_filename, 'rb')
+	data = fh.read()
+	fh.close()
+
+	try:
+		stream = M7VideoStream(data, option_column, option_sep)
+		bad_frames = verify_stream(stream, dump_dir, dump_name, option_start, option_verbose)
+	except FatalError as e:
+		print "ERROR: " + str(e)
+		sys.exit(2)
+
+	if bad_frames > 0:
+		sys.exit(1)
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# python script to precompute the credits scroll as a MODE 7 video stream of delta frames
+# Released under MIT license
+#
+# Runs the credit scroller in 6502/creditscroll.asm - the text rendered a pixel row at a time with the sixel font in
+# data/font_5x5_shifted_trimmed.mode7.bin, the scroll window moving up a pixel every 50Hz frame with a pause between
+# lines of text - and records what changes on screen each frame as delta frames in the video stream format
+# (see m7vcodec.py), so the 6502 would only have to apply deltas instead of scrolling every character itself.
+#
+# A delta frame holds at most 252 deltas, more than that in one 50Hz frame are written as several delta frames
+# where every one but the last is full. The worst case is what decides whether the scroll holds 50Hz, so it's
+# reported as deltas & an estimate of the cycles to apply them against what the run-time scroller costs.
+#
+# The text comes from the strings at fx_creditscroll_text in creditscroll.asm, or a text file with one line of
+# credits per line, centred the way the asm strings are. The scroll window starts out as rows 5-22 of the
+# credits page.
+
+
+import sys
+import os
+import re
+
+from m7vcodec import M7VideoStream, M7VideoEncoder, FatalError, MODE7_WIDTH, DELTA_MAX_COUNT
+from m7vcycles import CYCLES_DELTA, CYCLES_DECRUNCH_CALL
+import exoraw
+
+
+#-----------------------------------------------------------------------------
+
+# the scroll window as set up in creditscroll.asm
+CREDITS_FIRST_ROW = 5
+CREDITS_ROWS = 18
+CREDITS_FIRST_CHAR = 1
+CREDITS_SIZE = CREDITS_ROWS * MODE7_WIDTH
+
+ROW_DELAY = 15			# vsyncs between lines of text
+TEXT_ROWS = 6			# pixel rows per line of text, 2 character rows of the font
+GLYPH_WIDTH = 3			# characters per glyph
+MAX_GLYPHS = 13			# glyphs on a line
+
+DEFAULT_WINDOW = 1024
+VIDEO_FPS = 50
+
+# cycles in decode_frame_data's delta loop reading from memory rather than the decruncher
+CYCLES_PER_DELTA = CYCLES_DELTA - 2 * CYCLES_DECRUNCH_CALL
+# the FAST_SCROLL inner loop, the one that got the scroll to hold 50Hz
+CYCLES_PER_SCROLL_CHAR = 32
+SCROLL_CYCLES = CYCLES_PER_SCROLL_CHAR * (MODE7_WIDTH - CREDITS_FIRST_CHAR) * CREDITS_ROWS
+
+# SET_TELETEXT_FONT_CHAR_MAP, each glyph's offset into the font, the second row of it 40 bytes on
+FONT_CHAR_MAP = { '?': 191, '!': 194, '.': 197, ' ': 241 }
+for n in range(13):
+	FONT_CHAR_MAP[chr(ord('A') + n)] = FONT_CHAR_MAP[chr(ord('a') + n)] = 1 + n * 3
+	FONT_CHAR_MAP[chr(ord('N') + n)] = FONT_CHAR_MAP[chr(ord('n') + n)] = 81 + n * 3
+for n in range(10):
+	FONT_CHAR_MAP[chr(ord('0') + n)] = 161 + n * 3
+
+# EQUS <x>,"<text>",0 and EQUS &FF at the end
+ASM_STRING = re.compile(r'^\s*EQUS\s+(\d+)\s*,\s*"([^"]*)"\s*,\s*0\s*$')
+ASM_END = re.compile(r'^\s*EQUS\s+&FF\s*$')
+
+
+# the sixel tables from creditscroll.asm, only defined for 32-127
+def build_table(f):
+	table = [None] * 256
+	for n in range(32, 128):
+		table[n] = f((n & 1), (n >> 1) & 1, (n >> 2) & 1, (n >> 3) & 1, (n >> 4) & 1, (n >> 6) & 1, n)
+	return table
+
+# the pixels up a row, bottom row from the next character (glyph_shift_table_1 | glyph_shift_table_2)
+glyph_shift_table_1 = build_table(lambda a, b, c, d, e, f, n: 32 + c + d * 2 + e * 4 + f * 8)
+glyph_shift_table_2 = build_table(lambda a, b, c, d, e, f, n: a * 16 + b * 64)
+# the pixels up a row, top row to the bottom
+rotate_table = build_table(lambda a, b, c, d, e, f, n: 32 + a * 16 + b * 64 + c + d * 2 + e * 4 + f * 8 if n & 32 else n)
+
+
+def lookup(table, n):
+	if table[n] is None:
+		raise FatalError("Character " + str(n) + " is outside the scroller's tables")
+	return table[n]
+
+
+#-----------------------------------------------------------------------------
+
+# (x, text) of each string at fx_creditscroll_text
+def asm_strings(text):
+	start = text.find(".fx_creditscroll_text\n")
+	if start < 0:
+		raise FatalError("No .fx_creditscroll_text in the asm")
+	strings = []
+	for line in text[start:].splitlines()[1:]:
+		line = line.split(';')[0]
+		m = ASM_STRING.match(line)
+		if m:
+			strings.append((int(m.group(1)), m.group(2)))
+		elif ASM_END.match(line):
+			return strings
+	raise FatalError("No EQUS &FF at the end of the credits text")
+
+
+# (x, text) of each line, centred as the offsets in the comments in creditscroll.asm
+def text_strings(text):
+	strings = []
+	for line in text.splitlines():
+		line = line.strip()
+		if len(line) > MAX_GLYPHS:
+			raise FatalError("'" + line + "' is longer than " + str(MAX_GLYPHS) + " characters")
+		strings.append((CREDITS_FIRST_CHAR + (MAX_GLYPHS - max(1, len(line))) * GLYPH_WIDTH // 2, line))
+	return strings
+
+
+# fx_creditscroll_new_line with one character row of the string's glyphs, as write_new_text does
+def text_line(font, x, text, font_row):
+	line = bytearray(MODE7_WIDTH)
+	for c in text:
+		if c not in FONT_CHAR_MAP:
+			raise FatalError("No glyph for '" + c + "' in '" + text + "'")
+		offset = FONT_CHAR_MAP[c] + font_row * MODE7_WIDTH
+		for k in range(GLYPH_WIDTH):
+			if x >= MODE7_WIDTH:
+				return line
+			line[x] = font[offset + k]
+			x += 1
+	return line
+
+
+# fx_creditscroll_rotate_new_line
+def rotate_line(line):
+	for x in range(CREDITS_FIRST_CHAR, MODE7_WIDTH):
+		line[x] = lookup(rotate_table, (line[x] & 0xFC) | 32)
+
+
+# fx_creditscroll_scroll_up, the bottom row taking the top pixels of the new line
+def scroll_up(window, line):
+	last = (CREDITS_ROWS - 1) * MODE7_WIDTH
+	for row in range(0, last, MODE7_WIDTH):
+		for x in range(row + CREDITS_FIRST_CHAR, row + MODE7_WIDTH):
+			window[x] = lookup(glyph_shift_table_1, window[x]) | lookup(glyph_shift_table_2, window[x + MODE7_WIDTH])
+	for x in range(CREDITS_FIRST_CHAR, MODE7_WIDTH):
+		window[last + x] = lookup(rotate_table, (window[last + x] & 0xFC) | 32 | (line[x] & 3))
+
+
+# the scroll window after every call of fx_creditscroll_update until the credits are finished
+def scroll_screens(font, strings, window, delay = ROW_DELAY):
+	window = bytearray(window)
+	screens = []
+	for n, (x, text) in enumerate(strings):
+		for row in range(TEXT_ROWS):
+			if row % 3 == 0:
+				line = text_line(font, x, text, row // 3)
+			else:
+				rotate_line(line)
+			scroll_up(window, line)
+			screens.append(bytearray(window))
+		if n < len(strings) - 1:
+			screens += [ bytearray(window) ] * delay
+	return screens
+
+
+#-----------------------------------------------------------------------------
+
+# encodes the screens as delta frames, returns (stream, deltas in each 50Hz frame)
+def encode_screens(window, screens):
+	encoder = M7VideoEncoder(CREDITS_SIZE, CREDITS_FIRST_CHAR, screen = window)
+	deltas = []
+	for screen in screens:
+		frames = encoder.add_delta_frames(screen)
+		deltas.append(sum([ frame[0] for frame in frames ]))
+	stream = encoder.stream()
+
+	# full frames carry on into the next one, the screen after the last one has to be the scroll's
+	n = 0
+	for frame_type, offset, size, screen in M7VideoStream(stream, CREDITS_FIRST_CHAR).frames(bytearray(window)):
+		if stream[offset] == DELTA_MAX_COUNT:
+			continue
+		if n >= len(screens) or screen != screens[n]:
+			raise FatalError("50Hz frame " + str(n) + " doesn't decode to the scroll")
+		n += 1
+	if n != len(screens):
+		raise FatalError("Stream decodes to " + str(n) + " 50Hz frames, not " + str(len(screens)))
+
+	return stream, deltas
+
+
+def read_file(filename):
+	fh = open(filename, 'rb')
+	data = fh.read()
+	fh.close()
+	return data
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) > 1 and sys.argv[1] in [ '-h', '-help', '/?' ]:
+		print "m7vcredits.py [<credits.txt>] [-asm <creditscroll.asm>] [-font <font.bin>] [-page <credits.bin>] [-o <stream.bin>]"
+		print "              [-delay <vsyncs>] [-c [<window>]]"
+		print "  <credits.txt>  one line of credits per line (default the strings in the asm)"
+		print "  -asm           scroller source for the credits (default 6502/creditscroll.asm)"
+		print "  -font          sixel font (default data/font_5x5_shifted_trimmed.mode7.bin)"
+		print "  -page          page the scroll starts on (default data/pages/credits.txt.bin)"
+		print "  -o             output stream (default credits_beeb.bin)"
+		print "  -delay         vsyncs between lines of text (default " + str(ROW_DELAY) + ")"
+		print "  -c             also report the crunched size, with this window (default " + str(DEFAULT_WINDOW) + ")"
+		exit()
+
+	argv = sys.argv
+	option_text = None
+	option_asm = os.path.join("6502", "creditscroll.asm")
+	option_font = os.path.join("data", "font_5x5_shifted_trimmed.mode7.bin")
+	option_page = os.path.join("data", "pages", "credits.txt.bin")
+	option_output = "credits_beeb.bin"
+	option_delay = ROW_DELAY
+	option_window = None
+
+	if len(argv) > 1 and argv[1][0] != '-':
+		option_text = argv[1]
+
+	for i in range(1, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 'asm':
+				option_asm = argv[i+1]
+			elif option == 'font':
+				option_font = argv[i+1]
+			elif option == 'page':
+				option_page = argv[i+1]
+			elif option == 'o':
+				option_output = argv[i+1]
+			elif option == 'delay':
+				option_delay = int(argv[i+1])
+			elif option == 'c':
+				option_window = DEFAULT_WINDOW
+				if i + 1 < len(argv) and argv[i+1].isdigit():
+					option_window = int(argv[i+1])
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	try:
+		if option_text is not None:
+			strings = text_strings(read_file(option_text))
+		else:
+			strings = asm_strings(read_file(option_asm))
+		font = bytearray(read_file(option_font))
+		page = bytearray(read_file(option_page))
+		window = page[CREDITS_FIRST_ROW * MODE7_WIDTH:CREDITS_FIRST_ROW * MODE7_WIDTH + CREDITS_SIZE]
+		if len(window) != CREDITS_SIZE:
+			raise FatalError("Page '" + option_page + "' is too short for the scroll window")
+
+		screens = scroll_screens(font, strings, window, option_delay)
+		stream, deltas = encode_screens(window, screens)
+		crunched = None
+		if option_window is not None:
+			crunched = exoraw.crunch(stream, option_window)
+	except (FatalError, IOError) as e:
+		print "ERROR: " + str(e)
+		sys.exit(1)
+
+	fh = open(option_output, 'wb')
+	fh.write(stream)
+	fh.close()
+
+	worst = max(deltas)
+	worst_frame = deltas.index(worst)
+	over = len([ d for d in deltas if d * CYCLES_PER_DELTA > SCROLL_CYCLES ])
+	split = len([ d for d in deltas if d >= DELTA_MAX_COUNT ])
+
+	print str(len(strings)) + " lines of text, " + str(len(screens)) + " frames (" + ("%.1f" % (len(screens) / float(VIDEO_FPS))) + " seconds at " + str(VIDEO_FPS) + "Hz)"
+	print "deltas = " + str(sum(deltas)) + ", " + ("%.1f" % (sum(deltas) / float(len(deltas)))) + " per frame on average"
+	print "worst case = " + str(worst) + " deltas in frame " + str(worst_frame) + ", ~" + str(worst * CYCLES_PER_DELTA) + " cycles"
+	print "run-time scroll = ~" + str(SCROLL_CYCLES) + " cycles every frame it moves"
+	print "frames costing more than the run-time scroll = " + str(over)
+	print "frames needing more than one delta frame = " + str(split)
+	line = "stream = " + str(len(stream)) + " bytes"
+	if crunched is not None:
+		line += ", crunched = " + str(len(crunched)) + " bytes (window " + str(option_window) + ")"
+	print line + ", written to '" + option_output + "'"
+	if over > 0:
+		print "WARNING: applying the deltas is slower than scrolling for " + str(over) + " frames, the scroll would tear"
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+# python script to estimate the 6502 cycles m7vplay needs to decode each frame of a MODE 7 video stream
+# Released under MIT license
+#
+# Walks the stream with the reference decoder and adds up the cycle cost of every instruction the player's
+# decode_frame_header / decode_frame_data / decode_entire_frame routines execute for each frame.
+# Fetching a byte from the Exomizer decruncher costs a fixed average (-g) as the cost of the decrunch
+# depends on the compressed data, not the video stream.
+#
+# At 25 fps each frame gets two 50Hz timer IRQs worth of CPU (80000 cycles at 2MHz), less what the
+# VGM player and the OS take on each of those IRQs. A frame that doesn't fit holds the decode lock
+# over the next video frame's IRQ so the video drops behind and has to catch up.
+
+
+import sys
+
+from m7vcodec import M7VideoStream, FatalError, FRAME_BLANK, FRAME_DELTA, FRAME_STEVE_DELTA, frame_type_names
+
+
+#-----------------------------------------------------------------------------
+
+CPU_CLOCK = 2000000
+VIDEO_FPS = 25
+IRQ_HZ = 50
+
+# JSR get_decrunched_byte, the routine itself is the -g average
+CYCLES_DECRUNCH_CALL = 6
+
+# cycles for the IRQ handler around the decode (interrupt entry, lock, frame counter, FX test, register save & restore, JSRs)
+CYCLES_IRQ = 126
+
+# decode_frame_header: JSR get_decrunched_byte, BCS, STA num_deltas, reset writeptr, RTS
+CYCLES_HEADER = 6 + 2 + 3 + 4 + 3 + 4 + 3 + 6
+
+# decode_frame_data
+CYCLES_BLANK = 3 + 3 + 2 + 6							# LDA, BEQ taken, CLC, RTS
+CYCLES_DELTA_ENTRY = 3 + 2 + 2 + 2						# LDA, BEQ, CMP, BCS
+CYCLES_DELTA = 82										# per delta, both JSRs, offset add, bit shuffle, STA (zp),Y, DEC, BNE
+CYCLES_DELTA_EXIT = -1 + 2 + 6							# BNE not taken, CLC, RTS
+CYCLES_STEVE_ENTRY = 3 + 2 + 2 + 3 + 2 + 2 + 3 + 2 + 3	# LDA, BEQ, CMP, BCS, CMP, BNE, JMP, LDA #, STA
+CYCLES_ROW = 2											# LDY #2
+CYCLES_BYTE = 3 + 6 + 2 + 2							# STY xpos, JSR get_decrunched_byte, BCS, TAX
+CYCLES_SKIP_ROW = 3										# BEQ taken
+CYCLES_LITERAL = 2 + 2 + 3 + 3 + 6 + 2					# BEQ, CMP, BCS taken, LDY, STA (zp),Y, INY
+CYCLES_BLOCKS = 2 + 2 + 2 + 2 + 3 + 2 + 2 + 2 + 3 + 3	# BEQ, CMP, BCS, CMP, BCS taken, AND, TAX, LDA, LDY, JMP
+CYCLES_SPACES = 2 + 2 + 2 + 2 + 2 + 2 + 3 + 3			# BEQ, CMP, BCS, CMP, BCS, LDA, LDY, JMP
+CYCLES_RUN_CHAR = 6 + 2 + 2 + 3							# STA (zp),Y, INY, DEX, BNE per character (-1 on the last)
+CYCLES_ROW_CHECK = 2 + 3								# CPY, BCC taken back to the loop (-1 at the end of the row)
+CYCLES_NEXT_ROW = 5 + 2 + 2 + 3 + 2 + 3 + 3 + 3			# DEC num_deltas, BEQ, CLC, LDA, ADC, STA, BCC taken, JMP
+CYCLES_STEVE_EXIT = 5 + 3 + 2 + 6						# DEC num_deltas, BEQ taken, CLC, RTS
+
+DEFAULT_DECRUNCH_CYCLES = 80		# average get_decrunched_byte, ~60 copying a match and ~120 for a literal
+DEFAULT_VGM_CYCLES = 3000			# VGM player on each 50Hz IRQ
+DEFAULT_OS_CYCLES = 1000			# OS IRQ handling on each 50Hz IRQ
+
+
+# cycles to decode one frame of the stream, from its first byte (the frame type / delta count)
+def frame_cycles(data, offset, frame_type, frame_height, decrunch = DEFAULT_DECRUNCH_CYCLES):
+
+	cycles = CYCLES_IRQ + CYCLES_HEADER + decrunch
+
+	if frame_type == FRAME_BLANK:
+		return cycles + CYCLES_BLANK
+
+	if frame_type == FRAME_DELTA:
+		count = data[offset]
+		return cycles + CYCLES_DELTA_ENTRY + count * (CYCLES_DELTA + 2 * decrunch) + CYCLES_DELTA_EXIT
+
+	if frame_type == FRAME_STEVE_DELTA:
+		# the player takes 0xFD as a delta frame of 253 deltas
+		return cycles + CYCLES_DELTA_ENTRY + 0xFD * (CYCLES_DELTA + 2 * decrunch) + CYCLES_DELTA_EXIT
+
+	cycles += CYCLES_STEVE_ENTRY
+	pos = offset + 1
+	for y in range(frame_height):
+		cycles += CYCLES_ROW
+		x = 2
+		b = data[pos]
+		if b == 0:
+			pos += 1
+			cycles += CYCLES_BYTE + decrunch + CYCLES_SKIP_ROW
+		else:
+			while x < 40:
+				b = data[pos]
+				pos += 1
+				cycles += CYCLES_BYTE + decrunch + CYCLES_ROW_CHECK
+				if b >= 128:
+					cycles += CYCLES_LITERAL
+					x += 1
+				elif b >= 64:
+					cycles += CYCLES_BLOCKS + (b - 64) * CYCLES_RUN_CHAR - 1
+					x += b - 64
+				else:
+					cycles += CYCLES_SPACES + b * CYCLES_RUN_CHAR - 1
+					x += b
+			cycles -= 1
+		cycles += CYCLES_NEXT_ROW
+
+	# the last row leaves through the BEQ instead of moving to the next row
+	return cycles - CYCLES_NEXT_ROW + CYCLES_STEVE_EXIT
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) < 2 or sys.argv[1][0] == '-':
+		print "m7vcycles.py <stream_beeb.bin> [-s <start frame>] [-g <cycles>] [-m <cycles>] [-os <cycles>] [-b <cycles>] [-v]"
+		print "  -s   frame number of the first frame in the stream (default 1)"
+		print "  -g   average cycles per decrunched byte (default " + str(DEFAULT_DECRUNCH_CYCLES) + ")"
+		print "  -m   cycles the VGM player takes per 50Hz IRQ (default " + str(DEFAULT_VGM_CYCLES) + ")"
+		print "  -os  cycles the OS takes per 50Hz IRQ (default " + str(DEFAULT_OS_CYCLES) + ")"
+		print "  -b   histogram bucket size in cycles (default 5000)"
+		print "  -v   verbose, list the cycles for every frame"
+		exit()
+
+	source_filename = sys.argv[1]
+	option_start = 1
+	option_decrunch = DEFAULT_DECRUNCH_CYCLES
+	option_vgm = DEFAULT_VGM_CYCLES
+	option_os = DEFAULT_OS_CYCLES
+	option_bucket = 5000
+	option_verbose = False
+
+	argv = sys.argv
+	for i in range(2, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 's':
+				option_start = int(argv[i+1])
+			elif option == 'g':
+				option_decrunch = int(argv[i+1])
+			elif option == 'm':
+				option_vgm = int(argv[i+1])
+			elif option == 'os':
+				option_os = int(argv[i+1])
+			elif option == 'b':
+				option_bucket = int(argv[i+1])
+			elif option == 'v' or option == 'verbose':
+				option_verbose = True
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	fh = open(source_filename, 'rb')
+	data = fh.read()
+	fh.close()
+
+	irqs_per_frame = IRQ_HZ // VIDEO_FPS
+	budget = CPU_CLOCK // VIDEO_FPS - irqs_per_frame * (option_vgm + option_os)
+
+	histogram = {}
+	over = []
+	total_cycles = 0
+	max_cycles = 0
+	max_frame = 0
+	n = option_start
+
+	try:
+		stream = M7VideoStream(data)
+		for frame_type, offset, size, screen in stream.frames():
+			cycles = frame_cycles(stream.data, offset, frame_type, stream.frame_height, option_decrunch)
+
+			total_cycles += cycles
+			if cycles > max_cycles:
+				max_cycles = cycles
+				max_frame = n
+
+			bucket = cycles // option_bucket
+			histogram[bucket] = histogram.get(bucket, 0) + 1
+
+			if cycles > budget or frame_type == FRAME_STEVE_DELTA:
+				over.append((n, frame_type, cycles))
+
+			if option_verbose:
+				print "Frame " + str(n) + ": " + frame_type_names[frame_type] + " " + str(size) + " bytes " + str(cycles) + " cycles"
+
+			n += 1
+	except FatalError as e:
+		print "ERROR: " + str(e)
+		sys.exit(2)
+
+	total = n - option_start
+	if total == 0:
+		print "ERROR: Stream has no frames"
+		sys.exit(2)
+
+	print "budget / frame = " + str(budget) + " cycles (" + str(CPU_CLOCK // VIDEO_FPS) + " less " + str(irqs_per_frame) + " x (" + str(option_vgm) + " VGM + " + str(option_os) + " OS))"
+	print "decrunch / byte = " + str(option_decrunch) + " cycles"
+	print "total frames = " + str(total)
+	print "average cycles / frame = " + str(total_cycles // total) + " (" + str(100 * total_cycles // (total * budget)) + "% of budget)"
+	print "max cycles = " + str(max_cycles) + " (frame " + str(max_frame) + ")"
+	print ""
+
+	print "cycles histogram:"
+	biggest = max(histogram.values())
+	for bucket in range(min(histogram.keys()), max(histogram.keys()) + 1):
+		count = histogram.get(bucket, 0)
+		label = str(bucket * option_bucket).rjust(7) + " - " + str((bucket + 1) * option_bucket - 1).rjust(7)
+		if bucket * option_bucket > budget:
+			label += " !"
+		else:
+			label += "  "
+		print label + " " + str(count).rjust(6) + " " + "#" * ((count * 50 + biggest - 1) // biggest)
+	print ""
+
+	print "frames over budget = " + str(len(over))
+	for n, frame_type, cycles in over:
+		if frame_type == FRAME_STEVE_DELTA:
+			print "  frame " + str(n) + ": 0xFD frame is not supported by the player"
+		else:
+			print "  frame " + str(n) + ": " + frame_type_names[frame_type] + " " + str(cycles) + " cycles (" + str(cycles - budget) + " over)"
+
+	if len(over) > 0:
+		sys.exit(1)
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# python script to build the MODE 7 video disks
+# Released under MIT license
+#
+# Takes the disk 1 image beebasm writes (player code, credits music & padding up to the video track) and
+# the Exomizer compressed video stream, and writes:
+#   <dir>/disks/<dir>_disk1.ssd	player + first part of the video from DISK1_first_track to the end of the disk
+#   <dir>/disks/<dir>_disk2.ssd	readme in track 0, rest of the video from DISK2_first_track, then help
+#   <dir>/disks/<dir>.dsd		both sides interleaved
+#
+# The video is $.<name> on each side. The old bbcim build had the disk 2 part as two files of the same name,
+# the split files' sizes, which the player never sees as it reads tracks, so here it's one file. The .ssd
+# images end at the last used sector like bbcim's. Given the same readme & help, disk 1 comes out byte for byte
+# as the old build's and disk 2 differs only in its catalogue (that one video file, and boot option 0 where
+# bbcim left 3). The old .dsd also has two stray bytes past the end of disk 2, at 401920 & 407040, which
+# aren't on its .ssd and aren't written here.
+#
+# The video is split on exact track boundaries to match load_next_track in m7vplay.6502, which reads
+# whole tracks from DISK1_first_track and then from DISK2_first_track on drive 2.
+
+
+import sys
+import os
+import time
+
+from dfsdisk import DfsDisk, DfsError, write_dsd, read_inf, DFS_SECTORS_PER_TRACK, DFS_TRACK_SIZE, DFS_TRACKS
+
+
+#-----------------------------------------------------------------------------
+
+def add_file_from_dir(disk, directory, filename, name, sector = None):
+	path = os.path.join(directory, filename)
+	fh = open(path, 'rb')
+	data = fh.read()
+	fh.close()
+
+	load, execute = 0, 0
+	if os.path.isfile(path + ".inf"):
+		load, execute = read_inf(path + ".inf")
+
+	return disk.add_file(name, data, load, execute, sector = sector)
+
+
+def build_disks(shortname, exo_filename, files_dir, disk1_first, disk2_first, tracks = DFS_TRACKS):
+
+	disk1_filename = os.path.join(shortname, "disks", shortname + "_disk1.ssd")
+	disk1 = DfsDisk.read_ssd(disk1_filename)
+	disk1.tracks = tracks
+
+	fh = open(exo_filename, 'rb')
+	video = fh.read()
+	fh.close()
+
+	# video name on both sides, DFS names are only 7 characters
+	name = os.path.basename(os.path.normpath(shortname))[:7]
+
+	# disk 1 - the video starts on the first track after the player, replacing any from a previous build
+	# (which put it in directory V)
+	disk1.remove_file(name, 'V')
+	disk1.remove_file(name, '$')
+
+	if disk1.next_free_sector() > disk1_first * DFS_SECTORS_PER_TRACK:
+		raise DfsError("Disk 1 files run into the video at track " + str(disk1_first) + " (used to sector " + str(disk1.next_free_sector()) + ")")
+
+	disk1_size = (tracks - disk1_first) * DFS_TRACK_SIZE
+	disk1.add_file(name, video[:disk1_size], sector = disk1_first * DFS_SECTORS_PER_TRACK)
+
+	# disk 2 - readme fits in track 0 after the catalogue, video from disk2_first, help at the end
+	disk2 = DfsDisk(tracks = tracks)
+	add_file_from_dir(disk2, files_dir, "readme", "readme")
+
+	if disk2.next_free_sector() > disk2_first * DFS_SECTORS_PER_TRACK:
+		raise DfsError("Readme runs into the video at track " + str(disk2_first))
+
+	rest = video[disk1_size:]
+	if len(rest) > 0:
+		disk2.add_file(name, rest, sector = disk2_first * DFS_SECTORS_PER_TRACK)
+
+	add_file_from_dir(disk2, files_dir, "help", "help")
+
+	disk1.write_ssd(disk1_filename)
+	disk2.write_ssd(os.path.join(shortname, "disks", shortname + "_disk2.ssd"))
+	write_dsd(os.path.join(shortname, "disks", shortname + ".dsd"), disk1, disk2)
+
+	return disk1, disk2, len(video), disk1_size
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) < 2 or sys.argv[1][0] == '-':
+		print "m7vdisks.py <short name/dir> [-exo <file>] [-files <dir>] [-disk1 <track>] [-disk2 <track>]"
+		print "  -exo    compressed video stream (default <dir>/<dir>_beeb.bin.exo)"
+		print "  -files  directory holding readme & help (default files)"
+		print "  -disk1  first video track on disk 1, DISK1_first_track (default 8)"
+		print "  -disk2  first video track on disk 2, DISK2_first_track (default 1)"
+		exit()
+
+	argv = sys.argv
+	shortname = argv[1]
+	option_exo = os.path.join(shortname, shortname + "_beeb.bin.exo")
+	option_files = "files"
+	option_disk1 = 8
+	option_disk2 = 1
+
+	for i in range(2, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 'exo':
+				option_exo = argv[i+1]
+			elif option == 'files':
+				option_files = argv[i+1]
+			elif option == 'disk1':
+				option_disk1 = int(argv[i+1])
+			elif option == 'disk2':
+				option_disk2 = int(argv[i+1])
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	t0 = time.time()
+
+	try:
+		disk1, disk2, video_size, disk1_size = build_disks(shortname, option_exo, option_files, option_disk1, option_disk2)
+	except (DfsError, IOError) as e:
+		print "ERROR: " + str(e)
+		sys.exit(1)
+
+	for side, disk in [ ("disk 1", disk1), ("disk 2", disk2) ]:
+		print side + ":"
+		for f in sorted(disk.files, key = lambda f: f.sector):
+			print "  " + f.directory + "." + f.name.ljust(7) + " " + ("%06X %06X" % (f.load, f.execute)) + " " + str(len(f.data)).rjust(6) + " bytes  track " + str(f.sector // DFS_SECTORS_PER_TRACK) + " sector " + str(f.sector % DFS_SECTORS_PER_TRACK)
+		print "  " + str(disk.total_sectors() - disk.next_free_sector()) + " sectors free"
+
+	print "video = " + str(video_size) + " bytes (" + str(min(video_size, disk1_size)) + " on disk 1, " + str(max(0, video_size - disk1_size)) + " on disk 2)"
+	print "built in " + str(int((time.time() - t0) * 1000)) + " ms"
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# python script to simulate m7vplay streaming a compressed MODE 7 video from disk
+# Released under MIT license
+#
+# Replays the player frame by frame at 50Hz:
+# - the timer IRQ decodes a video frame every other IRQ, consuming compressed bytes from the stream ring buffer
+#   (vsync_count lets it catch up on the following IRQ if it fell behind)
+# - the main loop waits for vsync and, when the decruncher is DFS_sectors_to_load pages past the load pointer,
+#   calls load_next_track which blocks it until OSWORD &7F has read that many sectors into the ring
+# - disk 1 is read from DISK1_first_track until DISK1_last_track, then the player moves to drive 2 (the other side)
+#
+# Drives 0 and 2 are the two sides of the same physical drive so the swap is a long seek back to the start.
+# Disk timing is a simple latency model: OSWORD overhead + head stepping + settle + rotational latency + sector reads.
+# Sectors become readable by the decruncher as each one arrives.
+#
+# A frame whose compressed data hasn't arrived in time is reported as a stall. The real player decodes whatever
+# is in the ring at that point; the simulation holds the frame until its data arrives so the rest of the run is
+# still meaningful.
+#
+# How many compressed bytes each frame consumes comes from tracing the decrunch of the .exo file, so it is exact;
+# -estimate falls back to assuming each frame takes its share of the stream in proportion to its uncompressed size.
+
+
+import sys
+
+from m7vcodec import M7VideoStream, FatalError
+import exoraw
+
+
+#-----------------------------------------------------------------------------
+
+DFS_SECTOR_SIZE = 256
+DFS_SECTORS_PER_TRACK = 10
+
+IRQ_MS = 20.0
+IRQS_PER_FRAME = 2
+
+
+class DiskTiming:
+
+	def __init__(self):
+		self.osword_ms = 2.0		# OS & DFS overhead per OSWORD &7F call
+		self.step_ms = 6.0			# per track stepped
+		self.settle_ms = 15.0		# head settle after any step
+		self.rpm = 300.0
+		self.latency_ms = None		# rotational latency, defaults to half a revolution
+
+	def revolution_ms(self):
+		return 60000.0 / self.rpm
+
+	def sector_ms(self):
+		return self.revolution_ms() / DFS_SECTORS_PER_TRACK
+
+	def rotational_latency_ms(self):
+		if self.latency_ms is None:
+			return self.revolution_ms() / 2
+		return self.latency_ms
+
+	# time from the call until the data starts arriving
+	def access_ms(self, head_track, track):
+		t = self.osword_ms + self.rotational_latency_ms()
+		if head_track != track:
+			t += abs(track - head_track) * self.step_ms + self.settle_ms
+		return t
+
+
+class DiskLayout:
+
+	# the video occupies [first_track, last_track) on each side, as DISKn_first_track / DISKn_last_track in m7vplay
+	def __init__(self, disk1_first = 8, disk1_last = 80, disk2_first = 1, disk2_last = 80):
+		self.sides = [ (0, disk1_first, disk1_last), (2, disk2_first, disk2_last) ]
+
+	def capacity(self):
+		return sum([ (last - first) * DFS_SECTORS_PER_TRACK * DFS_SECTOR_SIZE for drive, first, last in self.sides ])
+
+	# list of (drive, track, sector) for every sector of the stream in load order
+	def sectors(self):
+		out = []
+		for drive, first, last in self.sides:
+			for track in range(first, last):
+				for sector in range(DFS_SECTORS_PER_TRACK):
+					out.append((drive, track, sector))
+		return out
+
+
+#-----------------------------------------------------------------------------
+
+class StreamSimulator:
+
+	# frame_ends[n] = compressed bytes the decruncher has read once frame n has been decoded
+	# header_bytes = compressed bytes read before the IRQ starts (the frame size header)
+	def __init__(self, frame_ends, header_bytes, stream_size, layout, timing, buffer_tracks = 3, sectors_to_load = DFS_SECTORS_PER_TRACK):
+		self.frame_ends = frame_ends
+		self.header_bytes = header_bytes
+		self.stream_size = stream_size
+		self.layout = layout
+		self.timing = timing
+		self.buffer_pages = buffer_tracks * DFS_SECTORS_PER_TRACK
+		self.sectors_to_load = sectors_to_load
+
+		self.min_headroom = None
+		self.min_headroom_frame = 0
+		self.stalls = []
+		self.loads = 0
+		self.seeks = 0
+		self.busy_ms = 0.0
+		self.end_ms = 0.0
+		self.starved_frame = None
+
+
+	def run(self):
+		sectors = self.layout.sectors()
+		timing = self.timing
+
+		# the player fills the whole ring before it starts (not timed)
+		next_sector = self.buffer_pages
+		loaded_pages = self.buffer_pages			# pages up to load_to_HI, absolute
+		head = (sectors[next_sector - 1][0], sectors[next_sector - 1][1])
+
+		# current load in flight: (first page, number of pages, time first sector arrives, sector time)
+		load = None
+		main_free_at = 0.0
+
+		consumed = self.header_bytes
+		vsync_count = -1
+		frame = 0
+		num_frames = len(self.frame_ends)
+		irq = 0
+
+		while frame < num_frames:
+			irq += 1
+			t = irq * IRQ_MS
+
+			# main loop: wakes on vsync once any blocking load has finished
+			if load is not None and t >= load[2] + load[1] * load[3]:
+				loaded_pages = load[0] + load[1]
+				load = None
+
+			# EXO_crunch_byte_hi - load_to_HI, i.e. pages consumed since the load pointer's last lap
+			reader_page = max(consumed - 1, 0) // DFS_SECTOR_SIZE
+			free_pages = reader_page - (loaded_pages - self.buffer_pages)
+
+			if load is None and t >= main_free_at and next_sector < len(sectors):
+				if free_pages >= self.sectors_to_load:
+					drive, track, sector = sectors[next_sector]
+					start = t + timing.access_ms(head[1], track)
+					if head != (drive, track):
+						self.seeks += 1
+					count = min(self.sectors_to_load, len(sectors) - next_sector)
+					load = (loaded_pages, count, start, timing.sector_ms())
+					main_free_at = start + count * timing.sector_ms()
+					self.busy_ms += main_free_at - t
+					self.loads += 1
+					next_sector += count
+					head = (drive, track)
+
+			# bytes of the stream that have reached the ring
+			available = loaded_pages * DFS_SECTOR_SIZE
+			if load is not None and t >= load[2]:
+				arrived = min(int((t - load[2]) / load[3]), load[1])
+				available = (load[0] + arrived) * DFS_SECTOR_SIZE
+			available = min(available, self.stream_size)
+
+			# timer IRQ: decode a frame if we're not ahead of 25 fps
+			vsync_count += 1
+			if vsync_count >= 0:
+				need = self.frame_ends[frame]
+
+				if need > available:
+					self.stalls.append((frame, irq, need - available))
+
+					# nothing in flight and nothing more will be loaded so the data can never arrive
+					if load is None and t >= main_free_at and (next_sector >= len(sectors) or free_pages < self.sectors_to_load):
+						self.starved_frame = frame
+						break
+					continue
+
+				consumed = need
+				vsync_count -= IRQS_PER_FRAME
+
+				# once the whole stream has loaded running dry is fine
+				headroom = available - consumed
+				if available < self.stream_size and (self.min_headroom is None or headroom < self.min_headroom):
+					self.min_headroom = headroom
+					self.min_headroom_frame = frame
+
+				frame += 1
+
+		self.end_ms = irq * IRQ_MS
+
+
+#-----------------------------------------------------------------------------
+
+# compressed bytes consumed after each frame, in proportion to the frame's size in the uncompressed stream
+def estimate_frame_ends(stream, compressed_size):
+	ratio = compressed_size / float(len(stream.data))
+	ends = []
+	for frame_type, offset, size, screen in stream.frames():
+		ends.append(min(int((offset + size) * ratio + 0.5), compressed_size))
+	return ends, int(2 * ratio + 0.5)
+
+
+# compressed bytes the decruncher has read by the end of each frame, from a traced decrunch of the stream
+def trace_frame_ends(stream, compressed):
+	try:
+		data, positions = exoraw.decrunch(compressed, trace = True)
+	except exoraw.FatalError as e:
+		raise FatalError("Decrunching the compressed stream: " + str(e))
+
+	if data != bytearray(stream.data):
+		raise FatalError("Compressed stream doesn't decrunch to the video stream")
+
+	output_ends = [ offset + size for frame_type, offset, size, screen in stream.frames() ]
+	return exoraw.input_ends(positions, output_ends), exoraw.input_ends(positions, [2])[0]
+
+
+def report(sim, frame_ends, start_frame, verbose):
+	frames = len(frame_ends)
+	stall_frames = sorted(set([ f for f, irq, short in sim.stalls ]))
+
+	print "total frames = " + str(frames)
+	print "compressed size = " + str(sim.stream_size) + " bytes (disk capacity " + str(sim.layout.capacity()) + ")"
+	print "ring buffer = " + str(sim.buffer_pages) + " pages, " + str(sim.sectors_to_load) + " sectors per load"
+	print "average consumption = " + str(int(25 * frame_ends[-1] / float(frames))) + " bytes / second"
+	print "loads = " + str(sim.loads) + " (" + str(sim.seeks) + " seeks)"
+	print "disk busy = " + str(int(sim.busy_ms)) + " ms of " + str(int(sim.end_ms)) + " ms (" + str(int(100 * sim.busy_ms / sim.end_ms)) + "%)"
+	if sim.min_headroom is not None:
+		print "min headroom = " + str(sim.min_headroom) + " bytes (" + str(sim.min_headroom // DFS_SECTOR_SIZE) + " pages) at frame " + str(sim.min_headroom_frame + start_frame)
+	print "stall frames = " + str(len(stall_frames))
+	print "stalled IRQs = " + str(len(sim.stalls))
+
+	if verbose:
+		for f, irq, short in sim.stalls:
+			print "  frame " + str(f + start_frame) + " at " + str(int(irq * IRQ_MS)) + " ms short " + str(short) + " bytes"
+	elif len(stall_frames) > 0:
+		print "  first stall at frame " + str(stall_frames[0] + start_frame)
+
+	if sim.starved_frame is not None:
+		print "ERROR: frame " + str(sim.starved_frame + start_frame) + " can never be loaded (stream overruns the disk layout or a frame is bigger than the ring)"
+	elif sim.stream_size > sim.layout.capacity():
+		print "WARNING: compressed stream doesn't fit the disk layout"
+
+	return len(stall_frames)
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) < 3 or sys.argv[1][0] == '-' or sys.argv[2][0] == '-':
+		print "m7vstream.py <stream_beeb.bin> <stream_beeb.bin.exo> [options]"
+		print "  -s <n>          frame number of the first frame in the stream (default 1)"
+		print "  -sectors <n>    sectors per load (default 10, the player uses 1 for fast devices)"
+		print "  -buffer <n>     ring buffer size in tracks (default 3)"
+		print "  -disk1 <f>,<l>  first and last (exclusive) video tracks on disk 1 (default 8,80)"
+		print "  -disk2 <f>,<l>  first and last (exclusive) video tracks on disk 2 (default 1,80)"
+		print "  -step <ms>      track step time (default 6)"
+		print "  -settle <ms>    head settle time (default 15)"
+		print "  -rpm <n>        disk speed (default 300)"
+		print "  -latency <ms>   rotational latency (default half a revolution)"
+		print "  -osword <ms>    OSWORD overhead per load (default 2)"
+		print "  -estimate       estimate the compressed bytes per frame instead of decrunching the stream"
+		print "  -v              verbose, list every stalled IRQ"
+		exit()
+
+	argv = sys.argv
+	source_filename = argv[1]
+	compressed_filename = argv[2]
+
+	timing = DiskTiming()
+	option_start = 1
+	option_sectors = DFS_SECTORS_PER_TRACK
+	option_buffer = 3
+	option_disk1 = (8, 80)
+	option_disk2 = (1, 80)
+	option_verbose = False
+	option_estimate = False
+
+	for i in range(3, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 's':
+				option_start = int(argv[i+1])
+			elif option == 'sectors':
+				option_sectors = int(argv[i+1])
+			elif option == 'buffer':
+				option_buffer = int(argv[i+1])
+			elif option == 'disk1':
+				option_disk1 = tuple([ int(x) for x in argv[i+1].split(',') ])
+			elif option == 'disk2':
+				option_disk2 = tuple([ int(x) for x in argv[i+1].split(',') ])
+			elif option == 'step':
+				timing.step_ms = float(argv[i+1])
+			elif option == 'settle':
+				timing.settle_ms = float(argv[i+1])
+			elif option == 'rpm':
+				timing.rpm = float(argv[i+1])
+			elif option == 'latency':
+				timing.latency_ms = float(argv[i+1])
+			elif option == 'osword':
+				timing.osword_ms = float(argv[i+1])
+			elif option == 'estimate':
+				option_estimate = True
+			elif option == 'v' or option == 'verbose':
+				option_verbose = True
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	if option_sectors < 1 or DFS_SECTORS_PER_TRACK % option_sectors != 0:
+		print "ERROR: Sectors per load must divide " + str(DFS_SECTORS_PER_TRACK)
+		sys.exit(2)
+
+	if option_sectors > option_buffer * DFS_SECTORS_PER_TRACK:
+		print "ERROR: Sectors per load larger than the ring buffer"
+		sys.exit(2)
+
+	fh = open(source_filename, 'rb')
+	data = fh.read()
+	fh.close()
+
+	fh = open(compressed_filename, 'rb')
+	compressed = fh.read()
+	fh.close()
+	compressed_size = len(compressed)
+
+	try:
+		stream = M7VideoStream(data)
+		if option_estimate:
+			frame_ends, header_bytes = estimate_frame_ends(stream, compressed_size)
+		else:
+			frame_ends, header_bytes = trace_frame_ends(stream, compressed)
+	except FatalError as e:
+		print "ERROR: " + str(e)
+		sys.exit(2)
+
+	if len(frame_ends) == 0:
+		print "ERROR: Stream has no frames"
+		sys.exit(2)
+
+	layout = DiskLayout(option_disk1[0], option_disk1[1], option_disk2[0], option_disk2[1])
+	sim = StreamSimulator(frame_ends, header_bytes, compressed_size, layout, timing, option_buffer, option_sectors)
+	sim.run()
+
+	if report(sim, frame_ends, option_start, option_verbose) > 0:
+		sys.exit(1)
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# python script to animate the transitions between teletext pages as a MODE 7 video stream
+# Released under MIT license
+#
+# Takes a list of 1000 byte pages with a transition before each one and renders the frames in between:
+#   cut			straight to the page
+#   wipe		the page replaces the last one a row at a time from the top
+#   scroll		the last page scrolls up with the new one coming in underneath
+#   dissolve	the cells that change appear in a random order
+# then holds each page for a while (blank frames, 1 byte each) and encodes it all with M7VideoEncoder in the
+# delta / RLE frame format the player's decode_frame_data already plays at 25 frames / second, so an animated
+# intro needs no new 6502 code. The player has to be built with a 25 row frame at the top of the screen for it.
+#
+# RLE rows only start at the player's first column (2), so a page whose first columns hold control codes the
+# screen doesn't already have can only be shown by delta frames, which write graphics characters only -
+# those cells are counted as unreachable. Use -c 0 for a player built to RLE whole rows.
+#
+# The stream is decoded again with M7VideoStream to check every frame, and the bytes each transition
+# costs are listed with the size of the whole stream crunched by exoraw.py.
+
+
+import sys
+import os
+import random
+
+from m7vcodec import M7VideoStream, M7VideoEncoder, FatalError, MODE7_WIDTH, FRAME_BLANK, FRAME_DELTA, FRAME_STEVE, frame_type_names
+from teletext import TeletextPage, MODE7_HEIGHT, MODE7_SIZE
+import exoraw
+
+
+#-----------------------------------------------------------------------------
+
+VIDEO_FPS = 25
+DEFAULT_FRAMES = 25		# 1 second per transition
+DEFAULT_HOLD = 50		# 2 seconds on each page
+DEFAULT_WINDOW = 1024
+
+
+def cut_frames(a, b, frames, seed):
+	return [ bytearray(b) ]
+
+
+def wipe_frames(a, b, frames, seed):
+	screens = []
+	for k in range(1, frames + 1):
+		rows = (k * MODE7_HEIGHT + frames - 1) // frames
+		screens.append(bytearray(b[:rows * MODE7_WIDTH]) + bytearray(a[rows * MODE7_WIDTH:]))
+	return screens
+
+
+def scroll_frames(a, b, frames, seed):
+	both = bytearray(a) + bytearray(b)
+	screens = []
+	for k in range(1, frames + 1):
+		rows = (k * MODE7_HEIGHT + frames - 1) // frames
+		screens.append(both[rows * MODE7_WIDTH:rows * MODE7_WIDTH + MODE7_SIZE])
+	return screens
+
+
+# only the changes that show, so the last frame may differ from b in bytes that don't matter
+def dissolve_frames(a, b, frames, seed):
+	changes = TeletextPage(a).diff(TeletextPage(b), visible = True)
+	random.Random(seed).shuffle(changes)
+	screen = bytearray(a)
+	screens = []
+	done = 0
+	for k in range(1, frames + 1):
+		end = k * len(changes) // frames
+		for i, c in changes[done:end]:
+			screen[i] = c
+		done = end
+		screens.append(bytearray(screen))
+	return screens
+
+
+TRANSITIONS = { 'cut': cut_frames, 'wipe': wipe_frames, 'scroll': scroll_frames, 'dissolve': dissolve_frames }
+
+
+#-----------------------------------------------------------------------------
+
+# encodes the pages, each a (transition, frames, page name, page data), returns (stream, a result per page)
+def encode_pages(pages, hold = DEFAULT_HOLD, first_column = 2, seed = 1):
+	encoder = M7VideoEncoder(MODE7_SIZE, first_column)
+	expected = []
+	results = []
+
+	for n, (transition, frames, name, page) in enumerate(pages):
+		# checks it's 40 x 25
+		TeletextPage(page)
+
+		result = { 'name': name, 'transition': transition, 'frames': 0, 'bytes': 0, 'hold_frames': 0, 'hold_bytes': 0, 'unreachable': 0, 'types': [0] * len(frame_type_names) }
+		screens = TRANSITIONS[transition](encoder.screen, page, frames, seed + n)
+		target = screens[-1]
+		differences = lambda: len([ i for i in range(MODE7_SIZE) if (encoder.screen[i] ^ target[i]) & 0x7F ])
+
+		def add_frame(screen):
+			frame_type, frame = encoder.add_frame(screen)
+			expected.append(bytearray(encoder.screen))
+			result['types'][frame_type] += 1
+			return len(frame)
+
+		for screen in screens:
+			result['frames'] += 1
+			result['bytes'] += add_frame(screen)
+
+		# an RLE frame leaves the changes before first_column to a delta frame after it, which is still the
+		# transition, so it goes on while the screen gets closer to the page and holds for the frames left
+		held = 0
+		while held < hold:
+			before = differences()
+			size = add_frame(target)
+			held += 1
+			if differences() < before:
+				result['frames'] += 1
+				result['bytes'] += size
+			else:
+				result['hold_frames'] += 1
+				result['hold_bytes'] += size
+		result['unreachable'] = differences()
+		results.append(result)
+
+	stream = encoder.stream()
+
+	# check the player would show what was asked for (frames() updates one screen in place)
+	decoder = M7VideoStream(stream, first_column)
+	count = 0
+	for frame_type, offset, size, screen in decoder.frames():
+		if count >= len(expected) or any([ (x ^ y) & 0x7F for x, y in zip(screen, expected[count]) ]):
+			raise FatalError("Frame " + str(count) + " doesn't decode to the screen it was encoded from")
+		count += 1
+	if count != len(expected):
+		raise FatalError("Stream decodes to " + str(count) + " frames, not " + str(len(expected)))
+
+	return stream, results
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) < 2 or sys.argv[1][0] == '-':
+		print "m7vtrans.py [<transition>[:<frames>]] <page.bin> [<transition>[:<frames>]] <page.bin> ... [-o <stream.bin>]"
+		print "            [-frames <n>] [-hold <n>] [-c <first column>] [-seed <n>] [-m <window>]"
+		print "  <transition>  " + ", ".join(sorted(TRANSITIONS.keys())) + " before the page that follows (default cut)"
+		print "  -o            output stream (default intro_beeb.bin)"
+		print "  -frames       frames per transition (default " + str(DEFAULT_FRAMES) + ", " + str(VIDEO_FPS) + " frames / second)"
+		print "  -hold         frames each page stays on screen (default " + str(DEFAULT_HOLD) + ")"
+		print "  -c            first column of RLE rows (default 2, as the player)"
+		print "  -seed         dissolve order seed (default 1)"
+		print "  -m            window for the crunched size (default " + str(DEFAULT_WINDOW) + ")"
+		exit()
+
+	argv = sys.argv
+	option_output = "intro_beeb.bin"
+	option_frames = DEFAULT_FRAMES
+	option_hold = DEFAULT_HOLD
+	option_column = 2
+	option_seed = 1
+	option_window = DEFAULT_WINDOW
+
+	# pages & transitions in order, options all take a value
+	sequence = []
+	i = 1
+	while i < len(argv):
+		arg = argv[i]
+		i += 1
+		if arg[0] != '-':
+			sequence.append(arg)
+			continue
+		option = arg[1:].lower()
+		if option == 'o':
+			option_output = argv[i]
+		elif option == 'frames':
+			option_frames = int(argv[i])
+		elif option == 'hold':
+			option_hold = int(argv[i])
+		elif option == 'c':
+			option_column = int(argv[i])
+		elif option == 'seed':
+			option_seed = int(argv[i])
+		elif option == 'm':
+			option_window = int(argv[i])
+		else:
+			print "ERROR: Unrecognised option '" + arg + "'"
+			continue
+		i += 1
+
+	pages = []
+	transition = ('cut', 1)
+	try:
+		for arg in sequence:
+			name = arg.split(':')[0].lower()
+			if name in TRANSITIONS:
+				frames = option_frames
+				if ':' in arg:
+					frames = int(arg.split(':')[1])
+				transition = (name, max(1, frames))
+				continue
+
+			fh = open(arg, 'rb')
+			page = fh.read()
+			fh.close()
+			pages.append((transition[0], transition[1], os.path.basename(arg), page))
+			transition = ('cut', 1)
+
+		if len(pages) == 0:
+			raise FatalError("No pages")
+
+		stream, results = encode_pages(pages, option_hold, option_column, option_seed)
+		crunched = exoraw.crunch(stream, option_window)
+	except (FatalError, IOError) as e:
+		print "ERROR: " + str(e)
+		sys.exit(1)
+
+	fh = open(option_output, 'wb')
+	fh.write(stream)
+	fh.close()
+
+	print "page                  transition  frames   bytes  delta  steve  hold bytes  unreachable"
+	for r in results:
+		print r['name'].ljust(22) + r['transition'].ljust(10) + str(r['frames']).rjust(8) + str(r['bytes']).rjust(8) + str(r['types'][FRAME_DELTA]).rjust(7) + str(r['types'][FRAME_STEVE]).rjust(7) + str(r['hold_bytes']).rjust(12) + str(r['unreachable']).rjust(13)
+
+	frames = sum([ r['frames'] + r['hold_frames'] for r in results ])
+	print "total frames = " + str(frames) + " (" + ("%.1f" % (frames / float(VIDEO_FPS))) + " seconds)"
+	print "stream = " + str(len(stream)) + " bytes, crunched = " + str(len(crunched)) + " bytes (window " + str(option_window) + "), written to '" + option_output + "'"
+	if any([ r['unreachable'] for r in results ]):
+		print "WARNING: some cells before column " + str(option_column) + " can't be shown, see -c"
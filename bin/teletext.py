@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+# python script to check, render & diff MODE 7 teletext pages
+# Released under MIT license
+#
+# A TeletextPage is the 1000 bytes of a 40 x 25 MODE 7 screen, with each row resolved the way the SAA5050 does:
+# - every row starts as white alphanumerics on black, contiguous graphics, normal height, no hold
+# - control codes (0-31, or 128-159 as they're stored in screen memory) show as a space, or the held graphic
+# - "set at" codes take effect on their own cell: steady, normal height, conceal, contiguous, separated,
+#   black background, new background (the current foreground colour) & hold graphics
+# - "set after" codes take effect on the next cell: alpha & graphics colours, flash, double height & release graphics
+# - in graphics mode 32-63 & 96-127 are sixels (bit 0-4 & 6, top left to bottom right), 64-95 stay letters
+# - the row below a double height row is a lower row, shown from its own bytes with the bottom halves of its
+#   own double height cells - so BBC software prints double height text twice, the SAA5050 doesn't copy the row above
+# - the held graphic is forgotten when switching between alpha & graphics or changing height
+#
+# Diffs are lists of (offset, byte) to turn one page into another. With visible set, changes that make
+# no difference to what's on screen (e.g. one control code for another with the same effect, a letter in a
+# concealed cell) are left out, so the screen looks like the target but the bytes can differ.
+
+
+import sys
+
+try:
+	import numpy
+except ImportError:
+	# render needs numpy, the rest doesn't
+	numpy = None
+
+
+#-----------------------------------------------------------------------------
+
+
+class FatalError(Exception):
+	pass
+
+
+MODE7_WIDTH = 40
+MODE7_HEIGHT = 25
+MODE7_SIZE = MODE7_WIDTH * MODE7_HEIGHT
+MODE7_BLANK = 32
+
+# control codes, as the low 7 bits
+CODE_ALPHA_RED = 1			# to 7 = white
+CODE_FLASH = 8
+CODE_STEADY = 9
+CODE_NORMAL_HEIGHT = 12
+CODE_DOUBLE_HEIGHT = 13
+CODE_GFX_RED = 17			# to 23 = white
+CODE_CONCEAL = 24
+CODE_CONTIGUOUS = 25
+CODE_SEPARATED = 26
+CODE_BLACK_BG = 28
+CODE_NEW_BG = 29
+CODE_HOLD_GFX = 30
+CODE_RELEASE_GFX = 31
+
+# codes the SAA5050 does nothing with: alpha & graphics black, shift out / in & escape
+UNUSED_CODES = { 0: "alpha black", 14: "shift out", 15: "shift in", 16: "graphics black", 27: "escape" }
+
+COLOUR_NAMES = [ "black", "red", "green", "yellow", "blue", "magenta", "cyan", "white" ]
+
+# what a cell shows
+# char = character code shown (32 for blank), graphics = shown as sixels, double = 0 normal, 1 top half, 2 bottom half
+class Cell:
+
+	__slots__ = [ 'char', 'fg', 'bg', 'graphics', 'separated', 'double', 'flash', 'conceal' ]
+
+	def __init__(self, char, fg, bg, graphics, separated, double, flash, conceal):
+		self.char = char
+		self.fg = fg
+		self.bg = bg
+		self.graphics = graphics
+		self.separated = separated
+		self.double = double
+		self.flash = flash
+		self.conceal = conceal
+
+
+	# everything that changes how the cell looks, with the details that don't matter for it dropped
+	def key(self):
+		if self.char == MODE7_BLANK or self.conceal:
+			return (MODE7_BLANK, self.bg)
+		return (self.char, self.fg, self.bg, self.graphics, self.graphics and self.separated, self.double, self.flash)
+
+
+def is_sixel(c):
+	return (c & 0x20) != 0
+
+
+# one row of a page's buffer, indexed by column - slices read & write the page too, but can't change its length
+class RowView:
+
+	def __init__(self, data, y):
+		self.data = data
+		self.start = y * MODE7_WIDTH
+
+
+	def __len__(self):
+		return MODE7_WIDTH
+
+
+	def columns(self, x):
+		if isinstance(x, slice):
+			return range(*x.indices(MODE7_WIDTH))
+		if x < 0:
+			x += MODE7_WIDTH
+		if x < 0 or x >= MODE7_WIDTH:
+			raise IndexError("Column " + str(x) + " is off the row")
+		return x
+
+
+	def __getitem__(self, x):
+		x = self.columns(x)
+		if isinstance(x, list):
+			return bytearray([ self.data[self.start + c] for c in x ])
+		return self.data[self.start + x]
+
+
+	def __setitem__(self, x, value):
+		x = self.columns(x)
+		if isinstance(x, list):
+			value = bytearray(value)
+			if len(value) != len(x):
+				raise ValueError("Can't change the length of a row")
+			for c, b in zip(x, value):
+				self.data[self.start + c] = b
+		else:
+			self.data[self.start + x] = value
+
+
+	def __iter__(self):
+		return iter(self.data[self.start:self.start + MODE7_WIDTH])
+
+
+class TeletextPage:
+
+	def __init__(self, data):
+		if len(data) != MODE7_SIZE:
+			raise FatalError("Page is " + str(len(data)) + " bytes, not " + str(MODE7_WIDTH) + " x " + str(MODE7_HEIGHT) + " = " + str(MODE7_SIZE))
+		self.data = bytearray(data)
+
+
+	@staticmethod
+	def from_file(filename):
+		fh = open(filename, 'rb')
+		data = fh.read()
+		fh.close()
+		return TeletextPage(data)
+
+
+	def copy(self):
+		return TeletextPage(self.data)
+
+
+	# writable view of one row's 40 bytes
+	def row(self, y):
+		if y < 0 or y >= MODE7_HEIGHT:
+			raise IndexError("Row " + str(y) + " is off the page")
+		return RowView(self.data, y)
+
+
+	def rows(self):
+		return [ self.row(y) for y in range(MODE7_HEIGHT) ]
+
+
+	def has_double_height(self, y):
+		return any([ (b & 0x7F) == CODE_DOUBLE_HEIGHT for b in self.data[y * MODE7_WIDTH:(y + 1) * MODE7_WIDTH] ])
+
+
+	# the cells of one row without the row above it
+	def resolve_row(self, y):
+		fg = 7
+		bg = 0
+		graphics = False
+		separated = False
+		double = False
+		flash = False
+		conceal = False
+		hold = False
+		held_char = MODE7_BLANK
+		held_separated = False
+
+		cells = []
+		for b in self.data[y * MODE7_WIDTH:(y + 1) * MODE7_WIDTH]:
+			c = b & 0x7F
+			set_after = None
+
+			if c < 32:
+				# set at
+				if c == CODE_STEADY:
+					flash = False
+				elif c == CODE_NORMAL_HEIGHT:
+					if double:
+						held_char = MODE7_BLANK
+					double = False
+				elif c == CODE_CONCEAL:
+					conceal = True
+				elif c == CODE_CONTIGUOUS:
+					separated = False
+				elif c == CODE_SEPARATED:
+					separated = True
+				elif c == CODE_BLACK_BG:
+					bg = 0
+				elif c == CODE_NEW_BG:
+					bg = fg
+				elif c == CODE_HOLD_GFX:
+					hold = True
+				else:
+					set_after = c
+
+				if hold and graphics:
+					cells.append(Cell(held_char, fg, bg, True, held_separated, double, flash, conceal))
+				else:
+					cells.append(Cell(MODE7_BLANK, fg, bg, graphics, separated, double, flash, conceal))
+
+				# set after
+				if set_after is None:
+					pass
+				elif CODE_ALPHA_RED <= set_after <= 7:
+					if graphics:
+						held_char = MODE7_BLANK
+					fg = set_after
+					graphics = False
+					conceal = False
+				elif CODE_GFX_RED <= set_after <= 23:
+					if not graphics:
+						held_char = MODE7_BLANK
+					fg = set_after - 16
+					graphics = True
+					conceal = False
+				elif set_after == CODE_FLASH:
+					flash = True
+				elif set_after == CODE_DOUBLE_HEIGHT:
+					if not double:
+						held_char = MODE7_BLANK
+					double = True
+				elif set_after == CODE_RELEASE_GFX:
+					hold = False
+			else:
+				if graphics and is_sixel(c):
+					held_char = c
+					held_separated = separated
+				cells.append(Cell(c, fg, bg, graphics, separated, double, flash, conceal))
+
+		return cells
+
+
+	# a row below a row with double height that isn't a lower row itself
+	def lower_row(self, y):
+		lower = False
+		for r in range(y):
+			lower = not lower and self.has_double_height(r)
+		return lower
+
+
+	# the cells of one row as shown, the double height cells of a lower row showing their bottom halves
+	def cells(self, y):
+		cells = self.resolve_row(y)
+		half = 2 if self.lower_row(y) else 1
+		for cell in cells:
+			if cell.double:
+				cell.double = half
+		return cells
+
+
+	def row_key(self, y):
+		return tuple([ cell.key() for cell in self.cells(y) ])
+
+
+	# list of (offset, problem) for anything that won't show as the bytes suggest
+	def validate(self):
+		problems = []
+		for offset, b in enumerate(self.data):
+			c = b & 0x7F
+			if c in UNUSED_CODES:
+				problems.append((offset, "control code " + str(b) + " (" + UNUSED_CODES[c] + ") does nothing on the SAA5050"))
+
+		last = MODE7_HEIGHT - 1
+		if self.has_double_height(last):
+			problems.append((last * MODE7_WIDTH, "double height on the last row has no row below for its bottom half"))
+
+		# the top halves need the same cells double height in the lower row for their bottom halves
+		for y in range(1, MODE7_HEIGHT):
+			if self.lower_row(y):
+				above = self.cells(y - 1)
+				below = self.cells(y)
+				different = [ x for x in range(MODE7_WIDTH) if above[x].double == 1 and above[x].key()[0] != MODE7_BLANK and (below[x].double != 2 or below[x].key()[:1] != above[x].key()[:1]) ]
+				if len(different) > 0:
+					problems.append((y * MODE7_WIDTH + different[0], str(len(different)) + " double height cells where the lower row doesn't repeat the upper row"))
+		return problems
+
+
+	#-------------------------------------------------------------------------
+
+	# (offset, byte) changes to turn this page into other, only the ones that show with visible set
+	def diff(self, other, visible = False):
+		changes = [ (i, b) for i, (a, b) in enumerate(zip(self.data, other.data)) if a != b ]
+		if not visible:
+			return changes
+
+		# start from the target and put back every change that makes no difference to the row, or to the rows
+		# below it if it changes which of them are lower rows, top down so the rows above are already settled
+		page = other.copy()
+		targets = [ other.row_key(y) for y in range(MODE7_HEIGHT) ]
+		result = []
+		for i, b in changes:
+			y = i // MODE7_WIDTH
+			page.data[i] = self.data[i]
+			end = y + 1
+			if page.has_double_height(y) != other.has_double_height(y):
+				end = MODE7_HEIGHT
+			if any([ page.row_key(r) != targets[r] for r in range(y, end) ]):
+				page.data[i] = b
+				result.append((i, b))
+		return result
+
+
+	def apply(self, changes):
+		for i, b in changes:
+			self.data[i] = b
+
+
+	#-------------------------------------------------------------------------
+
+	# RGB image, 12 x 20 pixels per cell with sixel rows of 6, 8 & 6 pixels like the SAA5050's 3, 4 & 3 lines.
+	# There's no character ROM here so letters are drawn as a box in their colour.
+	def render(self):
+		if numpy is None:
+			raise FatalError("Rendering needs numpy")
+
+		cw, ch = 12, 20
+		palette = numpy.array([ [ 255 * (c & 1), 255 * ((c >> 1) & 1), 255 * ((c >> 2) & 1) ] for c in range(8) ], dtype = numpy.uint8)
+		image = numpy.zeros((MODE7_HEIGHT * ch, MODE7_WIDTH * cw, 3), dtype = numpy.uint8)
+		sixel_rows = [ (0, 6), (6, 14), (14, 20) ]
+
+		for y in range(MODE7_HEIGHT):
+			for x, cell in enumerate(self.cells(y)):
+				block = numpy.zeros((ch, cw), dtype = bool)
+				c = cell.char
+				if c != MODE7_BLANK and not cell.conceal:
+					if cell.graphics and is_sixel(c):
+						sixels = (c & 31) | ((c & 64) >> 1)
+						for s in range(6):
+							if sixels & (1 << s):
+								top, bottom = sixel_rows[s >> 1]
+								left, right = (s & 1) * 6, (s & 1) * 6 + 6
+								if cell.separated:
+									left += 2
+									bottom -= 2
+								block[top:bottom, left:right] = True
+					else:
+						block[4:16, 2:10] = True
+
+				if cell.double == 1:
+					block = numpy.repeat(block[:ch // 2], 2, axis = 0)
+				elif cell.double == 2:
+					block = numpy.repeat(block[ch // 2:], 2, axis = 0)
+
+				area = image[y * ch:(y + 1) * ch, x * cw:(x + 1) * cw]
+				area[:] = palette[cell.bg]
+				area[block] = palette[cell.fg]
+		return image
+
+
+def write_ppm(filename, image):
+	fh = open(filename, 'wb')
+	fh.write("P6\n" + str(image.shape[1]) + " " + str(image.shape[0]) + "\n255\n")
+	fh.write(image.tostring())
+	fh.close()
+
+
+# consecutive changes as (offset, bytes) runs
+def diff_runs(changes):
+	runs = []
+	for i, b in changes:
+		if len(runs) > 0 and runs[-1][0] + len(runs[-1][1]) == i:
+			runs[-1][1].append(b)
+		else:
+			runs.append((i, bytearray([b])))
+	return runs
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) < 2 or sys.argv[1][0] == '-':
+		print "teletext.py <page.bin> [<to_page.bin>] [-o <image.ppm>] [-visible]"
+		print "  checks a 1000 byte MODE 7 page, optionally rendering it, or diffs it against a second page"
+		print "  -o        render the page (the second page when diffing) to a PPM image"
+		print "  -visible  only count the changes that show on screen"
+		exit()
+
+	argv = sys.argv
+	source_filename = argv[1]
+	target_filename = None
+	if len(argv) > 2 and argv[2][0] != '-':
+		target_filename = argv[2]
+
+	option_image = None
+	option_visible = False
+
+	for i in range(2, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 'o':
+				option_image = argv[i+1]
+			elif option == 'visible':
+				option_visible = True
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	try:
+		pages = [ TeletextPage.from_file(source_filename) ]
+		if target_filename is not None:
+			pages.append(TeletextPage.from_file(target_filename))
+	except (FatalError, IOError) as e:
+		print "ERROR: " + str(e)
+		sys.exit(1)
+
+	problems = 0
+	for filename, page in zip([ source_filename, target_filename ], pages):
+		for offset, problem in page.validate():
+			print filename + " row " + str(offset // MODE7_WIDTH) + " column " + str(offset % MODE7_WIDTH) + ": " + problem
+			problems += 1
+
+	if len(pages) == 2:
+		changes = pages[0].diff(pages[1], option_visible)
+		runs = diff_runs(changes)
+		print "changed cells = " + str(len(changes)) + " in " + str(len(runs)) + " runs, " + str(len(set([ i // MODE7_WIDTH for i, b in changes ]))) + " rows"
+		print "as (offset, byte) pairs = " + str(3 * len(changes)) + " bytes, as runs = " + str(sum([ 3 + len(data) for offset, data in runs ])) + " bytes"
+
+	if option_image is not None:
+		try:
+			write_ppm(option_image, pages[-1].render())
+		except FatalError as e:
+			print "ERROR: " + str(e)
+			sys.exit(1)
+		print "rendered to '" + option_image + "'"
+
+	if problems > 0:
+		sys.exit(2)
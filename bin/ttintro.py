@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# python script to crunch the intro's teletext pages against each other
+# Released under MIT license
+#
+# The intro pages are shown one after another, each decrunched on its own from the streaming buffers
+# (see introz in m7vplay.6502). Pages share a lot - the same logos, borders & backgrounds - so here each page
+# is crunched with exoraw.py against the pages decrunched before it: if show_page leaves the decruncher's
+# circular buffer (the -m window) alone between pages it still holds the end of the previous page, and matches
+# can copy from it.
+#
+# Writes <page>.intro.exo for each page and a manifest listing the decode order - a page can only be
+# decrunched after the pages before it - with the bytes each page takes alone and against the history.
+# A page never comes out bigger than it does alone, as the cruncher is free to ignore the history.
+#
+# With -single all the pages are crunched as one stream instead (intro.exo), which also saves the 26 byte table
+# header of every page after the first. show_page then has to carry on with get_decrunched_byte from where the
+# previous page stopped rather than init the decruncher again. The manifest gives each page's offset in the
+# output and how much of the stream has been read by the end of it.
+
+
+import sys
+import os
+import json
+import time
+
+import exoraw
+from exoraw import FatalError
+
+
+#-----------------------------------------------------------------------------
+
+DEFAULT_WINDOW = 1024
+
+# the order introz shows them in
+INTRO_PAGES = [ "testcard", "bslogo", "balogo", "inversephase", "horsenburger", "blockparty", "frame" ]
+
+
+def read_file(filename):
+	fh = open(filename, 'rb')
+	data = fh.read()
+	fh.close()
+	return data
+
+
+def write_file(filename, data):
+	fh = open(filename, 'wb')
+	fh.write(data)
+	fh.close()
+
+
+def page_name(filename):
+	name = os.path.basename(filename)
+	for ext in [ ".bin", ".txt" ]:
+		if name.endswith(ext):
+			name = name[:-len(ext)]
+	return name
+
+
+# (name, page, page crunched alone) of each page, using the existing .exo when there is one
+def load_pages(filenames, window = DEFAULT_WINDOW):
+	pages = []
+	for filename in filenames:
+		page = read_file(filename)
+		if os.path.isfile(filename + ".exo"):
+			alone = read_file(filename + ".exo")
+		else:
+			alone = exoraw.crunch(page, window)
+		pages.append((page_name(filename), page, alone))
+	return pages
+
+
+# crunches each page against the window bytes of output before it, returns the manifest entries in decode order
+def crunch_pages(pages, window = DEFAULT_WINDOW):
+	entries = []
+	output = b''
+	for name, page, alone in pages:
+		history = output[-window:]
+		crunched = exoraw.crunch(page, window, history = history)
+		# a stream without matches into the history decrunches the same whatever the buffer holds,
+		# so the page alone (the .exo from ttpack if there is one) will do when it's smaller
+		for plain in [ exoraw.crunch(page, window), alone ]:
+			if len(plain) < len(crunched) and exoraw.decrunch(plain, window, history = history) == bytearray(page):
+				crunched = plain
+		if exoraw.decrunch(crunched, window, history = history) != bytearray(page):
+			raise FatalError("Page " + name + " doesn't decrunch back to itself")
+
+		entries.append({ 'order': len(entries), 'name': name, 'size': len(page), 'alone': len(alone), 'crunched': len(crunched), 'history': len(history), 'data': crunched })
+		output += page
+	return entries
+
+
+# crunches all the pages as one stream, returns (stream, manifest entries in decode order)
+def crunch_single(pages, window = DEFAULT_WINDOW):
+	data = b''.join([ page for name, page, alone in pages ])
+	stream = exoraw.crunch(data, window)
+	out, positions = exoraw.decrunch(stream, window, trace = True)
+	if out != bytearray(data):
+		raise FatalError("Stream doesn't decrunch back to the pages")
+
+	entries = []
+	offset = 0
+	previous_end = 0
+	for name, page, alone in pages:
+		offset += len(page)
+		end = exoraw.input_ends(positions, [offset])[0]
+		entries.append({ 'order': len(entries), 'name': name, 'size': len(page), 'alone': len(alone), 'offset': offset - len(page), 'stream_end': end, 'crunched': end - previous_end })
+		previous_end = end
+	# the end of stream marker
+	entries[-1]['crunched'] += len(stream) - previous_end
+	return stream, entries
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) > 1 and sys.argv[1] in [ '-h', '-help', '/?' ]:
+		print "ttintro.py [<page.bin> ...] [-pages <directory>] [-o <directory>] [-m <window>] [-manifest <file.json>] [-single]"
+		print "  <page.bin>  pages in the order they're shown (default the intro: " + ",".join(INTRO_PAGES) + ")"
+		print "  -pages      directory of the default pages (default data/pages)"
+		print "  -o          output directory for the .intro.exo files (default the first page's directory)"
+		print "  -m          decruncher buffer size (default " + str(DEFAULT_WINDOW) + ")"
+		print "  -manifest   decode order manifest (default <output directory>/intro.json)"
+		print "  -single     crunch the pages as one stream, intro.exo"
+		exit()
+
+	argv = sys.argv
+	option_files = []
+	option_pages = os.path.join("data", "pages")
+	option_output = None
+	option_window = DEFAULT_WINDOW
+	option_manifest = None
+	option_single = False
+
+	# options all take a value except -single, anything else is a page
+	i = 1
+	while i < len(argv):
+		arg = argv[i]
+		i += 1
+		if arg[0] != '-':
+			option_files.append(arg)
+			continue
+		option = arg[1:].lower()
+		if option == 'single':
+			option_single = True
+			continue
+		if option == 'pages':
+			option_pages = argv[i]
+		elif option == 'o':
+			option_output = argv[i]
+		elif option == 'm':
+			option_window = int(argv[i])
+		elif option == 'manifest':
+			option_manifest = argv[i]
+		else:
+			print "ERROR: Unrecognised option '" + arg + "'"
+			continue
+		i += 1
+
+	if len(option_files) == 0:
+		option_files = [ os.path.join(option_pages, name + ".txt.bin") for name in INTRO_PAGES ]
+	if option_output is None:
+		option_output = os.path.dirname(option_files[0]) or "."
+	if option_manifest is None:
+		option_manifest = os.path.join(option_output, "intro.json")
+
+	t0 = time.time()
+
+	try:
+		pages = load_pages(option_files, option_window)
+		if option_single:
+			stream, entries = crunch_single(pages, option_window)
+		else:
+			entries = crunch_pages(pages, option_window)
+	except (FatalError, IOError) as e:
+		print "ERROR: " + str(e)
+		sys.exit(1)
+
+	if option_single:
+		write_file(os.path.join(option_output, "intro.exo"), stream)
+		manifest = { 'window': option_window, 'file': "intro.exo", 'pages': entries }
+	else:
+		for entry in entries:
+			entry['file'] = entry['name'] + ".intro.exo"
+			write_file(os.path.join(option_output, entry['file']), entry['data'])
+			del entry['data']
+		manifest = { 'window': option_window, 'pages': entries }
+
+	fh = open(option_manifest, 'w')
+	json.dump(manifest, fh, indent = 1, sort_keys = True)
+	fh.close()
+
+	print "order  page                    alone  shared   saved"
+	for entry in entries:
+		print str(entry['order']).rjust(5) + "  " + entry['name'].ljust(20) + str(entry['alone']).rjust(8) + str(entry['crunched']).rjust(8) + str(entry['alone'] - entry['crunched']).rjust(8)
+
+	alone = sum([ entry['alone'] for entry in entries ])
+	shared = sum([ entry['crunched'] for entry in entries ])
+	print "total" + " " * 22 + str(alone).rjust(8) + str(shared).rjust(8) + str(alone - shared).rjust(8)
+	print "manifest written to '" + option_manifest + "' in " + ("%.1f" % (time.time() - t0)) + "s"
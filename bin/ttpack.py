@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+# python script to convert & crunch every teletext page in one go, replacing ttpack.bat / ttpackall.bat
+# Released under MIT license
+#
+# Pages come from either:
+# - a directory of .txt pages, 25 lines of 40 MODE 7 bytes with CR / LF line ends (as saved from a teletext editor),
+#   written to <page>.txt.bin and <page>.txt.bin.exo next to them like ttpack.bat did
+# - the edit.tf links in a markdown file like data/links.md, written to <title>.bin and <title>.bin.exo.
+#   The URL hash is <metadata>:<base64url of 25 x 40 7-bit characters, MSB first>, control codes 0-31 are
+#   stored as 128-159 in MODE 7 screen memory.
+#
+# Each 1000 byte page is crunched with exoraw.py (as exomizer raw -c -m 1024) and checked by decrunching.
+# A page is only crunched again when its .bin differs from the new page, its .exo is missing or was crunched
+# with another -m window (kept in <name>.bin.exo.m), so re-running after editing one page only costs that page.
+
+
+import sys
+import os
+import re
+import time
+
+import exoraw
+from exoraw import FatalError
+from teletext import TeletextPage, MODE7_WIDTH
+
+
+#-----------------------------------------------------------------------------
+
+PAGE_SIZE = 1000		# 25 x 40
+DEFAULT_WINDOW = 1024
+
+BASE64URL = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+
+# [title](http://edit.tf/#<metadata>:<page>)
+EDITTF_LINK = re.compile(r'\[([^\]]*)\]\((https?://edit\.tf/#([0-9A-Fa-f]*):([A-Za-z0-9_\-]+))\)')
+
+# the line ends are the only bytes dropped, everything else is screen memory
+TEXT_DELETE = "\r\n"
+
+# 7-bit teletext to MODE 7, control codes move up to 128-159 (translate wants all 256)
+TELETEXT_TO_MODE7 = "".join([ chr(c + 128) if c < 32 else chr(c) for c in range(256) ])
+
+
+def text_to_page(text):
+	return text.translate(None, TEXT_DELETE)
+
+
+def edittf_to_page(encoded):
+	bits = 0
+	count = 0
+	chars = []
+	for c in encoded:
+		value = BASE64URL.find(c)
+		if value < 0:
+			raise FatalError("Bad character '" + c + "' in edit.tf page data")
+		bits = (bits << 6) | value
+		count += 6
+		if count >= 7:
+			count -= 7
+			chars.append(chr((bits >> count) & 127))
+			bits &= (1 << count) - 1
+	if len(chars) < PAGE_SIZE:
+		raise FatalError("edit.tf page data is only " + str(len(chars)) + " characters")
+	return "".join(chars[:PAGE_SIZE]).translate(TELETEXT_TO_MODE7)
+
+
+def title_to_name(title):
+	return "_".join(re.findall(r'[a-z0-9]+', title.lower()))
+
+
+# (name, page) for every .txt in a directory, written as <name>.bin
+def directory_pages(directory):
+	pages = []
+	for filename in sorted(os.listdir(directory)):
+		if os.path.splitext(filename)[1].lower() != ".txt":
+			continue
+		fh = open(os.path.join(directory, filename), 'rb')
+		pages.append((filename, text_to_page(fh.read())))
+		fh.close()
+	return pages
+
+
+# (name, page) for every edit.tf link in a markdown file
+def links_pages(filename):
+	fh = open(filename, 'r')
+	text = fh.read()
+	fh.close()
+
+	pages = []
+	names = set()
+	for title, url, metadata, encoded in EDITTF_LINK.findall(text):
+		name = title_to_name(title)
+		if name in names:
+			raise FatalError("Two links are both called '" + title + "'")
+		names.add(name)
+		pages.append((name, edittf_to_page(encoded)))
+	return pages
+
+
+def read_file(filename):
+	if not os.path.isfile(filename):
+		return None
+	fh = open(filename, 'rb')
+	data = fh.read()
+	fh.close()
+	return data
+
+
+def write_file(filename, data):
+	fh = open(filename, 'wb')
+	fh.write(data)
+	fh.close()
+
+
+# writes <name>.bin, <name>.bin.exo & the window it was crunched with to <name>.bin.exo.m for each page, returns (name, page size, crunched size or None if unchanged)
+def pack_pages(pages, output_dir, window = DEFAULT_WINDOW, force = False):
+	results = []
+	for name, page in pages:
+		bin_filename = os.path.join(output_dir, name + ".bin")
+		exo_filename = bin_filename + ".exo"
+		window_filename = exo_filename + ".m"
+
+		if not force and read_file(bin_filename) == page and os.path.isfile(exo_filename) and read_file(window_filename) == str(window):
+			results.append((name, len(page), None))
+			continue
+
+		w, crunched, seconds = exoraw.crunch_and_check((page, window, 4, 64))
+		write_file(bin_filename, page)
+		write_file(exo_filename, crunched)
+		write_file(window_filename, str(window))
+		results.append((name, len(page), len(crunched)))
+	return results
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) > 1 and sys.argv[1] in [ '-h', '-help', '/?' ]:
+		print "ttpack.py [<directory>] [-links <links.md>] [-o <directory>] [-m <window>] [-f]"
+		print "  <directory>  pack every .txt page in this directory (default the current directory)"
+		print "  -links       pack the edit.tf links in this markdown file instead"
+		print "  -o           output directory (default the page directory, or the current directory for -links)"
+		print "  -m           decruncher buffer size (default " + str(DEFAULT_WINDOW) + ")"
+		print "  -f           crunch every page even if it hasn't changed"
+		exit()
+
+	argv = sys.argv
+	option_directory = "."
+	option_links = None
+	option_output = None
+	option_window = DEFAULT_WINDOW
+	option_force = False
+
+	if len(argv) > 1 and argv[1][0] != '-':
+		option_directory = argv[1]
+
+	for i in range(1, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 'links':
+				option_links = argv[i+1]
+			elif option == 'o':
+				option_output = argv[i+1]
+			elif option == 'm':
+				option_window = int(argv[i+1])
+			elif option == 'f':
+				option_force = True
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	if option_output is None:
+		if option_links is not None:
+			option_output = "."
+		else:
+			option_output = option_directory
+	if not os.path.isdir(option_output):
+		os.makedirs(option_output)
+
+	t0 = time.time()
+
+	try:
+		if option_links is not None:
+			pages = links_pages(option_links)
+		else:
+			pages = directory_pages(option_directory)
+		results = pack_pages(pages, option_output, option_window, option_force)
+	except (FatalError, IOError) as e:
+		print "ERROR: " + str(e)
+		sys.exit(1)
+
+	crunched = 0
+	for (page_name, page), (name, size, exo_size) in zip(pages, results):
+		line = name.ljust(50) + str(size).rjust(6) + " bytes"
+		if exo_size is None:
+			line += "  unchanged"
+		else:
+			line += " -> " + str(exo_size).rjust(4) + " bytes"
+			crunched += 1
+		if size != PAGE_SIZE:
+			line += "  WARNING: not " + str(PAGE_SIZE) + " bytes"
+		print line
+		if size == PAGE_SIZE:
+			for offset, problem in TeletextPage(page).validate():
+				print "  WARNING: row " + str(offset // MODE7_WIDTH) + " column " + str(offset % MODE7_WIDTH) + ": " + problem
+
+	print str(len(results)) + " pages, " + str(crunched) + " crunched in " + ("%.1f" % (time.time() - t0)) + "s"
@@ -0,0 +1,288 @@
+#!/usr/bin/env python
+# python script to benchmark the vgmconverter.py processing passes on synthetic VGMs
+# Released under MIT license
+#
+# Generates SN76489 VGMs of a given length and write density, then times each VgmStream pass in the order
+# vgmconverter.py runs them and records the peak memory of the process after each one.
+# Every case runs in a fresh worker process (so the peak memory is its own) in a scratch directory
+# (compress_packets writes its debug files to the current directory), with the passes' output discarded.
+#
+# Results can be saved as a JSON baseline and later runs compared against it, exiting with 1 if any pass got
+# slower than the tolerance allows.
+
+
+import sys
+import os
+import struct
+import random
+import json
+import time
+import timeit
+import tempfile
+import shutil
+import platform
+import multiprocessing
+
+try:
+	import resource
+except ImportError:
+	# not on Windows, peak memory isn't recorded
+	resource = None
+
+from vgmconverter import VgmStream
+
+
+#-----------------------------------------------------------------------------
+
+VGM_FREQUENCY = 44100
+FRAME_SAMPLES = 882				# 50Hz
+SOURCE_CLOCK = 3579545			# NTSC, so transpose has work to do
+
+PASSES = [ "parse", "truncate_loop", "optimize", "optimize2", "transpose", "quantize", "write_binary", "compress_packets" ]
+
+DEFAULT_LENGTHS = [10, 60, 600]
+DEFAULT_DENSITY = 0.25
+
+# allowed slow down before a pass counts as a regression, and the noise floor below which times aren't compared
+DEFAULT_TOLERANCE = 1.5
+MIN_SECONDS = 0.05
+
+
+def utf16z(s):
+	return s.encode('utf_16_le') + b'\x00\x00'
+
+
+# VGM 1.51 of length seconds at 50Hz, density = chance of a new note on each tone channel each frame,
+# vibrato retunes every channel every frame on top
+def generate_vgm(filename, seconds, density = DEFAULT_DENSITY, vibrato = False, seed = 1):
+	rng = random.Random(seed)
+	frames = seconds * VGM_FREQUENCY // FRAME_SAMPLES
+
+	data = bytearray()
+	tones = [ 0x100, 0x180, 0x200 ]
+	volumes = [ 15, 15, 15, 15 ]
+
+	def write(b):
+		data.extend(b'\x50')
+		data.append(b)
+
+	def write_tone(channel, period):
+		write(0x80 | (channel << 5) | (period & 15))
+		write((period >> 4) & 0x3F)
+
+	def write_volume(channel, volume):
+		write(0x90 | (channel << 5) | volume)
+
+	for frame in range(frames):
+		for channel in range(3):
+			if rng.random() < density:
+				tones[channel] = rng.randint(0x40, 0x3FF)
+				volumes[channel] = rng.randint(0, 4)
+				write_tone(channel, tones[channel])
+				write_volume(channel, volumes[channel])
+			elif vibrato:
+				write_tone(channel, max(1, tones[channel] + rng.randint(-3, 3)))
+			if frame & 1 and volumes[channel] < 15:
+				volumes[channel] += 1
+				write_volume(channel, volumes[channel])
+
+		if rng.random() < density / 4:
+			# periodic or white noise, sometimes at tone 2's rate
+			write(0xE0 | rng.randint(0, 7))
+			volumes[3] = rng.randint(0, 6)
+			write_volume(3, volumes[3])
+		elif volumes[3] < 15:
+			volumes[3] += 1
+			write_volume(3, volumes[3])
+
+		data.extend(b'\x63')
+	data.extend(b'\x66')
+
+	gd3 = bytearray()
+	for field in [ "bench", "", "vgmbench", "", "", "", "vgmbench", "", "", "", "" ]:
+		gd3.extend(utf16z(field))
+	gd3_block = bytearray(b'Gd3 ') + struct.pack('<II', 0x100, len(gd3)) + gd3
+
+	header = bytearray(64)
+	header[0:4] = b'Vgm '
+	struct.pack_into('<I', header, 0x04, 64 + len(data) + len(gd3_block) - 4)
+	struct.pack_into('<I', header, 0x08, 0x00000151)
+	struct.pack_into('<I', header, 0x0C, SOURCE_CLOCK)
+	struct.pack_into('<I', header, 0x14, 64 + len(data) - 0x14)
+	struct.pack_into('<I', header, 0x18, frames * FRAME_SAMPLES)
+	struct.pack_into('<I', header, 0x24, 50)
+	struct.pack_into('<H', header, 0x28, 0x0009)
+	struct.pack_into('B', header, 0x2A, 16)
+	struct.pack_into('<I', header, 0x34, 64 - 0x34)
+
+	fh = open(filename, 'wb')
+	fh.write(header + data + gd3_block)
+	fh.close()
+
+
+def peak_kb():
+	if resource is None:
+		return None
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+# runs in a fresh worker process
+def run_case(case):
+	name, seconds, density, vibrato = case
+	scratch = tempfile.mkdtemp(prefix = "vgmbench")
+	stdout = sys.stdout
+	cwd = os.getcwd()
+	try:
+		os.chdir(scratch)
+		vgm_filename = os.path.join(scratch, "bench.vgm")
+		generate_vgm(vgm_filename, seconds, density, vibrato)
+		vgm_size = os.path.getsize(vgm_filename)
+
+		sys.stdout = open(os.devnull, 'w')
+		results = {}
+		timer = timeit.default_timer
+		vgm_stream = None
+		for p in PASSES:
+			t0 = timer()
+			if p == "parse":
+				vgm_stream = VgmStream(vgm_filename)
+				commands = len(vgm_stream.command_list)
+			elif p == "truncate_loop":
+				vgm_stream.truncate_loop()
+			elif p == "optimize":
+				vgm_stream.optimize()
+			elif p == "optimize2":
+				vgm_stream.optimize2()
+			elif p == "transpose":
+				vgm_stream.transpose("bbc")
+			elif p == "quantize":
+				vgm_stream.quantize(50)
+			elif p == "write_binary":
+				vgm_stream.write_binary(os.path.join(scratch, "bench.raw"))
+			elif p == "compress_packets":
+				vgm_stream.compress_packets()
+			results[p] = { 'seconds': timer() - t0, 'peak_kb': peak_kb() }
+	finally:
+		if sys.stdout is not stdout:
+			sys.stdout.close()
+			sys.stdout = stdout
+		os.chdir(cwd)
+		shutil.rmtree(scratch, True)
+
+	return { 'name': name, 'seconds': seconds, 'density': density, 'vibrato': vibrato, 'vgm_bytes': vgm_size, 'commands': commands, 'passes': results }
+
+
+def run_cases(cases):
+	results = []
+	for case in cases:
+		# a new process per case so each gets its own peak memory
+		pool = multiprocessing.Pool(1, maxtasksperchild = 1)
+		try:
+			result = pool.apply(run_case, (case,))
+		finally:
+			pool.close()
+			pool.join()
+		print_result(result)
+		results.append(result)
+	return results
+
+
+def print_result(result):
+	print result['name'] + ": " + str(result['vgm_bytes']) + " bytes, " + str(result['commands']) + " commands"
+	for p in PASSES:
+		r = result['passes'][p]
+		line = "  " + p.ljust(18) + ("%9.3f" % r['seconds']) + "s"
+		if r['peak_kb'] is not None:
+			line += ("%9.1f" % (r['peak_kb'] / 1024.0)) + " MB peak"
+		print line
+
+
+# list of regressions against a baseline, matching cases by name
+def compare(results, baseline, tolerance = DEFAULT_TOLERANCE):
+	previous = {}
+	for result in baseline['cases']:
+		previous[result['name']] = result
+
+	regressions = []
+	for result in results:
+		old = previous.get(result['name'])
+		if old is None:
+			continue
+		for p in PASSES:
+			if p not in old['passes']:
+				continue
+			t = result['passes'][p]['seconds']
+			t_old = old['passes'][p]['seconds']
+			if t > MIN_SECONDS and t > t_old * tolerance:
+				regressions.append((result['name'], p, t_old, t))
+	return regressions
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) > 1 and sys.argv[1] in [ '-h', '-help', '/?' ]:
+		print "vgmbench.py [-l <seconds>[,<seconds>...]] [-density <n>] [-novibrato] [-o <baseline.json>] [-compare <baseline.json>] [-tolerance <n>]"
+		print "  -l          lengths of the synthetic VGMs in seconds (default " + ",".join([ str(l) for l in DEFAULT_LENGTHS ]) + ")"
+		print "  -density    chance of a new note per channel per frame (default " + str(DEFAULT_DENSITY) + ")"
+		print "  -novibrato  skip the dense vibrato cases"
+		print "  -o          write the results as a JSON baseline"
+		print "  -compare    compare with a JSON baseline, exit 1 if a pass is slower than the tolerance"
+		print "  -tolerance  allowed slow down against the baseline (default " + str(DEFAULT_TOLERANCE) + ")"
+		exit()
+
+	argv = sys.argv
+	option_lengths = DEFAULT_LENGTHS
+	option_density = DEFAULT_DENSITY
+	option_vibrato = True
+	option_output = None
+	option_compare = None
+	option_tolerance = DEFAULT_TOLERANCE
+
+	for i in range(1, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 'l':
+				option_lengths = [ int(l) for l in argv[i+1].split(',') ]
+			elif option == 'density':
+				option_density = float(argv[i+1])
+			elif option == 'novibrato':
+				option_vibrato = False
+			elif option == 'o':
+				option_output = argv[i+1]
+			elif option == 'compare':
+				option_compare = argv[i+1]
+			elif option == 'tolerance':
+				option_tolerance = float(argv[i+1])
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	cases = []
+	for seconds in option_lengths:
+		cases.append((str(seconds) + "s", seconds, option_density, False))
+		if option_vibrato:
+			cases.append((str(seconds) + "s vibrato", seconds, option_density, True))
+
+	results = run_cases(cases)
+
+	if option_output is not None:
+		baseline = { 'created': time.strftime("%Y-%m-%d %H:%M:%S"), 'python': platform.python_version(), 'platform': platform.platform(), 'cases': results }
+		fh = open(option_output, 'w')
+		json.dump(baseline, fh, indent = 1, sort_keys = True)
+		fh.close()
+		print "baseline written to '" + option_output + "'"
+
+	if option_compare is not None:
+		fh = open(option_compare, 'r')
+		baseline = json.load(fh)
+		fh.close()
+
+		regressions = compare(results, baseline, option_tolerance)
+		if len(regressions) > 0:
+			print "regressions against '" + option_compare + "':"
+			for name, p, t_old, t in regressions:
+				print "  " + name + " " + p + ": " + ("%.3f" % t_old) + "s -> " + ("%.3f" % t) + "s"
+			sys.exit(1)
+		print "no regressions against '" + option_compare + "'"
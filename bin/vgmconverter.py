@@ -27,6 +27,12 @@ import struct
 import sys
 import binascii
 import math
+import os
+import timeit
+import functools
+import logging
+import zlib
+import copy
 from os.path import basename
 
 if (sys.version_info > (3, 0)):
@@ -34,6 +40,12 @@ if (sys.version_info > (3, 0)):
 else:
 	from StringIO import StringIO as ByteBuffer
 
+try:
+	import resource
+except ImportError:
+	# not on Windows, peak memory isn't recorded
+	resource = None
+
 
 
 #-----------------------------------------------------------------------------
@@ -43,6 +55,78 @@ class FatalError(Exception):
 	pass
 
 
+# per-command debug messages, the hot loops check the level once before the loop and only
+# format a message when it's enabled
+log = logging.getLogger("vgmconverter")
+
+def set_log_level(level):
+	if len(log.handlers) == 0:
+		handler = logging.StreamHandler(sys.stdout)
+		handler.setFormatter(logging.Formatter("%(message)s"))
+		log.addHandler(handler)
+		log.propagate = False
+	log.setLevel(level)
+
+
+# times a VgmStream pass and records how the command list changed in vgm_stream.stats
+# (the debug log is inside the passes so leave -verbose off when timing)
+def timed_pass(name):
+	def decorator(method):
+		@functools.wraps(method)
+		def wrapper(self, *args, **kwargs):
+			commands_in = len(self.command_list)
+			writes_in = self.count_writes()
+			t0 = timeit.default_timer()
+			result = method(self, *args, **kwargs)
+			seconds = timeit.default_timer() - t0
+			self.record_pass(name, seconds, commands_in, writes_in, args)
+			return result
+		return wrapper
+	return decorator
+
+
+
+# a table of envelopes, each holding its last value once it ends, where a new sequence of values reuses any
+# envelope it's the start of. The envelopes are kept in a trie of their values to find them quickly.
+class EnvelopeTable:
+
+	def __init__(self):
+		self.envelopes = []
+		self.root = {}
+
+	# index of an envelope that plays values, adding one if there isn't one
+	def find(self, values):
+		# the same without the repeats of the last value at the end
+		length = len(values)
+		while length > 1 and values[length - 1] == values[length - 2]:
+			length -= 1
+
+		node = self.root
+		for value in values[:length]:
+			node = node.get(value)
+			if node == None:
+				return self.add(values[:length])
+
+		# any envelope that goes on holding the last value for the rest of them, or ends holding it
+		last = values[length - 1]
+		for i in range(length, len(values)):
+			if 'end' in node:
+				return node['end']
+			node = node.get(last)
+			if node == None:
+				return self.add(values[:length])
+		return node.get('end', node['id'])
+
+
+	def add(self, values):
+		index = len(self.envelopes)
+		self.envelopes.append(list(values))
+		node = self.root
+		for value in values:
+			node = node.setdefault(value, { 'id': index })
+		node.setdefault('end', index)
+		return index
+
 
 
 class VgmStream:
@@ -106,6 +190,7 @@ class VgmStream:
 	vgm_filename = ''
 	vgm_loop_offset = 0
 	vgm_loop_length = 0
+	vgm_loop_sample = None	# sample time the loop starts at, None if the tune doesn't loop
 	
 	# Supported VGM versions
 	supported_ver_list = [
@@ -308,6 +393,7 @@ class VgmStream:
 	def __init__(self, vgm_filename):
 
 		self.vgm_filename = vgm_filename
+		self.stats = { 'passes': [], 'commands_read': 0, 'commands_written': 0, 'writes_dropped': 0, 'bytes_written': 0 }
 		print "  VGM file loaded : '" + vgm_filename + "'"
 		
 		# open the vgm file and parse it
@@ -377,6 +463,8 @@ class VgmStream:
 		self.parse_commands()
 		
 		print "   VGM Commands # : " + str(len(self.command_list))
+		if self.vgm_loop_sample != None:
+			print "  VGM Loop Sample : " + str(self.vgm_loop_sample)
 		print ""
 
 
@@ -524,6 +612,7 @@ class VgmStream:
 
 	#-------------------------------------------------------------------------------------------------
 
+	@timed_pass("parse")
 	def parse_commands(self):
 		# Save the current position of the VGM data
 		original_pos = self.data.tell()
@@ -534,7 +623,16 @@ class VgmStream:
 			self.metadata_offsets[self.metadata['version']]['vgm_data_offset']['offset']
 		)
 
+		# the loop offset is relative to its own field and points at the first command of the loop
+		loop_position = None
+		loop_index = None
+		if self.vgm_loop_offset != 0 and self.vgm_loop_length != 0:
+			loop_position = self.metadata_offsets[self.metadata['version']]['loop_offset']['offset'] + self.vgm_loop_offset
+
 		while True:
+			if self.data.tell() == loop_position:
+				loop_index = len(self.command_list)
+
 			# Read a byte, this will be a VGM command, we will then make
 			# decisions based on the given command
 			command = self.data.read(1)
@@ -615,28 +713,44 @@ class VgmStream:
 
 		# Seek back to the original position in the VGM data
 		self.data.seek(original_pos)
+
+		# the passes all keep the timing, so the loop is carried through them as a sample time
+		if loop_index != None:
+			self.vgm_loop_sample = sum([ self.wait_samples(c['command'], c['data']) for c in self.command_list[:loop_index] ])
+		elif loop_position != None:
+			print "WARNING: loop offset " + str(self.vgm_loop_offset) + " isn't the start of a command, ignoring the loop"
 		
 		
 	#-------------------------------------------------------------------------------------------------
 
 			
 			
+	@timed_pass("write_vgm")
 	def write_vgm(self, filename):
 			
 		print "   VGM Processing : Writing output VGM file '" + filename + "'"
 		vgm_stream = bytearray()
+		debug = log.isEnabledFor(logging.DEBUG)
+
+		vgm_time = 0
+		loop_position = None
 
 		# convert the VGM command list to a byte array
 		for elem in self.command_list:
 			command = elem['command']
 			data = elem['data']
+
+			# the loop starts at the first command once the wait up to it is done
+			if self.vgm_loop_sample != None and loop_position == None and vgm_time >= self.vgm_loop_sample and command != b'\x66':
+				loop_position = len(vgm_stream)
+			vgm_time += self.wait_samples(command, data)
 			
 			if (data != None):
-				if self.VERBOSE: print "command=" + str(binascii.hexlify(command)) + ", data=" + str(binascii.hexlify(data))
+				if debug: log.debug("command=%s, data=%s", binascii.hexlify(command), binascii.hexlify(data))
 				
 			# filter dual chip
 			if b'\x30' == command:
-				if self.VERBOSE: print "DUAL CHIP COMMAND"
+				if debug: log.debug("DUAL CHIP COMMAND")
 				#continue
 				#command = b'\x50'
 
@@ -676,6 +790,14 @@ class VgmStream:
 		else:
 			print "   VGM Processing : GD3 tag was stripped"
 		
+		# loop offset is relative to its own field at 0x1c, the data starts at 0x40
+		loop_offset = 0
+		loop_samples = 0
+		if loop_position != None:
+			loop_offset = 0x40 + loop_position - 0x1c
+			loop_samples = self.metadata['total_samples'] - self.vgm_loop_sample
+			print "   VGM Processing : Loop at offset " + str(loop_offset) + ", " + str(loop_samples) + " samples long"
+
 		# build the full VGM output stream		
 		vgm_data = bytearray()
 		vgm_data.extend(self.vgm_magic_number)
@@ -685,8 +807,8 @@ class VgmStream:
 		vgm_data.extend(struct.pack('I', self.metadata['ym2413_clock']))
 		vgm_data.extend(struct.pack('I', gd3_offset))				# GD3 offset
 		vgm_data.extend(struct.pack('I', self.metadata['total_samples']))				# total samples
-		vgm_data.extend(struct.pack('I', 0)) #self.metadata['loop_offset']))				# loop offset
-		vgm_data.extend(struct.pack('I', 0)) #self.metadata['loop_samples']))				# loop # samples
+		vgm_data.extend(struct.pack('I', loop_offset))				# loop offset
+		vgm_data.extend(struct.pack('I', loop_samples))				# loop # samples
 		vgm_data.extend(struct.pack('I', self.metadata['rate']))				# rate
 		vgm_data.extend(struct.pack('H', self.metadata['sn76489_feedback']))				# sn fb
 		vgm_data.extend(struct.pack('B', self.metadata['sn76489_shift_register_width']))				# SNW	
@@ -737,9 +859,52 @@ class VgmStream:
 	
 
 
+	#-------------------------------------------------------------------------------------------------
+	# instrumentation
+
+	# 0x50 register writes in the command list, the waits come and go as the passes merge them
+	def count_writes(self):
+		return sum([ 1 for c in self.command_list if c['command'] == struct.pack('B', 0x50) ])
+
+	def record_pass(self, name, seconds, commands_in, writes_in, args):
+		commands_out = len(self.command_list)
+		writes_out = self.count_writes()
+		record = { 'pass': name, 'seconds': seconds, 'commands_in': commands_in, 'commands_out': commands_out }
+
+		if name == "parse":
+			self.stats['commands_read'] += commands_out
+		elif name.startswith("write_"):
+			# every output (-r, -o, ...) writes the same commands
+			self.stats['commands_written'] = commands_out
+			if len(args) > 0 and os.path.isfile(args[0]):
+				record['bytes'] = os.path.getsize(args[0])
+				self.stats['bytes_written'] += record['bytes']
+		elif writes_out < writes_in:
+			self.stats['writes_dropped'] += writes_in - writes_out
+
+		if resource is not None:
+			record['peak_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+		self.stats['passes'].append(record)
+
+
+	def print_stats(self):
+		print "   VGM Processing : Pass timings"
+		for record in self.stats['passes']:
+			line = "    " + record['pass'].ljust(18) + ("%9.3f" % record['seconds']) + "s " + str(record['commands_in']).rjust(8) + " -> " + str(record['commands_out']).ljust(8) + " commands"
+			if 'peak_kb' in record:
+				line += ("%8.1f" % (record['peak_kb'] / 1024.0)) + " MB peak"
+			print line
+		print "    commands read " + str(self.stats['commands_read']) + ", written " + str(self.stats['commands_written']) + " (" + str(self.stats['bytes_written']) + " bytes), register writes dropped " + str(self.stats['writes_dropped'])
+
+
 	#-------------------------------------------------------------------------------------------------
 	def set_verbose(self, verbose):
 		self.VERBOSE = verbose
+		if verbose:
+			set_log_level(logging.DEBUG)
+		else:
+			set_log_level(logging.INFO)
 		
 	#-------------------------------------------------------------------------------------------------
 		
@@ -756,9 +921,90 @@ class VgmStream:
 		else:
 			return -1
 	
+	# helper function
+	# the number of samples a command waits for, 0 for anything but a wait
+	def wait_samples(self, command, data):
+		if b'\x70' <= command <= b'\x8f':
+			n = ord(command) & 15
+			if command <= b'\x7f':
+				n += 1
+			return n
+		if command == b'\x61':
+			return struct.unpack('<H', data)[0]
+		if command == b'\x62':
+			return 735
+		if command == b'\x63':
+			return 882
+		return 0
+
+	# helper function
+	# the wait commands for a wait of t samples (up to 65535), 1/50 or 1/60 of a second and twice that use the single byte waits
+	def wait_commands(self, t):
+		debug = log.isEnabledFor(logging.DEBUG)
+		if t == 882: # 50Hz
+			if debug: log.debug("Outputting WAIT50")
+			return [ { 'command' : b'\x63', 'data' : None } ]
+		if t == 882*2: # 25Hz
+			if debug: log.debug("Outputting 2x WAIT50 ")
+			return [ { 'command' : b'\x63', 'data' : None }, { 'command' : b'\x63', 'data' : None } ]
+		if t == 735: # 60Hz
+			if debug: log.debug("Outputting WAIT60")
+			return [ { 'command' : b'\x62', 'data' : None } ]
+		if t == 735*2: # 30Hz
+			if debug: log.debug("Outputting WAIT60 x 2")
+			return [ { 'command' : b'\x62', 'data' : None }, { 'command' : b'\x62', 'data' : None } ]
+		# else emit the full 16-bit wait command (3 bytes)
+		if debug: log.debug("Outputting WAIT %d", t)
+		return [ { 'command' : b'\x61', 'data' : struct.pack('H', t) } ]
+
+	#-------------------------------------------------------------------------------------------------
+
+	# drop everything after the end of the first loop, the player jumps back to the loop start there
+	# so nothing after it is ever heard, and a tune stored unrolled just repeats the loop
+	@timed_pass("truncate_loop")
+	def truncate_loop(self):
+		if self.vgm_loop_sample == None:
+			return
+
+		loop_end = self.vgm_loop_sample + self.vgm_loop_length
+		total_samples = int(self.metadata['total_samples'])
+		if total_samples <= loop_end:
+			return
+
+		print "   VGM Processing : Truncating VGM at the loop end " + str(loop_end)
+
+		truncated_command_list = []
+		vgm_time = 0
+		for i in range(len(self.command_list)):
+			command = self.command_list[i]["command"]
+			data = self.command_list[i]["data"]
+
+			# waits are cut short at the loop end, any write from then on is the loop again
+			t = self.wait_samples(command, data)
+			if vgm_time + t > loop_end:
+				if vgm_time < loop_end:
+					truncated_command_list.append( { 'command' : b'\x61', 'data' : struct.pack('<H', loop_end - vgm_time) } )
+				break
+			if command == b'\x66' or (t == 0 and vgm_time >= loop_end):
+				break
+
+			truncated_command_list.append( { 'command' : command, 'data' : data } )
+			vgm_time += t
+
+		truncated_command_list.append( { 'command' : b'\x66', 'data' : None } )
+
+		command_bytes = lambda command_list: sum([ 1 + len(c['data'] or '') for c in command_list ])
+		removed_bytes = command_bytes(self.command_list) - command_bytes(truncated_command_list)
+		print "- Removed " + str(len(self.command_list) - len(truncated_command_list)) + " commands after the loop, saving " + str(removed_bytes) + " bytes of VGM data"
+		print "- Removed " + str(total_samples - loop_end) + " samples (" + str((total_samples - loop_end) / self.VGM_FREQUENCY) + " seconds)"
+
+		self.command_list = truncated_command_list
+		self.metadata['total_samples'] = loop_end
+
 	#-------------------------------------------------------------------------------------------------
 	
 	# iterate through the command list, removing any write commands that are destined for filter_channel_id
+	@timed_pass("filter_channel")
 	def filter_channel(self, filter_channel_id):
 		print "   VGM Processing : Filtering channel " + str(filter_channel_id)
 	
@@ -790,10 +1036,12 @@ class VgmStream:
 	# Process the tone frequencies in the VGM for the given clock_type ('ntsc', 'pal' or 'bbc')
 	# such that the output VGM plays at the same pitch as the original, but using the target clock speeds.
 	# Tuned periodic and white noise are also transposed.
+	@timed_pass("transpose")
 	def transpose(self, clock_type):
 		
 		# setup the correct target chip parameters
 		self.set_target_clock(clock_type)
+		debug = log.isEnabledFor(logging.DEBUG)
 		
 		# total number of commands in the vgm stream
 		num_commands = len(self.command_list)
@@ -823,7 +1071,7 @@ class VgmStream:
 				# first check it is not 0 (illegal value)
 				output_freq = 0
 				if tone_frequency == 0:
-					if self.VERBOSE: print "Zero frequency tone detected on channel "# + str(latched_channel)
+					if debug: log.debug("Zero frequency tone detected on channel %d", latched_channel)
 				else:
 				
 					# compute correct hz frequency of current tone from formula:
@@ -836,17 +1084,17 @@ class VgmStream:
 						#print "Periodic noise"
 						noise_ratio = (15.0 / 16.0) * (float(self.vgm_source_clock) / float(self.vgm_target_clock))
 						v = float(tone_frequency) / noise_ratio
-						if self.VERBOSE: print "noise_ratio=" + str(noise_ratio)
-						if self.VERBOSE: print "original freq=" + str(tone_frequency) + ", new freq=" + str(v)
-						if self.VERBOSE: print "retuned periodic noise effect on channel 2"										
+						if debug: log.debug("noise_ratio=%s", noise_ratio)
+						if debug: log.debug("original freq=%s, new freq=%s", tone_frequency, v)
+						if debug: log.debug("retuned periodic noise effect on channel 2")										
 
 					else:
 						#print "Tone"				
 						# compute corrected tone register value for generating the same frequency using the target chip's clock rate
 						hz = float(self.vgm_source_clock) / ( 2.0 * float(tone_frequency) * 16.0)
-						if self.VERBOSE: print "hz=" + str(hz)
+						if debug: log.debug("hz=%s", hz)
 						v = float(self.vgm_target_clock) / (2.0 * hz * 16.0 )
-						if self.VERBOSE: print "v=" + str(v)
+						if debug: log.debug("v=%s", v)
 					
 					# due to the integer maths, some precision is lost at the lower end
 					output_freq = int(round(v))	# using round minimizes error margin at lower precision
@@ -858,7 +1106,7 @@ class VgmStream:
 					
 					hz1 = float(self.vgm_source_clock) / (2.0 * float(tone_frequency) * 16.0) # target frequency
 					hz2 = float(self.vgm_target_clock) / (2.0 * float(output_freq) * 16.0)
-					if self.VERBOSE: print "channel=" + str(latched_channel) + ", old frequency=" + str(tone_frequency) + ", new frequency=" + str(output_freq) + ", source_clock=" + str(self.vgm_source_clock) + ", target_clock=" + str(self.vgm_target_clock) + ", src_hz=" + str(hz1) + ", tgt_hz=" + str(hz2)
+					if debug: log.debug("channel=%s, old frequency=%s, new frequency=%s, source_clock=%s, target_clock=%s, src_hz=%s, tgt_hz=%s", latched_channel, tone_frequency, output_freq, self.vgm_source_clock, self.vgm_target_clock, hz1, hz2)
 				
 				return output_freq		
 
@@ -1029,14 +1277,15 @@ class VgmStream:
 								hi_data = (new_freq>>4) & 0b00111111
 								self.command_list[nindex]["data"] = struct.pack('B', hi_data)	
 							else:
-								if self.VERBOSE: print "SINGLE REGISTER TONE WRITE on CHANNEL " + str(latched_channel)
+								if debug: log.debug("SINGLE REGISTER TONE WRITE on CHANNEL %s", latched_channel)
 
-							if self.VERBOSE: print "new_freq=" + format(new_freq, 'x') + ", lo_data=" + format(lo_data, '02x') + ", hi_data=" + format(hi_data, '02x')
+							if debug: log.debug("new_freq=%x, lo_data=%02x, hi_data=%02x", new_freq, lo_data, hi_data)
 		else:
 			print "transpose() - No transposing necessary as target clock matches source clock"
 			
 	#-------------------------------------------------------------------------------------------------
 	# iterate through the command list, removing any duplicate volume or tone writes
+	@timed_pass("optimize")
 	def optimize(self):
 
 		print "   VGM Processing : Optimizing VGM Stream "
@@ -1056,6 +1305,9 @@ class VgmStream:
 		skip_next_data_write = False
 		
 		first_command = True
+
+		vgm_time = 0
+		loop_reached = False
 		
 		for i in range(num_commands):
 			
@@ -1068,6 +1320,13 @@ class VgmStream:
 			# fetch next command & associated data
 			command = self.command_list[i]["command"]
 			data = self.command_list[i]["data"]
+
+			# the loop plays on from the registers the end of the tune left, so no write there is a duplicate
+			if self.vgm_loop_sample != None and not loop_reached and vgm_time >= self.vgm_loop_sample:
+				latched_tone_frequencies = [-1, -1, -1, -1]
+				latched_volumes = [-1, -1, -1, -1]
+				loop_reached = True
+			vgm_time += self.wait_samples(command, data)
 			
 			# process the command
 	
@@ -1191,52 +1450,9 @@ class VgmStream:
 				print "ERROR - WAS NOT EXPECTING non register data in command list"
 		
 		
-		##### EXPERIMENTAL CODE TO SORT COMMANDS INTO CHANNEL ORDER ####
-		# Part of some tests to see if compression can be improved.
-		# Disabled for the moment
-		if False:
-			# sorted by type & channel
-			volume_channel_list = []
-			tone_channel_list = []
-
-			# sort volumes into channel order
-			for channel in range(0,4):
-				for c in volume_list:
-					# fetch next command & associated data
-					command = c["command"]
-					data = c["data"]
-					
-					if binascii.hexlify(command) == "50":
-						w = int(binascii.hexlify(data), 16)		
-						# already know its a volume command, so just check channel
-						if ((w >> 5) & 3) == channel:
-							volume_channel_list.append( c )
-				
-			# sort tones into channel order
-			for channel in range(0,4):
-				next_tone_write = False
-				for c in tone_list:
-					# fetch next command & associated data
-					command = c["command"]
-					data = c["data"]
-					
-					if binascii.hexlify(command) == "50":
-						w = int(binascii.hexlify(data), 16)		
-						# already know its a tone command, so just check channel
-						if (w & 128):
-							if ((w >> 5) & 3) == channel:
-								tone_channel_list.append( c )	
-								next_tone_write = True
-						else:
-							if next_tone_write:
-								tone_channel_list.append( c )
-								next_tone_write = False
-			
-			# replace original lists with sorted lists
-			volume_list = volume_channel_list
-			tone_list = tone_channel_list
+		# other orders compress better for some tunes but transpose relies on this one,
+		# write_binary reorders the packets on the way out (see order_packets)
 
-		
 		# return the commands sorted into volumes first followed by tones
 		output_list = []
 		output_list += volume_list
@@ -1251,9 +1467,11 @@ class VgmStream:
 	# we also sort the register updates so that volumes are set before tones
 	# this allows for better frequency correction - some tunes set tones before volumes which makes it tricky
 	# to detect tuned noise effects and compensate accordingly. Sorting register updates makes this more accurate.
+	@timed_pass("optimize2")
 	def optimize2(self):
 
 		print "   VGM Processing : Optimizing VGM Packets "
+		debug = log.isEnabledFor(logging.DEBUG)
 
 		# total number of commands in the vgm stream
 		num_commands = len(self.command_list)	
@@ -1315,7 +1533,7 @@ class VgmStream:
 								if (not redundant):
 									temp_command_list.append(c)								
 								else:
-									if self.VERBOSE: print "Command#" + str(i) + " Removed redundant volume write"
+									if debug: log.debug("Command#%d Removed redundant volume write", i)
 									
 							# replace command list with optimized command list
 							optimized_command_list = temp_command_list
@@ -1357,7 +1575,7 @@ class VgmStream:
 									temp_command_list.append(c)
 								else:
 									redundant_count += 1
-									if self.VERBOSE: print "Command#" + str(i) + " Removed redundant tone write"
+									if debug: log.debug("Command#%d Removed redundant tone write", i)
 									
 								# replace command list with optimized command list
 								optimized_command_list = temp_command_list							
@@ -1386,6 +1604,7 @@ class VgmStream:
 		
 	#-------------------------------------------------------------------------------------------------
 	
+	@timed_pass("quantize")
 	def quantize(self, play_rate):
 				
 		print "   VGM Processing : Quantizing VGM to " + str(play_rate) + " Hz"
@@ -1404,8 +1623,25 @@ class VgmStream:
 		playback_time = 0
 
 		interval_time = self.VGM_FREQUENCY/play_rate	
+
+		# a command at sample t lands in interval ceil(t / interval_time) - 1, so the loop start and end go
+		# there too, and the intervals from the loop end on are dropped as the player has looped by then
+		loop_interval = None
+		if self.vgm_loop_sample != None:
+			quantized_interval = lambda t: max(0, (t + interval_time - 1) / interval_time - 1)
+			loop_interval = quantized_interval(self.vgm_loop_sample)
+			end_interval = quantized_interval(self.vgm_loop_sample + self.vgm_loop_length)
+			if loop_interval < end_interval:
+				total_samples = end_interval * interval_time
+				if self.vgm_loop_length % interval_time != 0:
+					print "WARNING: the loop is " + ("%.2f" % (float(self.vgm_loop_length) / interval_time)) + " intervals long, rounded to " + str(end_interval - loop_interval)
+			else:
+				print "WARNING: the loop is shorter than one interval, ignoring the loop"
+				self.vgm_loop_sample = None
+				loop_interval = None
 		
 		vgm_command_index = 0
+		debug = log.isEnabledFor(logging.DEBUG)
 
 		unhandled_commands = 0
 
@@ -1439,7 +1675,7 @@ class VgmStream:
 					t += 1
 					vgm_time += t
 					scommand = "WAITn"
-					if self.VERBOSE: print "WAITN=" + str(t)
+					if debug: log.debug("WAITN=%d", t)
 				else:
 					pcommand = binascii.hexlify(command)
 				
@@ -1456,7 +1692,7 @@ class VgmStream:
 							msb = (t / 256)
 							t = (lsb * 256) + msb
 							vgm_time += t		
-							if self.VERBOSE: print "WAIT=" + str(t)
+							if debug: log.debug("WAIT=%d", t)
 						else:			
 							if pcommand == "66":	#end
 								# send the end command
@@ -1471,10 +1707,10 @@ class VgmStream:
 									else:
 										unhandled_commands += 1		
 				
-				if self.VERBOSE: print "vgm_time=" + str(vgm_time) + ", playback_time=" + str(playback_time) + ", vgm_command_index=" + str(vgm_command_index) + ", output_command_list=" + str(len(output_command_list)) + ", command=" + scommand
+				if debug: log.debug("vgm_time=%d, playback_time=%d, vgm_command_index=%d, output_command_list=%d, command=%s", vgm_time, playback_time, vgm_command_index, len(output_command_list), scommand)
 				vgm_command_index += 1
 			
-			if self.VERBOSE: print "vgm_time has caught up with playback_time"
+			if debug: log.debug("vgm_time has caught up with playback_time")
 			
 
 			
@@ -1485,7 +1721,7 @@ class VgmStream:
 			
 				# flush any pending wait commands before data writes, to optimize redundant wait commands
 
-				if self.VERBOSE: print "Flushing " + str(len(quantized_command_list)) + " commands, accumulated_time=" + str(accumulated_time)
+				if debug: log.debug("Flushing %d commands, accumulated_time=%d", len(quantized_command_list), accumulated_time)
 				
 				# make sure we limit the max time delay to be the nearest value under 65535
 				# that is wholly divisible by the quantization interval
@@ -1498,28 +1734,7 @@ class VgmStream:
 					if (t > max_accumulated_time):
 						t = max_accumulated_time
 					
-					# optimization: if quantization time step is 1/50 or 1/60 of a second use the single byte wait
-					if t == 882: # 50Hz
-						if self.VERBOSE: print "Outputting WAIT50"
-						output_command_list.append( { 'command' : b'\x63', 'data' : None } )
-					else:
-						if t == 882*2: # 25Hz
-							if self.VERBOSE: print "Outputting 2x WAIT50 "
-							output_command_list.append( { 'command' : b'\x63', 'data' : None } )	
-							output_command_list.append( { 'command' : b'\x63', 'data' : None } )	
-						else:
-							if t == 735: # 60Hz
-								if self.VERBOSE: print "Outputting WAIT60"
-								output_command_list.append( { 'command' : b'\x62', 'data' : None } )	
-							else:
-								if t == 735*2: # 30Hz
-									if self.VERBOSE: print "Outputting WAIT60 x 2"
-									output_command_list.append( { 'command' : b'\x62', 'data' : None } )	
-									output_command_list.append( { 'command' : b'\x62', 'data' : None } )	
-								else:
-									if self.VERBOSE: print "Outputting WAIT " + str(t) + " (" + str(float(t)/float(interval_time)) + " intervals)"
-									# else emit the full 16-bit wait command (3 bytes)
-									output_command_list.append( { 'command' : b'\x61', 'data' : struct.pack('H', t) } )	
+					output_command_list += self.wait_commands(t)
 
 					accumulated_time -= t
 						
@@ -1530,8 +1745,21 @@ class VgmStream:
 			# accumulate time to next quantized time period
 			next_w = (self.VGM_FREQUENCY/play_rate)
 			accumulated_time += next_w
-			if self.VERBOSE: print "next_w=" + str(next_w)
+			if debug: log.debug("next_w=%d", next_w)
+
+
+		# a looping tune waits out the rest of its last interval before the end, so the loop keeps its length
+		if loop_interval != None:
+			while (accumulated_time > 0):
+				t = min(accumulated_time, (65535 / interval_time) * interval_time)
+				output_command_list += self.wait_commands(t)
+				accumulated_time -= t
+			output_command_list.append( { 'command' : b'\x66', 'data' : None } )
 
+			self.vgm_loop_sample = loop_interval * interval_time
+			self.vgm_loop_length = total_samples - self.vgm_loop_sample
+			self.metadata['total_samples'] = total_samples
+			print "- Loop starts at interval " + str(loop_interval) + " of " + str(total_samples / interval_time)
 
 		# report
 		print "Processed VGM stream, quantized to " + str(play_rate) + "Hz playback intervals" 
@@ -1545,7 +1773,9 @@ class VgmStream:
 
 	#-------------------------------------------------------------------------------------------------
 
-	def analyse(self):
+	@timed_pass("analyse")
+	# prints the analysis numbers, and with dump_filename writes every command & event list to that file
+	def analyse(self, dump_filename = None):
 			
 
 		# now we've quantized we can eliminate redundant register writes
@@ -1576,9 +1806,9 @@ class VgmStream:
 		writecount = 0
 		totalwritecount = 0
 		maxwritecount = 0
-		writedictionary = []
-		waitdictionary = []
-		tonedictionary = []
+		writedictionary = set()
+		waitdictionary = set()
+		tonedictionary = set()
 		maxtonedata = 0
 		numtonedatawrites = 0
 		unhandledcommands = 0
@@ -1598,47 +1828,46 @@ class VgmStream:
 		waittime = 0
 		tonechannel = 0
 
+		# the per-command dump is only formatted when it's going to a file
+		dump = None
+		if dump_filename != None:
+			dump = open(dump_filename, 'w', 65536)
+			print "   VGM Processing : Writing analysis dump to '" + dump_filename + "'"
+
+		volume_keys = [ "v0", "v1", "v2", "v3" ]
+		tone_keys = [ "t0", "t1", "t2", "t3" ]
+
 		for n in range(num_commands):
 			command = self.command_list[n]["command"]
 			data = self.command_list[n]["data"]
+			c = ord(command)
 			pdata = "NONE"
 			
 			# process command
-			if b'\x70' <= command <= b'\x7f':		
+			if 0x70 <= c <= 0x7f:
 				pcommand = "WAITn"
+			elif c == 0x50:
+				pcommand = "WRITE"	
+				# count number of serial writes
+				writecount += 1
+				totalwritecount += 1
+				writedictionary.add(data)
 			else:
-				pcommand = binascii.hexlify(command)
-				
-			
-				if pcommand == "50":
-					pcommand = "WRITE"	
-					# count number of serial writes
-					writecount += 1
-					totalwritecount += 1
-					if data not in writedictionary:
-						writedictionary.append(data)
+				if writecount > maxwritecount:
+					maxwritecount = writecount
+				writecount = 0
+				if c == 0x61:
+					pcommand = "WAIT "
+				elif c == 0x66:
+					pcommand = "END"
+				elif c == 0x62:
+					pcommand = "WAIT60"
+				elif c == 0x63:
+					pcommand = "WAIT50"
 				else:
-					if writecount > maxwritecount:
-						maxwritecount = writecount
-					writecount = 0
-					if pcommand == "61":
-						pcommand = "WAIT "
-					else:			
-						if pcommand == "66":
-							pcommand = "END"
-						else:
-							if pcommand == "62":
-								pcommand = "WAIT60"
-							else:
-								if pcommand == "63":
-									pcommand = "WAIT50"						
-								else:
-									unhandledcommands += 1
-									pdata = "UNKNOWN COMMAND"
-									
-				
-
-
+					pcommand = binascii.hexlify(command)
+					unhandledcommands += 1
+					pdata = "UNKNOWN COMMAND"
 
 			# process data
 			# handle data writes first	
@@ -1656,54 +1885,27 @@ class VgmStream:
 					event = { "wait" : 0, "t0" : -1, "v0" : -1, "t1" : -1, "v1" : -1, "t2" : -1, "v2" : -1, "t3" : -1,  "v3" : - 1 }	
 					
 				# process the write data
-				pdata = binascii.hexlify(data)
-				w = int(pdata, 16)
-				s = pdata
-				pdata = s + " (" + str(w) + ")"
+				w = ord(data)
 				if w & 128:
 					tonechannel = (w&96)>>5
-					pdata += " LATCH"
-					pdata += " CH" + str(tonechannel)
-					
 					if (w & 16):
-						pdata += " VOL"
 						totalvolwrites += 1
-						vol = w & 15
-						if tonechannel == 0:
-							event["v0"] = vol
-						if tonechannel == 1:
-							event["v1"] = vol
-						if tonechannel == 2:
-							event["v2"] = vol
-						if tonechannel == 3:
-							event["v3"] = vol
-							
-						
+						event[volume_keys[tonechannel]] = w & 15
 					else:
-						pdata += " TONE"
 						totaltonewrites += 1
 						latchtone = w & 15
-					pdata += " " + str(w & 15)
+					if dump:
+						pdata = binascii.hexlify(data) + " (" + str(w) + ") LATCH CH" + str(tonechannel) + (" VOL " if (w & 16) else " TONE ") + str(w & 15)
 				else:
-					pdata += " DATA"
 					numtonedatawrites += 1
 					if w > maxtonedata:
 						maxtonedata = w
 					tone = latchtone + (w << 4)
-					pdata += " " + str(w) + " (tone=" + str(tone) + ")"
-					
 					latchtone = 0
-					if tone not in tonedictionary:
-						tonedictionary.append(tone)
-					
-					if tonechannel == 0:
-						event["t0"] = tone
-					if tonechannel == 1:
-						event["t1"] = tone
-					if tonechannel == 2:
-						event["t2"] = tone
-					if tonechannel == 3:
-						event["t3"] = tone
+					tonedictionary.add(tone)
+					event[tone_keys[tonechannel]] = tone
+					if dump:
+						pdata = binascii.hexlify(data) + " (" + str(w) + ") DATA " + str(w) + " (tone=" + str(tone) + ")"
 			else:
 				# process wait or end commands
 				
@@ -1712,53 +1914,31 @@ class VgmStream:
 					eventlist.append(event)
 					event = None	
 					
+				t = 0
 				if pcommand == "WAIT60":			
 					t = 735
-					waittime += t
-					if t not in waitdictionary:
-						waitdictionary.append(t)
-
-				if pcommand == "WAIT50":
+				elif pcommand == "WAIT50":
 					t = 882
-					waittime += t
-					if t not in waitdictionary:
-						waitdictionary.append(t)	
-
-				if pcommand == "WAIT ":
-					pdata = binascii.hexlify(data)
-					t = int(pdata, 16)
-					# sdm: swap bytes to LSB
-					lsb = t & 255
-					msb = (t / 256)
-					t = (lsb * 256) + msb
-					waittime += t
+				elif pcommand == "WAIT ":
+					t = struct.unpack('<H', data)[0]
 					if t < minwait:
 						minwait = t
-					ms = t * 1000 / self.VGM_FREQUENCY
-					pdata = str(ms) +"ms, " + str(t) + " samples (" + pdata +")"
-					if t not in waitdictionary:
-						waitdictionary.append(t)					
-
-
-				if pcommand == "WAITn":
+					if dump:
+						pdata = str(t * 1000 / self.VGM_FREQUENCY) + "ms, " + str(t) + " samples (" + binascii.hexlify(data) + ")"
+				elif pcommand == "WAITn":
 					# data will be "None" for this but thats ok.
-					pdata = binascii.hexlify(command)
-					t = int(pdata, 16)
-					t &= 15
-					waittime += t
+					t = c & 15
 					if t < minwaitn:
 						minwaitn = t
-					ms = t * 1000 / self.VGM_FREQUENCY
-					pdata = str(ms) +"ms, " + str(t) + " samples (" + pdata +")"
-					if t not in waitdictionary:
-						waitdictionary.append(t)
+					if dump:
+						pdata = str(t * 1000 / self.VGM_FREQUENCY) + "ms, " + str(t) + " samples (" + binascii.hexlify(command) + ")"
 
-				
-				
-
-				
+				if pcommand in [ "WAIT60", "WAIT50", "WAIT ", "WAITn" ]:
+					waittime += t
+					waitdictionary.add(t)
 
-			print "#" + str(n) + " Command:" + pcommand + " Data:" + pdata # '{:02x}'.format(data)
+			if dump:
+				dump.write("#" + str(n) + " Command:" + pcommand + " Data:" + pdata + "\n")
 
 		# NOTE: multiple register writes happen instantaneously
 		# ideas:
@@ -1776,15 +1956,14 @@ class VgmStream:
 
 
 		#--------------------------------
-		print "--------------------------------------------------------------------------"
-		print "Number of sampled events: " + str(len(eventlist))
+		if dump:
+			dump.write("--------------------------------------------------------------------------\n")
+			dump.write("Number of sampled events: " + str(len(eventlist)) + "\n")
 
-		for n in range(len(eventlist)):
-			event = eventlist[n]
-			print "%6d" % n + " " + str(event)
-			
+			for n in range(len(eventlist)):
+				dump.write("%6d " % n + str(eventlist[n]) + "\n")
 
-		print "--------------------------------------------------------------------------"
+			dump.write("--------------------------------------------------------------------------\n")
 
 		# compile volume channel 0 stream
 
@@ -1799,11 +1978,11 @@ class VgmStream:
 		eventlist_t3 = []
 
 		def printEvents(eventlistarray, arrayname):
-			print ""
-			print "Total " + arrayname + " events: " + str(len(eventlistarray))
+			if not dump:
+				return
+			dump.write("\nTotal " + arrayname + " events: " + str(len(eventlistarray)) + "\n")
 			for n in range(len(eventlistarray)):
-				event = eventlistarray[n]
-				print "%6d" % n + " " + str(event)
+				dump.write("%6d " % n + str(eventlistarray[n]) + "\n")
 
 		def processEvents(eventsarray_in, eventsarray_out, tag_in, tag_out):
 			waittime = 0
@@ -1830,6 +2009,8 @@ class VgmStream:
 		processEvents(eventlist, eventlist_t2, "t2", "t")
 		processEvents(eventlist, eventlist_t3, "t3", "t")				
 
+		if dump:
+			dump.close()
 
 		# ----------------------- analysis
 
@@ -1907,7 +2088,8 @@ class VgmStream:
 	#  [byte] - packet count msb
 	#  [byte] - duration minutes
 	#  [byte] - duration seconds
-	# todo: add looping offsets
+	#  [byte] - loop packet lsb, only if the tune loops
+	#  [byte] - loop packet msb, playback carries on from this packet after the last one
 	# <title>
 	#  [byte] - title string size
 	#  [dd] ... - ZT title string
@@ -2176,6 +2358,7 @@ class VgmStream:
 	#--------------------------------------------------------------------------------------------------------------
 
 	# Apply a sliding window dictionary compression to the packet data
+	@timed_pass("compress_packets")
 	def compress_packets(self):
 	
 		print "--------------------------------------"
@@ -2332,95 +2515,98 @@ class VgmStream:
 	
 	#--------------------------------------------------------------------------------------------------------------	
 	
-	def write_binary(self, filename):
-		print "   VGM Processing : Output binary file "
-		
-		# debug data to dump out information about the packet stream
-		#self.insights()
-		#self.compress_packets()
-		
-		byte_size = 1
-		packet_size = 0
+	# the data writes of each update interval, as the raw binary's packets
+	# returns None if a wait isn't a whole number of intervals
+	def packets(self):
 		play_rate = self.metadata['rate']
 		play_interval = self.VGM_FREQUENCY / play_rate
-		data_block = bytearray()
+		packet_list = []
 		packet_block = bytearray()
-
-		packet_count = 0
+		carried_wait = 0
+		debug = log.isEnabledFor(logging.DEBUG)
 		
-		# emit the packet data
 		for q in self.command_list:
 			
 			command = q["command"]
 			if command != struct.pack('B', 0x50):
+
+				# see if command is a wait longer than one interval and emit empty packets to compensate,
+				# 25Hz & 30Hz intervals are two single byte waits so a part interval carries on to the next wait
+				wait = carried_wait + self.wait_samples(command, q["data"])
+				carried_wait = 0
+				if wait % play_interval != 0:
+					if command != struct.pack('B', 0x66):
+						carried_wait = wait
+						continue
+					print "ERROR in data stream, wait value (" + str(wait) + ") was not divisible by play_rate (" + str(play_interval) + "), bailing"
+					return None
 			
+				# a looping tune ends on a wait, the end is where it jumps back rather than another packet
+				if command == struct.pack('B', 0x66) and len(packet_block) == 0 and self.vgm_loop_sample != None:
+					break
+
 				# non-write command, so flush any pending packet data
-				if self.VERBOSE: print "Packet length " + str(len(packet_block))
+				if debug: log.debug("Packet length %d", len(packet_block))
 
-				data_block.append(struct.pack('B', len(packet_block)))
-				data_block.extend(packet_block)
-				packet_count += 1
+				packet_list.append(packet_block)
 				
 				# start new packet
 				packet_block = bytearray()
 				
-				if self.VERBOSE: print "Command " + str(binascii.hexlify(command))
-				
-				
-
-				# see if command is a wait longer than one interval and emit empty packets to compensate
-				wait = 0
-				if command == struct.pack('B', 0x61):
-					t = int(binascii.hexlify(q["data"]), 16)
-					wait = ((t & 255) * 256) + (t>>8)
-				else:
-					if command == struct.pack('B', 0x62):
-						wait = 735
-					else:
-						if command == struct.pack('B', 0x63):
-							wait = 	882
+				if debug: log.debug("Command %s", binascii.hexlify(command))
 					
 				if wait != 0:	
-					intervals = wait / (self.VGM_FREQUENCY / play_rate)
-					if intervals == 0:
-						print "ERROR in data stream, wait value (" + str(wait) + ") was not divisible by play_rate (" + str((self.VGM_FREQUENCY / play_rate)) + "), bailing"
-						return
-					else:
-						if self.VERBOSE: print "WAIT " + str(intervals) + " intervals"
+					intervals = wait / play_interval
+					if debug: log.debug("WAIT %d intervals", intervals)
 						
-					# emit empty packet headers to simulate wait commands
+					# emit empty packets to simulate wait commands
 					intervals -= 1
 					while intervals > 0:
-						data_block.append(0)
-						if self.VERBOSE: print "Packet length 0"
+						packet_list.append(bytearray())
+						if debug: log.debug("Packet length 0")
 						intervals -= 1
-						packet_count += 1
-
-				
 				
 			else:
-				if self.VERBOSE: print "Data " + str(binascii.hexlify(command))			
+				if carried_wait != 0:
+					print "ERROR in data stream, wait value (" + str(carried_wait) + ") was not divisible by play_rate (" + str(play_interval) + "), bailing"
+					return None
+				if debug: log.debug("Data %s", binascii.hexlify(command))			
 				packet_block.extend(q['data'])
 
-		# eof
-		data_block.append(0x00)	# append one last wait
-		data_block.append(0xFF)	# signal EOF
-		
-		
+		return packet_list
+
+
+	# the packet a looping tune jumps back to after its last one, None if it doesn't loop
+	def loop_packet(self, packet_count):
+		if self.vgm_loop_sample == None:
+			return None
+		play_interval = self.VGM_FREQUENCY / self.metadata['rate']
+		if self.vgm_loop_sample % play_interval != 0 or self.vgm_loop_sample / play_interval >= packet_count:
+			print "WARNING: loop at sample " + str(self.vgm_loop_sample) + " isn't a packet, quantize first, ignoring the loop"
+			return None
+		return self.vgm_loop_sample / play_interval
+
+
+	# the header, title & author that start every raw binary file
+	def binary_header(self, packet_count, loop_packet = None):
+		play_rate = self.metadata['rate']
+
 		header_block = bytearray()
 		# emit the play rate
-		print "play rate is " + str(play_rate)
 		header_block.append(struct.pack('B', play_rate & 0xff))
 		header_block.append(struct.pack('B', packet_count & 0xff))		
 		header_block.append(struct.pack('B', (packet_count >> 8) & 0xff))	
 
-		print "    Num packets " + str(packet_count)
 		duration = packet_count / play_rate
 		duration_mm = int(duration / 60.0)
 		duration_ss = int(duration % 60.0)
-		print "    Song duration " + str(duration) + " seconds, " + str(duration_mm) + "m" + str(duration_ss) + "s"
 		header_block.append(struct.pack('B', duration_mm))	# minutes		
 		header_block.append(struct.pack('B', duration_ss))	# seconds
+
+		# players that don't loop skip header bytes they don't know
+		if loop_packet != None:
+			header_block.append(struct.pack('B', loop_packet & 0xff))
+			header_block.append(struct.pack('B', (loop_packet >> 8) & 0xff))
 		
 		# output the final byte stream
 		output_block = bytearray()	
@@ -2451,9 +2637,134 @@ class VgmStream:
 		output_block.append(struct.pack('B', len(author) + 1))	# author string length
 		output_block.extend(author)
 		output_block.append(struct.pack('B', 0))				# zero terminator
+
+		return output_block
+
+
+	# the packet data of the raw binary, after the header
+	def binary_packets(self, packet_list):
+		data_block = bytearray()
+		for packet_block in packet_list:
+			data_block.append(struct.pack('B', len(packet_block)))
+			data_block.extend(packet_block)
+
+		# eof
+		data_block.append(0x00)	# append one last wait
+		data_block.append(0xFF)	# signal EOF
+		return data_block
+
+
+	# orders of the writes within each packet, which all play the same as a packet's writes reach the chip together:
+	#  type			volumes then tones, as optimize2 leaves them
+	#  channel		channel 0 to 3, the volume then the tone of each
+	#  type_channel	volumes then tones, each in channel order
+	#  first_seen	registers in the order the tune first writes them
+	# A tone's data byte stays with its latch byte, and so does a data byte starting a packet with the latch
+	# the packet before it ends on, which keeps its place. optimize2 has to leave volumes before tones for
+	# transpose to spot periodic noise, so these are only used on the way out, after any transpose.
+	PACKET_ORDERS = [ "type", "channel", "type_channel", "first_seen" ]
+
+	def order_packets(self, packet_list, order):
+		# each packet split into latch bytes with any data bytes after them
+		packet_units = []
+		first_seen = {}
+		for packet in packet_list:
+			units = []
+			for w in packet:
+				if w & 128:
+					units.append(bytearray([w]))
+					first_seen.setdefault((w >> 4) & 7, len(first_seen))
+				elif len(units) == 0:
+					units.append(bytearray([w]))
+				else:
+					units[-1].append(w)
+			packet_units.append(units)
+
+		sort_keys = {
+			"type": lambda r: 0 if r & 1 else 1,
+			"channel": lambda r: (r >> 1, 0 if r & 1 else 1),
+			"type_channel": lambda r: (0 if r & 1 else 1, r >> 1),
+			"first_seen": lambda r: first_seen[r],
+		}
+		sort_key = sort_keys[order]
+
+		ordered_list = []
+		next_starts_with_data = False
+		for units in reversed(packet_units):
+			first = []
+			last = []
+			if len(units) > 0 and not (units[0][0] & 128):
+				first = units[:1]
+				units = units[1:]
+			if next_starts_with_data and len(units) > 0:
+				last = units[-1:]
+				units = units[:-1]
+			units = sorted(units, key = lambda unit: sort_key((unit[0] >> 4) & 7))
+
+			packet = bytearray()
+			for unit in first + units + last:
+				packet.extend(unit)
+			ordered_list.append(packet)
+
+			if len(first) > 0:
+				next_starts_with_data = True
+			elif len(packet) > 0:
+				next_starts_with_data = False
+
+		ordered_list.reverse()
+		return ordered_list
+
+
+	# the order whose packets come out smallest through zlib's LZ, as a quick estimate of what Exomizer will make of them
+	def choose_packet_order(self, packet_list):
+		best = None
+		for order in self.PACKET_ORDERS:
+			data = self.binary_packets(self.order_packets(packet_list, order))
+			size = len(zlib.compress(bytes(data), 9))
+			print "    Packet order " + order.ljust(12) + " " + str(len(data)) + " bytes, LZ estimate " + str(size) + " bytes"
+			if best == None or size < best[1]:
+				best = (order, size)
+		return best[0]
+
+
+	@timed_pass("write_binary")
+	def write_binary(self, filename, order = "type"):
+		print "   VGM Processing : Output binary file "
+		
+		# debug data to dump out information about the packet stream
+		#self.insights()
+		#self.compress_packets()
+		
+		packet_list = self.packets()
+		if packet_list == None:
+			return
+
+		if order == "auto":
+			order = self.choose_packet_order(packet_list)
+		ordered_list = self.order_packets(packet_list, order)
+		if self.channel_events(ordered_list) != self.channel_events(packet_list):
+			print "ERROR: packets in " + order + " order don't play the same, bailing"
+			return
+		packet_list = ordered_list
+		print "    Packet order " + order
+
+		play_rate = self.metadata['rate']
+		packet_count = len(packet_list)
+		print "play rate is " + str(play_rate)
+		print "    Num packets " + str(packet_count)
+		duration = packet_count / play_rate
+		print "    Song duration " + str(duration) + " seconds, " + str(int(duration / 60.0)) + "m" + str(int(duration % 60.0)) + "s"
+
+		loop_packet = self.loop_packet(packet_count)
+		if loop_packet != None:
+			print "    Loop at packet " + str(loop_packet) + ", " + str(packet_count - loop_packet) + " packets long"
+			if len(packet_list[loop_packet]) > 0 and not (packet_list[loop_packet][0] & 128):
+				print "WARNING: the loop packet starts with a data byte for the register latched before it"
+
+		output_block = self.binary_header(packet_count, loop_packet)
 		
 		# send data
-		output_block.extend(data_block)
+		output_block.extend(self.binary_packets(packet_list))
 		
 		# write file
 		print "Compressed VGM is " + str(len(output_block)) + " bytes long"
@@ -2462,236 +2773,865 @@ class VgmStream:
 		bin_file = open(filename, 'wb')
 		bin_file.write(output_block)
 		bin_file.close()		
+
+
+	#--------------------------------------------------------------------------------------------------------------	
+
+	# per channel binary format schema, an alternative to write_binary's packets:
+	# Volumes change far more often than tones, so each of the 8 SN registers gets a stream of its own
+	# holding (wait, value) pairs for the intervals the register changes in, rather than every interval
+	# holding the writes of all of them.
+
+	# <header>, <title>, <author> as write_binary
+	# <streams>
+	#  [word] x 8 - offset of each register's stream from the start of this table, little endian,
+	#               in register order tone 0, volume 0, tone 1, volume 1, tone 2, volume 2, noise, volume 3
+	# <stream>
+	#  [byte] - 0x00-0xFD wait this many intervals then write the next value (from the start or the last write)
+	#           0xFE end of stream, no more writes to this register
+	#           0xFF wait 0xFD intervals, no write (0xFE can't be a wait so longer gaps are made of these)
+	#  tone registers:
+	#  [byte] - low 4 bits of the tone, for the latch byte
+	#  [byte] - high 6 bits of the tone, the data byte
+	#  volume & noise registers:
+	#  [byte] - two values packed in nibbles, first in the high nibble. The byte follows the first wait of each
+	#           pair, the second value's wait is followed straight by the next wait.
+
+	CHANNEL_REGISTER_NAMES = [ "t0", "v0", "t1", "v1", "t2", "v2", "n3", "v3" ]
+	CHANNEL_END = 0xFE
+	CHANNEL_WAIT = 0xFF
+	CHANNEL_MAX_WAIT = 0xFD
+
+	# (interval, value) of each register write after a packet, the noise register every time it's written as
+	# that restarts the noise, the others only when they change value. Registers never written have no events.
+	def channel_events(self, packet_list):
+		registers = [ 0 ] * 8
+		touched = [ False ] * 8
+		written = [ None ] * 8
+		events = [ [] for r in range(8) ]
+		latch = 0
+
+		for interval, packet in enumerate(packet_list):
+			noise_written = False
+			for w in packet:
+				if w & 128:
+					latch = (w >> 4) & 7
+					touched[latch] = True
+					if latch & 1 or latch == 6:
+						registers[latch] = w & 15
+						if latch == 6:
+							noise_written = True
+					else:
+						registers[latch] = (registers[latch] & 0x3F0) | (w & 15)
+				elif latch & 1 or latch == 6:
+					# volume & noise take the low bits of a data byte
+					registers[latch] = w & 15
+					if latch == 6:
+						noise_written = True
+				else:
+					registers[latch] = (registers[latch] & 15) | ((w & 63) << 4)
+
+			for r in range(8):
+				if touched[r] and (registers[r] != written[r] or (r == 6 and noise_written)):
+					events[r].append((interval, registers[r]))
+					written[r] = registers[r]
+
+		return events
+
+
+	# one register's stream from its events
+	def channel_stream(self, register, events):
+		stream = bytearray()
+		nibbles = (register & 1) or register == 6
+		last = 0
+		pending = None
+		for interval, value in events:
+			wait = interval - last
+			last = interval
+			while wait > self.CHANNEL_MAX_WAIT:
+				stream.append(self.CHANNEL_WAIT)
+				wait -= self.CHANNEL_MAX_WAIT
+			stream.append(wait)
+			if nibbles:
+				if pending == None:
+					pending = len(stream)
+					stream.append((value & 15) << 4)
+				else:
+					stream[pending] |= value & 15
+					pending = None
+			else:
+				stream.append(value & 15)
+				stream.append((value >> 4) & 63)
+		stream.append(self.CHANNEL_END)
+		return stream
+
+
+	# (interval, value) of each write in a register's stream, to check it
+	def decode_channel_stream(self, register, stream):
+		nibbles = (register & 1) or register == 6
+		events = []
+		interval = 0
+		pending = None
+		i = 0
+		while stream[i] != self.CHANNEL_END:
+			wait = stream[i]
+			i += 1
+			if wait == self.CHANNEL_WAIT:
+				interval += self.CHANNEL_MAX_WAIT
+				continue
+			interval += wait
+			if nibbles:
+				if pending == None:
+					pending = stream[i]
+					i += 1
+					events.append((interval, pending >> 4))
+				else:
+					events.append((interval, pending & 15))
+					pending = None
+			else:
+				events.append((interval, stream[i] | (stream[i+1] << 4)))
+				i += 2
+		return events
+
+
+	@timed_pass("write_channels")
+	def write_channels(self, filename, window = 2048):
+		print "   VGM Processing : Output channel file "
+
+		packet_list = self.packets()
+		if packet_list == None:
+			return
+
+		events = self.channel_events(packet_list)
+		streams = []
+		for r in range(8):
+			stream = self.channel_stream(r, events[r])
+			if self.decode_channel_stream(r, stream) != events[r]:
+				print "ERROR: register " + self.CHANNEL_REGISTER_NAMES[r] + " stream doesn't decode back to its writes, bailing"
+				return
+			streams.append(stream)
+
+		table_block = bytearray()
+		data_block = bytearray()
+		for stream in streams:
+			offset = 16 + len(data_block)
+			table_block.append(struct.pack('B', offset & 0xff))
+			table_block.append(struct.pack('B', (offset >> 8) & 0xff))
+			data_block.extend(stream)
+
+		# a stream per register would need a loop offset in each, so these only hold the tune up to the loop end
+		if self.vgm_loop_sample != None:
+			print "WARNING: the loop isn't stored in this format"
+		header_block = self.binary_header(len(packet_list))
+		output_block = header_block + table_block + data_block
+
+		bin_file = open(filename, 'wb')
+		bin_file.write(output_block)
+		bin_file.close()
+
+		for r in range(8):
+			print "    " + self.CHANNEL_REGISTER_NAMES[r] + " " + str(len(events[r])).rjust(6) + " writes " + str(len(streams[r])).rjust(6) + " bytes"
+
+		# against the packets write_binary would have written
+		packets_block = header_block + self.binary_packets(packet_list)
+		print "    packets  " + str(len(packets_block)).rjust(6) + " bytes" + self.crunched_size(packets_block, window)
+		print "    channels " + str(len(output_block)).rjust(6) + " bytes" + self.crunched_size(output_block, window)
+
+
+	# ", crunched n bytes" with exoraw.py if it's there to do it
+	def crunched_size(self, data, window):
+		try:
+			import exoraw
+		except ImportError:
+			return ""
+		return ", crunched " + str(len(exoraw.crunch(data, window))).rjust(6) + " bytes (window " + str(window) + ")"
+
+
+	#--------------------------------------------------------------------------------------------------------------	
+
+	# instrument song format schema, re-sequencing the tune as notes played with instruments:
+	# Each channel is split into notes. A note starts when the volume gets louder, when the tone changes while the
+	# channel is silent (the tone of channel 2 still drives the periodic noise then), when the noise is written,
+	# or SONG_MAX_NOTE intervals after the last one. A note's volumes make a volume envelope. Its tones, less the
+	# tone it starts on, make an arpeggio envelope. An instrument is a pair of envelopes shared by every note
+	# that plays them (see EnvelopeTable), so the size goes with the number of notes & distinct instruments
+	# rather than with intervals x channels. Lossless - write_song decodes the song again to check every
+	# interval of every channel. Channels start silent on tone 0, as the player sets them up.
+
+	# <header>, <title>, <author> as write_binary
+	# <tables>
+	#  [word] x 7 - offsets of the volume envelopes, arpeggio envelopes, instruments and the notes of channels
+	#               0-3 from the start of this table, little endian
+	# <volume envelopes>
+	#  [byte] - number of envelopes, then for each:
+	#  [byte] - length in intervals
+	#  [dd] ... - volumes packed two nibbles per byte, first in the high nibble
+	# <arpeggio envelopes>
+	#  [byte] - number of envelopes, then for each:
+	#  [byte] - length in intervals
+	#  [dd] ... - signed 16-bit little endian offset from the note's tone for each interval
+	# <instruments>
+	#  [byte] - number of instruments, then for each:
+	#  [byte] - volume envelope
+	#  [byte] - arpeggio envelope
+	# <notes> for each channel
+	#  [byte] - 0x00-0xFD wait this many intervals (from the start or the last note) then start a note
+	#           0xFE end of the channel
+	#  [byte] - instrument
+	#  tone channels:
+	#  [byte] - low 4 bits of the tone, for the latch byte
+	#  [byte] - high 6 bits of the tone, the data byte
+	#  noise channel:
+	#  [byte] - noise register
+
+	SONG_MAX_NOTE = 0xFD
+	SONG_END = 0xFE
+	SONG_MAX_TABLE = 255		# each table starts with its count in a byte
+	SONG_SILENT = 15
+
+	# [ tones, volumes ] of each channel in each interval from the register writes, the noise register as tone 3
+	def channel_states(self, events, interval_count):
+		states = []
+		for c in range(4):
+			channel = []
+			for register, value in [ (c * 2, 0), (c * 2 + 1, self.SONG_SILENT) ]:
+				values = []
+				for interval, v in events[register] + [ (interval_count, None) ]:
+					values.extend([ value ] * (interval - len(values)))
+					value = v
+				channel.append(values)
+			states.append(channel)
+		return states
+
+
+	# (start, length) of the notes of a channel
+	def channel_notes(self, tones, volumes, restarts):
+		notes = []
+		start = 0
+		for i in range(1, len(tones)):
+			if volumes[i] < volumes[i-1] or (volumes[i-1] == self.SONG_SILENT and tones[i] != tones[i-1]) or i in restarts or i - start == self.SONG_MAX_NOTE:
+				notes.append((start, i - start))
+				start = i
+		if start < len(tones):
+			notes.append((start, len(tones) - start))
+		return notes
+
+
+	# [ tones, volumes ] of each channel in each interval from a song's tables & notes, as a player would
+	def decode_song(self, volume_envelopes, arpeggio_envelopes, instruments, channel_notes, interval_count):
+		states = []
+		for notes in channel_notes:
+			tones = [ 0 ] * interval_count
+			volumes = [ self.SONG_SILENT ] * interval_count
+			interval = 0
+			for n, (wait, instrument, tone) in enumerate(notes):
+				interval += wait
+				end = interval_count
+				if n + 1 < len(notes):
+					end = interval + notes[n + 1][0]
+				volume_envelope = volume_envelopes[instruments[instrument][0]]
+				arpeggio_envelope = arpeggio_envelopes[instruments[instrument][1]]
+				for t in range(end - interval):
+					volumes[interval + t] = volume_envelope[min(t, len(volume_envelope) - 1)]
+					tones[interval + t] = tone + arpeggio_envelope[min(t, len(arpeggio_envelope) - 1)]
+			states.append([ tones, volumes ])
+		return states
+
+
+	@timed_pass("write_song")
+	def write_song(self, filename, window = 2048):
+		print "   VGM Processing : Output instrument song file "
+
+		packet_list = self.packets()
+		if packet_list == None:
+			return
+
+		interval_count = len(packet_list)
+		events = self.channel_events(packet_list)
+		states = self.channel_states(events, interval_count)
+		restarts = set([ interval for interval, value in events[6] ])
+
+		volume_table = EnvelopeTable()
+		arpeggio_table = EnvelopeTable()
+		instruments = []
+		instrument_index = {}
+
+		# longest notes first so the shorter ones can play the start of their envelopes
+		all_notes = []
+		for c in range(4):
+			tones, volumes = states[c]
+			for start, length in self.channel_notes(tones, volumes, restarts if c == 3 else set()):
+				all_notes.append((length, c, start))
+		all_notes.sort(key = lambda note: (-note[0], note[1], note[2]))
+
+		channel_notes = [ [] for c in range(4) ]
+		for length, c, start in all_notes:
+			tones, volumes = states[c]
+			tone = tones[start]
+			v = volume_table.find(volumes[start:start + length])
+			a = arpeggio_table.find([ t - tone for t in tones[start:start + length] ])
+			instrument = instrument_index.setdefault((v, a), len(instruments))
+			if instrument == len(instruments):
+				instruments.append((v, a))
+			channel_notes[c].append((start, instrument, tone))
+
+		sizes = [ len(volume_table.envelopes), len(arpeggio_table.envelopes), len(instruments) ]
+		if max(sizes) > self.SONG_MAX_TABLE:
+			print "ERROR: " + str(sizes[0]) + " volume envelopes, " + str(sizes[1]) + " arpeggio envelopes & " + str(sizes[2]) + " instruments don't fit the byte counts of the song format, bailing"
+			return
+
+		# notes in order with the wait before each
+		for c in range(4):
+			notes = []
+			last = 0
+			for start, instrument, tone in sorted(channel_notes[c]):
+				notes.append((start - last, instrument, tone))
+				last = start
+			channel_notes[c] = notes
+
+		if self.decode_song(volume_table.envelopes, arpeggio_table.envelopes, instruments, channel_notes, interval_count) != states:
+			print "ERROR: song doesn't decode back to the tune, bailing"
+			return
+
+		blocks = []
+
+		volume_block = bytearray([ len(volume_table.envelopes) ])
+		for envelope in volume_table.envelopes:
+			volume_block.append(len(envelope))
+			for i in range(0, len(envelope), 2):
+				volume_block.append((envelope[i] << 4) | (envelope[i + 1] if i + 1 < len(envelope) else 0))
+		blocks.append(volume_block)
+
+		arpeggio_block = bytearray([ len(arpeggio_table.envelopes) ])
+		for envelope in arpeggio_table.envelopes:
+			arpeggio_block.append(len(envelope))
+			for offset in envelope:
+				arpeggio_block.extend(struct.pack('<h', offset))
+		blocks.append(arpeggio_block)
+
+		instrument_block = bytearray([ len(instruments) ])
+		for v, a in instruments:
+			instrument_block.append(v)
+			instrument_block.append(a)
+		blocks.append(instrument_block)
+
+		for c in range(4):
+			notes_block = bytearray()
+			for wait, instrument, tone in channel_notes[c]:
+				notes_block.append(wait)
+				notes_block.append(instrument)
+				if c == 3:
+					notes_block.append(tone)
+				else:
+					notes_block.append(tone & 15)
+					notes_block.append(tone >> 4)
+			notes_block.append(self.SONG_END)
+			blocks.append(notes_block)
+
+		table_block = bytearray()
+		offset = len(blocks) * 2
+		for block in blocks:
+			table_block.extend(struct.pack('<H', offset))
+			offset += len(block)
+
+		# a note list per channel would need a loop offset in each, and a note held over the loop point split, so
+		# the song only holds the tune up to the loop end
+		if self.vgm_loop_sample != None:
+			print "WARNING: the loop isn't stored in this format"
+		header_block = self.binary_header(interval_count)
+		output_block = header_block + table_block
+		for block in blocks:
+			output_block.extend(block)
+
+		bin_file = open(filename, 'wb')
+		bin_file.write(output_block)
+		bin_file.close()
+
+		note_count = sum([ len(notes) for notes in channel_notes ])
+		print "    " + str(note_count) + " notes over " + str(interval_count) + " intervals, " + str(len(instruments)) + " instruments"
+		print "    volume envelopes   " + str(len(volume_table.envelopes)).rjust(5) + str(len(volume_block)).rjust(7) + " bytes"
+		print "    arpeggio envelopes " + str(len(arpeggio_table.envelopes)).rjust(5) + str(len(arpeggio_block)).rjust(7) + " bytes"
+		print "    instruments        " + str(len(instruments)).rjust(5) + str(len(instrument_block)).rjust(7) + " bytes"
+		for c in range(4):
+			print "    channel " + str(c) + " notes    " + str(len(channel_notes[c])).rjust(5) + str(len(blocks[3 + c])).rjust(7) + " bytes"
+
+		# against the packets write_binary would have written
+		packets_block = header_block + self.binary_packets(packet_list)
+		print "    packets " + str(len(packets_block)).rjust(6) + " bytes" + self.crunched_size(packets_block, window)
+		print "    song    " + str(len(output_block)).rjust(6) + " bytes" + self.crunched_size(output_block, window)
+
+
+	#--------------------------------------------------------------------------------------------------------------	
+
+	# quantize rate search, to choose the player's update rate from the data:
+	# Each candidate rate is quantized & optimized as main does it and written as write_binary's packets, measuring
+	#  bytes		the size of the raw binary, and crunched by exoraw.py if it's there
+	#  timing		how far quantizing moves the writes from their own time, RMS & worst case in ms. Every write moves to
+	#				the start of the interval it falls in, so only the spread about the average move is heard, none for a
+	#				50Hz tune at 50Hz. The writes at time 0 have no interval before them to move back to, so they keep their
+	#				time and are counted apart ("at 0") instead of showing as a whole interval of error.
+	#  lost			register changes that no longer happen, overwritten by another write in the same interval
+	# A rate is on the Pareto front when no other rate is at least as good at all three and better at one.
+	# quantize only takes rates that divide 44100, so those are the candidates.
+
+	SEARCH_RATES = "10-100"
+
+	# the rates in a list of rates and ranges like "25,50,60" or "10-100" that quantize can use
+	def rate_candidates(self, spec):
+		rates = set()
+		for part in spec.split(','):
+			if '-' in part:
+				low, high = [ int(n) for n in part.split('-') ]
+				rates.update([ rate for rate in range(max(1, low), high + 1) if self.VGM_FREQUENCY % rate == 0 ])
+			elif self.VGM_FREQUENCY % int(part) == 0:
+				rates.add(int(part))
+			else:
+				print "WARNING: " + part + " Hz isn't a whole number of samples, skipping it"
+		return sorted(rates)
+
+
+	# (RMS, worst) ms that quantizing to play_rate moves the writes by, about the average move, and the number of
+	# writes at time 0 that stay where they are
+	def timing_error(self, play_rate):
+		interval_time = self.VGM_FREQUENCY / play_rate
+		moves = []
+		at_start = 0
+		vgm_time = 0
+		for c in self.command_list:
+			if c['command'] == struct.pack('B', 0x50):
+				if vgm_time == 0:
+					at_start += 1
+				else:
+					# quantize plays a write at sample t in interval ceil(t / interval_time) - 1
+					moves.append(vgm_time - ((vgm_time + interval_time - 1) / interval_time - 1) * interval_time)
+			vgm_time += self.wait_samples(c['command'], c['data'])
+		if len(moves) == 0:
+			return 0.0, 0.0, at_start
+
+		mean = float(sum(moves)) / len(moves)
+		rms = math.sqrt(sum([ (m - mean) ** 2 for m in moves ]) / len(moves))
+		worst = max([ abs(m - mean) for m in moves ])
+		return rms * 1000 / self.VGM_FREQUENCY, worst * 1000 / self.VGM_FREQUENCY, at_start
+
+
+	# the register changes channel_events sees in the command list, the writes between two waits all at once
+	def register_changes(self):
+		groups = [ bytearray() ]
+		for c in self.command_list:
+			if c['command'] == struct.pack('B', 0x50):
+				groups[-1].extend(c['data'])
+			elif self.wait_samples(c['command'], c['data']) != 0:
+				groups.append(bytearray())
+		return sum([ len(events) for events in self.channel_events(groups) ])
+
+
+	# quantizes a copy of the stream to play_rate and measures it, the stream itself is left as it is
+	def measure_rate(self, play_rate, order, window, source_changes):
+		stream = copy.copy(self)
+		stream.metadata = dict(self.metadata)
+		stream.stats = dict(self.stats, passes = [])
+
+		result = { 'rate': play_rate, 'timing': self.timing_error(play_rate), 'bytes': None }
+		stream.quantize(play_rate)
+		stream.optimize()
+		stream.optimize2()
+		stream.optimize()
+
+		packet_list = stream.packets()
+		if packet_list == None:
+			return result
+		if order == "auto":
+			order = stream.choose_packet_order(packet_list)
+		packet_list = stream.order_packets(packet_list, order)
+		data = stream.binary_header(len(packet_list), stream.loop_packet(len(packet_list))) + stream.binary_packets(packet_list)
+
+		result['packets'] = len(packet_list)
+		result['bytes'] = len(data)
+		result['lost'] = source_changes - stream.register_changes()
+		try:
+			import exoraw
+			result['crunched'] = len(exoraw.crunch(data, window))
+		except ImportError:
+			result['crunched'] = None
+		return result
+
+
+	# measures the stream quantized to each rate, in parallel worker processes that share this stream copy-on-write
+	@timed_pass("search_rates")
+	def search_rates(self, rates, order = "auto", window = 2048, jobs = None):
+		global search_stream
+
+		print "   VGM Processing : Searching " + str(len(rates)) + " quantize rates"
+		work = [ (rate, order, window, self.register_changes()) for rate in rates ]
+		search_stream = self
+		try:
+			# Windows has no fork, the workers would each have to load the VGM again
+			if jobs == 1 or len(work) <= 1 or not hasattr(os, 'fork'):
+				results = map(search_rate, work)
+			else:
+				import multiprocessing
+				pool = multiprocessing.Pool(jobs)
+				try:
+					results = pool.map(search_rate, work)
+				finally:
+					pool.close()
+					pool.join()
+		finally:
+			search_stream = None
+
+		measured = [ r for r in results if r['bytes'] != None ]
+		size = lambda r: r['crunched'] if r['crunched'] != None else r['bytes']
+		costs = lambda r: (size(r), r['timing'][0], r['lost'])
+		for r in measured:
+			r['pareto'] = not any([ costs(o) != costs(r) and all([ a <= b for a, b in zip(costs(o), costs(r)) ]) for o in measured ])
+
+		print "     rate  interval  packets    bytes  crunched  timing rms  worst  at 0  lost changes"
+		for r in results:
+			line = "    " + str(r['rate']).rjust(3) + "Hz" + ("%8.2f" % (1000.0 / r['rate'])) + "ms"
+			if r['bytes'] == None:
+				print line + "  packets failed"
+				continue
+			line += str(r['packets']).rjust(9) + str(r['bytes']).rjust(9)
+			line += (str(r['crunched']) if r['crunched'] != None else "-").rjust(10)
+			line += ("%10.2f" % r['timing'][0]) + "ms" + ("%5.1f" % r['timing'][1]) + "ms" + str(r['timing'][2]).rjust(6) + str(r['lost']).rjust(14)
+			if r['pareto']:
+				line += "  *"
+			print line
+		print "    * on the Pareto front of " + ("crunched" if any([ r['crunched'] != None for r in measured ]) else "raw") + " size, timing & lost changes"
+		return results
+
+
+# the stream search_rates is measuring, set before the worker processes fork so they share it copy-on-write
+search_stream = None
+
+def search_rate(args):
+	play_rate, order, window, source_changes = args
+
+	# each rate goes through all the passes, which say far too much side by side
+	stdout = sys.stdout
+	sys.stdout = open(os.devnull, 'w')
+	try:
+		return search_stream.measure_rate(play_rate, order, window, source_changes)
+	finally:
+		sys.stdout.close()
+		sys.stdout = stdout
+
 		
 #------------------------------------------------------------------------------------------
 # Main
 #------------------------------------------------------------------------------------------
 
-# for testing
-my_command_line = None
-if False:
-	filename = "vgms/sms/10 Page 4.vgm"
-	filename = "vgms/sms/18 - 14 Dan's Theme.vgm"
-	filename = "vgms/bbc/Galaforce2-title.vgm"
-	filename = "vgms/bbc/Firetrack-ingame.vgm"
-	filename = "vgms/bbc/CodenameDroid-title.vgm"
-	filename = "vgms/sms/07 - 07 COOL JAM.vgm"
-	filename = "vgms/sms/09 - 13 Ken's Theme.vgm"
-	filename = "vgms/ntsc/15 Diamond Maze.vgm"
-	filename = "vgms/ntsc/01 Game Start.vgm"
+if __name__ == '__main__':
 
+	# for testing
+	my_command_line = None
+	if False:
+		filename = "vgms/sms/10 Page 4.vgm"
+		filename = "vgms/sms/18 - 14 Dan's Theme.vgm"
+		filename = "vgms/bbc/Galaforce2-title.vgm"
+		filename = "vgms/bbc/Firetrack-ingame.vgm"
+		filename = "vgms/bbc/CodenameDroid-title.vgm"
+		filename = "vgms/sms/07 - 07 COOL JAM.vgm"
+		filename = "vgms/sms/09 - 13 Ken's Theme.vgm"
+		filename = "vgms/ntsc/15 Diamond Maze.vgm"
+		filename = "vgms/ntsc/01 Game Start.vgm"
 
-	#filename = "vgms/ntsc/ne7-magic_beansmaster_system_psg.vgm"
-	filename = "vgms/ntsc/Chris Kelly - SMS Power 15th Anniversary Competitions - Collision Chaos.vgz"
-	#filename = "vgms/ntsc/BotB 16439 Chip Champion - frozen dancehall of the pharaoh.vgm" # pathological fail, uses the built-in periodic noises which are tuned differently
 
-	#filename = "pn.vgm"
-	#filename = "vgms/ntsc/en vard fyra javel.vgm"
-	#filename = "chris.vgm"
-	filename = "vgms/ntsc/MISSION76496.vgm"
-	#filename = "vgms/ntsc/fluid.vgm"
-	#filename = "ng.vgm"
+		#filename = "vgms/ntsc/ne7-magic_beansmaster_system_psg.vgm"
+		filename = "vgms/ntsc/Chris Kelly - SMS Power 15th Anniversary Competitions - Collision Chaos.vgz"
+		#filename = "vgms/ntsc/BotB 16439 Chip Champion - frozen dancehall of the pharaoh.vgm" # pathological fail, uses the built-in periodic noises which are tuned differently
 
-	# for testing...
-	my_command_line = 'vgmconverter "' + filename + '" -t bbc -q 50 -o "test.vgm"'
+		#filename = "pn.vgm"
+		#filename = "vgms/ntsc/en vard fyra javel.vgm"
+		#filename = "chris.vgm"
+		filename = "vgms/ntsc/MISSION76496.vgm"
+		#filename = "vgms/ntsc/fluid.vgm"
+		#filename = "ng.vgm"
 
+		# for testing...
+		my_command_line = 'vgmconverter "' + filename + '" -t bbc -q 50 -o "test.vgm"'
 
 
 
-#------------------------------------------------------------------------------------------
 
-if my_command_line != None:
-	argv = my_command_line.split()
-else:
-	argv = sys.argv
+	#------------------------------------------------------------------------------------------
 
-argc = len(argv)
+	if my_command_line != None:
+		argv = my_command_line.split()
+	else:
+		argv = sys.argv
 
-if argc < 2:
-	print "VGM Conversion Utility for VGM files based on TI SN76849 sound chips"
-	print " Supports gzipped VGM or .vgz files."
-	print ""
-	print " Usage:"
-	print "  vgmconverter <vgmfile> [-transpose <n>] [-quantize <n>] [-filter <n>] [-rawfile <filename>] [-output <filename>] [-dump] [-verbose]"
-	print ""
-	print "   where:"
-	print "    <vgmfile> is the source VGM file to be processed. Wildcards are not yet supported."
-	print ""
-	print "   options:"
-	print "    [-transpose <n>, -t <n>] transpose the source VGM to a new frequency. For <n> Specify 'ntsc' (3.57MHz), 'pal' (4.2MHz) or 'bbc' (4.0MHz)"
-	print "    [-quantize <n>, -q <n>] quantize the VGM to a specific playback update interval. For <n> specify an integer Hz value"
-	print "    [-filter <n>, -n <n>] strip one or more output channels from the VGM. For <n> specify a string of channels to filter eg. '0123' or '13' etc."
-	print "    [-rawfile <filename>, -r <filename>] output a raw binary file version of the chip data within the source VGM. A default quantization of 60Hz will be applied if not specified with -q"
-	print "    [-output <filename>, -o <filename>] specifies the filename to output a processed VGM. Optional."
-	print "    [-dump] output human readable version of the VGM"
-	print "    [-verbose] enable debug information"
-	exit()
-
-# pre-process argv to merge quoted arguments
-argi = 0
-inquotes = False
-outargv = []
-quotedarg = []
-#print argv
-for s in argv:
-	#print "s=" + s
-	#print "quotedarg=" + str(quotedarg)
+	argc = len(argv)
+
+	if argc < 2:
+		print "VGM Conversion Utility for VGM files based on TI SN76849 sound chips"
+		print " Supports gzipped VGM or .vgz files."
+		print ""
+		print " Usage:"
+		print "  vgmconverter <vgmfile> [-transpose <n>] [-quantize <n>] [-filter <n>] [-rawfile <filename>] [-order <order>] [-channels <filename>] [-song <filename>] [-search [<rates>]] [-jobs <n>] [-output <filename>] [-analyse] [-dump [<filename>]] [-verbose] [-stats <filename>] [-profile <filename>]"
+		print ""
+		print "   where:"
+		print "    <vgmfile> is the source VGM file to be processed. Wildcards are not yet supported."
+		print ""
+		print "   options:"
+		print "    [-transpose <n>, -t <n>] transpose the source VGM to a new frequency. For <n> Specify 'ntsc' (3.57MHz), 'pal' (4.2MHz) or 'bbc' (4.0MHz)"
+		print "    [-quantize <n>, -q <n>] quantize the VGM to a specific playback update interval. For <n> specify an integer Hz value"
+		print "    [-filter <n>, -n <n>] strip one or more output channels from the VGM. For <n> specify a string of channels to filter eg. '0123' or '13' etc."
+		print "    [-rawfile <filename>, -r <filename>] output a raw binary file version of the chip data within the source VGM. A default quantization of 60Hz will be applied if not specified with -q"
+		print "    [-order <order>] order of the writes within each packet of the raw binary file: type (volumes then tones), channel, type_channel, first_seen or auto to pick the one that compresses best (default auto)"
+		print "    [-channels <filename>, -c <filename>] output the chip data as a stream per SN register instead of packets (see write_channels), comparing sizes with -rawfile's. Quantizes to 60Hz by default as -rawfile does"
+		print "    [-song <filename>, -i <filename>] output the chip data re-sequenced as notes played with instruments (see write_song), comparing sizes with -rawfile's. Quantizes to 60Hz by default as -rawfile does"
+		print "    [-search [<rates>]] quantize to each rate in a list like '25,50,60' or range like '10-100' (the default) that divides 44100, listing the size, timing error & lost register changes of each to choose a rate by"
+		print "    [-jobs <n>, -j <n>] parallel processes for -search (default one per core)"
+		print "    [-output <filename>, -o <filename>] specifies the filename to output a processed VGM. Optional."
+		print "    [-analyse, -a] print statistics about the processed VGM"
+		print "    [-dump [<filename>], -d [<filename>]] as -analyse, also writing a human readable version of the VGM to <filename> (default <vgmfile>.dump.txt)"
+		print "    [-verbose] enable debug information"
+		print "    [-stats <filename>, -s <filename>] write the time & command counts of each processing pass as JSON (use without -verbose for true timings)"
+		print "    [-profile <filename>, -p <filename>] profile the conversion with cProfile, writing the pstats to <filename> and listing the slowest functions"
+		exit()
+
+	# pre-process argv to merge quoted arguments
+	argi = 0
+	inquotes = False
+	outargv = []
+	quotedarg = []
+	#print argv
+	for s in argv:
+		#print "s=" + s
+		#print "quotedarg=" + str(quotedarg)
 	
-	if s.startswith('"') and s.endswith('"'):
-		outargv.append(s[1:-1])	
-		continue
+		if s.startswith('"') and s.endswith('"'):
+			outargv.append(s[1:-1])	
+			continue
 	
-	if not inquotes and s.startswith('"'):
-		inquotes = True
-		quotedarg.append(s[1:] + ' ')
-		continue
+		if not inquotes and s.startswith('"'):
+			inquotes = True
+			quotedarg.append(s[1:] + ' ')
+			continue
 	
-	if inquotes and s.endswith('"'):
-		inquotes = False
-		quotedarg.append(s[:-1])
-		outargv.append("".join(quotedarg))
-		quotedarg = []
-		continue
+		if inquotes and s.endswith('"'):
+			inquotes = False
+			quotedarg.append(s[:-1])
+			outargv.append("".join(quotedarg))
+			quotedarg = []
+			continue
 		
-	if inquotes:
-		quotedarg.append(s + ' ')	
-		continue
+		if inquotes:
+			quotedarg.append(s + ' ')	
+			continue
 		
-	outargv.append(s)
+		outargv.append(s)
 
-if inquotes:
-	print "Error parsing command line " + str(" ".join(argv))
-	exit()
+	if inquotes:
+		print "Error parsing command line " + str(" ".join(argv))
+		exit()
 
-argv = outargv
+	argv = outargv
 	
-# validate source file	
-source_filename = None
-if argv[1][0] != '-':
-	source_filename = argv[1]
-
-# setup option defaults
-option_verbose = None
-option_outputfile = None
-option_transpose = None
-option_quantize = None
-option_filter = None
-option_rawfile = None
-option_dump = None
-
-
-# process command line
-for i in range(2, len(argv)):
-	arg = argv[i]
-	if arg[0] == '-':
-		option = arg[1:].lower()
-		if option == 'o' or option == 'output':
-			option_outputfile = argv[i+1]
-		else:
-			if option == 't' or option == 'transpose':
-				option_transpose = argv[i+1]
+	# validate source file	
+	source_filename = None
+	if argv[1][0] != '-':
+		source_filename = argv[1]
+
+	# setup option defaults
+	option_verbose = None
+	option_outputfile = None
+	option_transpose = None
+	option_quantize = None
+	option_filter = None
+	option_rawfile = None
+	option_order = "auto"
+	option_channels = None
+	option_song = None
+	option_search = None
+	option_jobs = None
+	option_analyse = None
+	option_dump = None
+	option_stats = None
+	option_profile = None
+
+
+	# process command line
+	for i in range(2, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 'o' or option == 'output':
+				option_outputfile = argv[i+1]
 			else:
-				if option == 'q' or option == 'quantize':
-					option_quantize = argv[i+1]
+				if option == 't' or option == 'transpose':
+					option_transpose = argv[i+1]
 				else:
-					if option == 'f' or option == 'filter':
-						option_filter = argv[i+1]
+					if option == 'q' or option == 'quantize':
+						option_quantize = argv[i+1]
 					else:
-						if option == 'r' or option == 'rawfile':
-							option_rawfile = argv[i+1]
+						if option == 'f' or option == 'filter':
+							option_filter = argv[i+1]
 						else:
-							if option == 'd' or option == 'dump':
-								option_dump = True
+							if option == 'r' or option == 'rawfile':
+								option_rawfile = argv[i+1]
+							elif option == 'order':
+								option_order = argv[i+1].lower()
+							elif option == 'c' or option == 'channels':
+								option_channels = argv[i+1]
+							elif option == 'i' or option == 'song':
+								option_song = argv[i+1]
+							elif option == 'search':
+								option_search = VgmStream.SEARCH_RATES
+								if i+1 < len(argv) and argv[i+1][0] != '-':
+									option_search = argv[i+1]
+							elif option == 'j' or option == 'jobs':
+								option_jobs = int(argv[i+1])
 							else:
-								if option == 'v' or option == 'verbose':
-									option_verbose = True
+								if option == 'd' or option == 'dump':
+									option_analyse = True
+									if i+1 < len(argv) and argv[i+1][0] != '-':
+										option_dump = argv[i+1]
+									else:
+										option_dump = os.path.splitext(source_filename)[0] + ".dump.txt"
 								else:
-									print "ERROR: Unrecognised option '" + arg + "'"
+									if option == 'v' or option == 'verbose':
+										option_verbose = True
+									else:
+										if option == 's' or option == 'stats':
+											option_stats = argv[i+1]
+										else:
+											if option == 'p' or option == 'profile':
+												option_profile = argv[i+1]
+											else:
+												if option == 'a' or option == 'analyse':
+													option_analyse = True
+												else:
+													print "ERROR: Unrecognised option '" + arg + "'"
+
+	# load the VGM
+	if source_filename == None:
+		print "ERROR: No source <filename> provided."
+		exit()
+
+	if option_order != "auto" and option_order not in VgmStream.PACKET_ORDERS:
+		print "ERROR: Unknown packet order '" + option_order + "'"
+		exit()
+
+	# if rawfile output is specified, but no quantization option given, force a default quantization of 60Hz (NTSC)
+	if option_rawfile != None or option_channels != None or option_song != None:
+		if option_quantize == None:
+			option_quantize = 60
+	
+	# debug code	
+	if False:
+		print "source " + str(source_filename)
+		print "verbose " + str(option_verbose)
+		print "output " + str(option_outputfile)
+		print "transpose " + str(option_transpose)
+		print "quantize " + str(option_quantize)
+		print "filter " + str(option_filter)
+		print "rawfile " + str(option_rawfile)
+		print "dump " + str(option_dump)
+		print ""
 
-# load the VGM
-if source_filename == None:
-	print "ERROR: No source <filename> provided."
-	exit()
 
-# if rawfile output is specified, but no quantization option given, force a default quantization of 60Hz (NTSC)
-if option_rawfile != None:
-	if option_quantize == None:
-		option_quantize = 60
-	
-# debug code	
-if False:
-	print "source " + str(source_filename)
-	print "verbose " + str(option_verbose)
-	print "output " + str(option_outputfile)
-	print "transpose " + str(option_transpose)
-	print "quantize " + str(option_quantize)
-	print "filter " + str(option_filter)
-	print "rawfile " + str(option_rawfile)
-	print "dump " + str(option_dump)
-	print ""
+	# profile everything from loading the VGM on
+	if option_profile != None:
+		import cProfile
+		profiler = cProfile.Profile()
+		profiler.enable()
 
+	vgm_stream = VgmStream(source_filename)
 
-	
-vgm_stream = VgmStream(source_filename)
+	# turn on verbose mode if required
+	if option_verbose == True:
+		vgm_stream.set_verbose(True)
 
-# turn on verbose mode if required
-if option_verbose == True:
-	vgm_stream.set_verbose(True)
+	# a looping tune only needs the data up to the end of its first loop
+	vgm_stream.truncate_loop()
 	
-# apply channel filters
-if option_filter != None:
-	if option_filter.find('0') != -1:
-		vgm_stream.filter_channel(0)
-	if option_filter.find('1') != -1:
-		vgm_stream.filter_channel(1)
-	if option_filter.find('2') != -1:
-		vgm_stream.filter_channel(2)
-	if option_filter.find('3') != -1:
-		vgm_stream.filter_channel(3)
-
-# Fixed optimization - non-lossy. Only removes duplicate register writes that are wholly unnecessary		
-vgm_stream.optimize()
-
-# Second optimization - for each update interval, eliminate redundant register writes 
-# and sort the writes for each interval so that volumes are set before tones.
-# This is in principle 'lossy' since the output VGM will be different to the source, but 
-# technically it will not influence the output audio stream.
-vgm_stream.optimize2()		
+	# apply channel filters
+	if option_filter != None:
+		if option_filter.find('0') != -1:
+			vgm_stream.filter_channel(0)
+		if option_filter.find('1') != -1:
+			vgm_stream.filter_channel(1)
+		if option_filter.find('2') != -1:
+			vgm_stream.filter_channel(2)
+		if option_filter.find('3') != -1:
+			vgm_stream.filter_channel(3)
+
+	# Fixed optimization - non-lossy. Only removes duplicate register writes that are wholly unnecessary		
+	vgm_stream.optimize()
+
+	# Second optimization - for each update interval, eliminate redundant register writes 
+	# and sort the writes for each interval so that volumes are set before tones.
+	# This is in principle 'lossy' since the output VGM will be different to the source, but 
+	# technically it will not influence the output audio stream.
+	vgm_stream.optimize2()		
 	
-# Run first optimization again to take advantage of any redundancy from last optimization
-vgm_stream.optimize()	
+	# Run first optimization again to take advantage of any redundancy from last optimization
+	vgm_stream.optimize()	
 	
-# apply transpose
-if option_transpose != None:
-	vgm_stream.transpose(option_transpose)
-
-# quantize the VGM if required
-if option_quantize != None:
-	hz = int(option_quantize)
-	vgm_stream.quantize(hz)
+	# apply transpose
+	if option_transpose != None:
+		vgm_stream.transpose(option_transpose)
+
+	# try quantizing to a range of rates if required, leaving the stream as it is
+	if option_search != None:
+		vgm_stream.search_rates(vgm_stream.rate_candidates(option_search), option_order, jobs = option_jobs)
+
+	# quantize the VGM if required
+	if option_quantize != None:
+		hz = int(option_quantize)
+		vgm_stream.quantize(hz)
 	
-	# optimize the stream
-	vgm_stream.optimize()
-	# optimize the packets
-	vgm_stream.optimize2()
-	# optimize the stream again, since packet optimization may have reduced data set further
-	vgm_stream.optimize()
-
-
-# emit a raw binary file if required
-if option_rawfile != None:
-	vgm_stream.write_binary(option_rawfile)
-
-# write out the processed VGM if required
-if option_outputfile != None:
-	vgm_stream.write_vgm(option_outputfile)
-
-# dump the processed VGM
-if option_dump != None:
-	vgm_stream.analyse()
-
-# all done
-print ""
-print "Processing complete."
+		# optimize the stream
+		vgm_stream.optimize()
+		# optimize the packets
+		vgm_stream.optimize2()
+		# optimize the stream again, since packet optimization may have reduced data set further
+		vgm_stream.optimize()
+
+
+	# emit a raw binary file if required
+	if option_rawfile != None:
+		vgm_stream.write_binary(option_rawfile, option_order)
+
+	# emit the per channel raw file if required
+	if option_channels != None:
+		vgm_stream.write_channels(option_channels)
+
+	# emit the instrument song file if required
+	if option_song != None:
+		vgm_stream.write_song(option_song)
+
+	# write out the processed VGM if required
+	if option_outputfile != None:
+		vgm_stream.write_vgm(option_outputfile)
+
+	# analyse the processed VGM, dumping it if required
+	if option_analyse != None:
+		vgm_stream.analyse(option_dump)
+
+	if option_profile != None:
+		profiler.disable()
+		profiler.dump_stats(option_profile)
+		import pstats
+		print ""
+		pstats.Stats(option_profile).sort_stats('cumulative').print_stats(20)
+
+	# machine readable pass timings
+	if option_stats != None:
+		import json
+		vgm_stream.print_stats()
+		stats = dict(vgm_stream.stats)
+		stats['source'] = source_filename
+		stats['total_seconds'] = sum([ p['seconds'] for p in stats['passes'] ])
+		stats_file = open(option_stats, 'w')
+		json.dump(stats, stats_file, indent = 1, sort_keys = True)
+		stats_file.close()
+		print "   VGM Processing : Pass timings written to '" + option_stats + "'"
+
+	# all done
+	print ""
+	print "Processing complete."
 
 
@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+# python script to measure what vgmconverter.py's processing does to a tune
+# Released under MIT license
+#
+# Both streams are resolved into register space - the value of each of the 8 PSG registers (tone / volume per
+# channel, the noise control) over time, keeping only writes that change a register - then each processed change
+# is matched to the source change it came from:
+# - the source change for a processed change at time t is the last one at or before t + the quantize interval,
+#   as quantize moves every write in an interval back to its start and optimize2 keeps only the last write to
+#   each register in an interval
+# - source changes skipped over by a match were dropped (optimize2, or transpose mapping two tones to one value)
+# - timing displacement = processed time - source time of each match
+# - pitch error = cents between the source and processed tone frequencies of each match, at each stream's clock.
+#   When the noise channel is playing periodic noise at tone 2's rate, tone 2 changes are measured as the
+#   noise pitch (tone 2 / shift register width), which is what the transpose heuristics retune for.
+#
+# Every register list is walked once, so the whole comparison is linear in the length of the streams.
+
+
+import sys
+import math
+
+from vgmconverter import VgmStream, FatalError
+from vgmrender import vgm_events
+
+
+#-----------------------------------------------------------------------------
+
+REGISTER_NAMES = [ "tone 0", "volume 0", "tone 1", "volume 1", "tone 2", "volume 2", "noise", "volume 3" ]
+TONE_REGISTERS = [0, 2, 4]
+NOISE_REGISTER = 6
+
+PITCH_NAMES = [ "channel 0", "channel 1", "channel 2", "periodic noise" ]
+
+# bucket upper bounds, the last bucket is everything over
+CENTS_BUCKETS = [ 0.5, 1, 2, 5, 10, 25, 50, 100 ]
+DISPLACEMENT_BUCKETS_MS = [ 0, 1, 2, 5, 10, 20, 40 ]
+
+
+class ResolvedStream:
+
+	# changes[register] = [ (VGM sample time, value) ] for every write that changed the register
+	def __init__(self, vgm_stream):
+		self.clock = vgm_stream.metadata['sn76489_clock'] & 0x3FFFFFFF
+		self.width = vgm_stream.metadata.get('sn76489_shift_register_width', 0) or 16
+		self.rate = vgm_stream.metadata.get('rate', 0)
+		self.writes = 0
+		self.changes = [ [] for r in range(8) ]
+
+		registers = [None] * 8
+		latch = 0
+		for t, writes in vgm_events(vgm_stream):
+			for b in writes:
+				self.writes += 1
+				if b & 0x80:
+					latch = (b >> 4) & 7
+					if latch in TONE_REGISTERS:
+						value = ((registers[latch] or 0) & 0x3F0) | (b & 15)
+					else:
+						value = b & 15
+				else:
+					if latch in TONE_REGISTERS:
+						value = ((registers[latch] or 0) & 15) | ((b & 0x3F) << 4)
+					else:
+						value = b & 15
+				if latch == NOISE_REGISTER:
+					value &= 7
+
+				if value != registers[latch]:
+					registers[latch] = value
+					changes = self.changes[latch]
+					# a latch + data pair is one change
+					if len(changes) > 0 and changes[-1][0] == t:
+						changes[-1] = (t, value)
+					else:
+						changes.append((t, value))
+
+
+	def tone_hz(self, value):
+		if value == 0:
+			value = 0x400
+		return self.clock / (32.0 * value)
+
+
+# register value at increasing times, walking the change list once
+class RegisterCursor:
+
+	def __init__(self, changes):
+		self.changes = changes
+		self.index = -1
+
+	def value_at(self, t):
+		changes = self.changes
+		while self.index + 1 < len(changes) and changes[self.index + 1][0] <= t:
+			self.index += 1
+		if self.index < 0:
+			return None
+		return changes[self.index][1]
+
+
+def is_periodic_tone2(noise):
+	return noise is not None and (noise & 4) == 0 and (noise & 3) == 3
+
+
+def bucket_index(value, buckets):
+	for i, b in enumerate(buckets):
+		if value <= b:
+			return i
+	return len(buckets)
+
+
+class VgmMetrics:
+
+	def __init__(self, source, processed, interval = None):
+		self.source = source
+		self.processed = processed
+		if interval is None:
+			interval = 0
+			if processed.rate > 0:
+				interval = VgmStream.VGM_FREQUENCY // processed.rate
+		self.interval = interval
+
+		self.matched = 0
+		self.dropped = [0] * 8
+		self.unmatched = [0] * 8
+
+		self.cents = [ [0] * (len(CENTS_BUCKETS) + 1) for c in range(len(PITCH_NAMES)) ]
+		self.cents_total = [0.0] * len(PITCH_NAMES)
+		self.cents_count = [0] * len(PITCH_NAMES)
+		self.cents_max = [0.0] * len(PITCH_NAMES)
+
+		self.displacement = [0] * (len(DISPLACEMENT_BUCKETS_MS) + 1)
+		self.displacement_total = 0
+		self.displacement_max = 0
+
+		for register in range(8):
+			self.match_register(register)
+
+
+	def match_register(self, register):
+		src = self.source.changes[register]
+		proc = self.processed.changes[register]
+		src_noise = RegisterCursor(self.source.changes[NOISE_REGISTER])
+		proc_noise = RegisterCursor(self.processed.changes[NOISE_REGISTER])
+		window = self.interval
+
+		i = 0
+		for tp, vp in proc:
+			j = i
+			if j >= len(src) or src[j][0] > tp + window:
+				self.unmatched[register] += 1
+				continue
+			while j + 1 < len(src) and src[j + 1][0] <= tp + window:
+				j += 1
+
+			self.dropped[register] += j - i
+			ts, vs = src[j]
+			i = j + 1
+			self.matched += 1
+
+			shift = abs(tp - ts)
+			self.displacement[bucket_index(shift * 1000.0 / VgmStream.VGM_FREQUENCY, DISPLACEMENT_BUCKETS_MS)] += 1
+			self.displacement_total += shift
+			self.displacement_max = max(self.displacement_max, shift)
+
+			if register in TONE_REGISTERS:
+				channel = register >> 1
+				source_hz = self.source.tone_hz(vs)
+				processed_hz = self.processed.tone_hz(vp)
+				if register == 4 and is_periodic_tone2(src_noise.value_at(ts)) and is_periodic_tone2(proc_noise.value_at(tp)):
+					channel = 3
+					source_hz /= self.source.width
+					processed_hz /= self.processed.width
+				self.add_pitch(channel, abs(1200.0 * math.log(processed_hz / source_hz, 2)))
+
+		self.dropped[register] += len(src) - i
+
+
+	def add_pitch(self, channel, cents):
+		self.cents[channel][bucket_index(cents, CENTS_BUCKETS)] += 1
+		self.cents_total[channel] += cents
+		self.cents_count[channel] += 1
+		self.cents_max[channel] = max(self.cents_max[channel], cents)
+
+
+	def report(self):
+		source = self.source
+		processed = self.processed
+		source_changes = sum([ len(c) for c in source.changes ])
+		processed_changes = sum([ len(c) for c in processed.changes ])
+
+		print "source    = " + str(source.clock) + " Hz, " + str(source.writes) + " writes, " + str(source_changes) + " register changes"
+		print "processed = " + str(processed.clock) + " Hz, " + str(processed.writes) + " writes, " + str(processed_changes) + " register changes"
+		print "quantize interval = " + str(self.interval) + " samples (" + ("%.1f" % (self.interval * 1000.0 / VgmStream.VGM_FREQUENCY)) + " ms)"
+		print "matched changes = " + str(self.matched)
+		print "dropped changes = " + str(sum(self.dropped)) + " (" + ", ".join([ REGISTER_NAMES[r] + " " + str(self.dropped[r]) for r in range(8) if self.dropped[r] > 0 ]) + ")"
+		if sum(self.unmatched) > 0:
+			print "unmatched processed changes = " + str(sum(self.unmatched))
+		print ""
+
+		print "pitch error (cents):"
+		print "              " + "".join([ ("<=" + str(b)).rjust(8) for b in CENTS_BUCKETS ]) + (">" + str(CENTS_BUCKETS[-1])).rjust(8) + "    mean     max"
+		for c in range(len(PITCH_NAMES)):
+			if self.cents_count[c] == 0:
+				continue
+			print PITCH_NAMES[c].ljust(14) + "".join([ str(n).rjust(8) for n in self.cents[c] ]) + ("%8.2f" % (self.cents_total[c] / self.cents_count[c])) + ("%8.1f" % self.cents_max[c])
+		print ""
+
+		print "timing displacement (ms):"
+		print "  " + "".join([ ("<=" + str(b)).rjust(8) for b in DISPLACEMENT_BUCKETS_MS ]) + (">" + str(DISPLACEMENT_BUCKETS_MS[-1])).rjust(8) + "    mean     max"
+		mean = 0.0
+		if self.matched > 0:
+			mean = self.displacement_total * 1000.0 / (self.matched * VgmStream.VGM_FREQUENCY)
+		print "  " + "".join([ str(n).rjust(8) for n in self.displacement ]) + ("%8.2f" % mean) + ("%8.1f" % (self.displacement_max * 1000.0 / VgmStream.VGM_FREQUENCY))
+
+
+#-----------------------------------------------------------------------------
+
+# a tune as vgmconverter.py's command line loads it, up to the end of its first loop
+def load(vgm_filename):
+	vgm_stream = VgmStream(vgm_filename)
+	vgm_stream.truncate_loop()
+	return vgm_stream
+
+
+# the same processing vgmconverter.py's command line applies
+def process(vgm_filename, transpose = None, quantize = None, optimize2 = True):
+	vgm_stream = load(vgm_filename)
+	vgm_stream.optimize()
+	if optimize2:
+		vgm_stream.optimize2()
+		vgm_stream.optimize()
+	if transpose is not None:
+		vgm_stream.transpose(transpose)
+	if quantize is not None:
+		vgm_stream.quantize(quantize)
+		vgm_stream.optimize()
+		if optimize2:
+			vgm_stream.optimize2()
+			vgm_stream.optimize()
+	return vgm_stream
+
+
+if __name__ == '__main__':
+
+	if len(sys.argv) < 2 or sys.argv[1][0] == '-':
+		print "vgmmetrics.py <source.vgm> [<processed.vgm>] [-t <clock>] [-q <rate>[,<rate>...]] [-no2]"
+		print "  compares a source VGM with a processed one (e.g. vgmconverter -o output), or with the source"
+		print "  processed here the same way as vgmconverter does"
+		print "  -t    transpose to ntsc, pal or bbc"
+		print "  -q    quantize to each of these play rates in turn"
+		print "  -no2  skip optimize2"
+		exit()
+
+	argv = sys.argv
+	source_filename = argv[1]
+	processed_filename = None
+	if len(argv) > 2 and argv[2][0] != '-':
+		processed_filename = argv[2]
+
+	option_transpose = None
+	option_quantize = [None]
+	option_optimize2 = True
+
+	for i in range(2, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 't' or option == 'transpose':
+				option_transpose = argv[i+1]
+			elif option == 'q' or option == 'quantize':
+				option_quantize = [ int(q) for q in argv[i+1].split(',') ]
+			elif option == 'no2':
+				option_optimize2 = False
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	try:
+		source = ResolvedStream(load(source_filename))
+		results = []
+		if processed_filename is not None:
+			results.append((processed_filename, VgmMetrics(source, ResolvedStream(load(processed_filename)))))
+		else:
+			for q in option_quantize:
+				name = "transpose " + str(option_transpose) + ", quantize " + str(q) + ", optimize2 " + ("on" if option_optimize2 else "off")
+				processed = ResolvedStream(process(source_filename, option_transpose, q, option_optimize2))
+				results.append((name, VgmMetrics(source, processed)))
+	except FatalError as e:
+		print "ERROR: " + str(e)
+		sys.exit(1)
+
+	for name, metrics in results:
+		print ""
+		print "---- " + name
+		metrics.report()
+
+	if len(results) > 1:
+		print ""
+		print "summary:"
+		print " " * 44 + "  writes  dropped  mean cents  mean ms"
+		for name, metrics in results:
+			cents = sum(metrics.cents_total) / max(1, sum(metrics.cents_count))
+			ms = metrics.displacement_total * 1000.0 / (max(1, metrics.matched) * VgmStream.VGM_FREQUENCY)
+			print name.ljust(44) + str(metrics.processed.writes).rjust(8) + str(sum(metrics.dropped)).rjust(9) + ("%12.2f" % cents) + ("%9.2f" % ms)
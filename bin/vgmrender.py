@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+# python script to render SN76489 PSG music to a WAV file, to hear what vgmconverter.py has done to a tune
+# Released under MIT license
+#
+# Renders either a VGM file (or a VgmStream after transpose / quantize) or the raw packet file that
+# VgmStream.write_binary writes for vgmplayer.asm.
+#
+# Between register writes the chip state is constant, so each run of samples is rendered in one go with NumPy:
+# - tone channels are square waves, the counter flips the output every N ticks of clock / 16.
+#   Periods too short to hear (N = 1 is used to play samples) are output as a constant level like the real chip.
+#   N = 0 counts as 0x400.
+# - the noise channel shifts its LFSR every other flip of its counter (N = 0x10, 0x20, 0x40 or tone 2's period)
+#   and outputs bit 0. The whole LFSR sequence is generated once so a run of samples is just an index into it.
+#   White noise feeds back the parity of the tapped bits, periodic noise just bit 0, and writing the noise
+#   register resets the LFSR.
+#   BBC Micro: 15 bit shift register, taps 0x0003 (sn76489_feedback), so periodic noise is 1/15th of tone 2
+#   Sega: 16 bit shift register, taps 0x0009, periodic noise is 1/16th
+# - volumes are 2dB per step, 15 = off
+
+
+import sys
+import os
+import struct
+import wave
+import time
+
+import numpy
+
+from vgmconverter import VgmStream, FatalError
+
+
+#-----------------------------------------------------------------------------
+
+VGM_FREQUENCY = 44100
+
+PSG_MODELS = {
+	'bbc': { 'clock': 4000000, 'feedback': 0x0003, 'width': 15 },
+	'sega': { 'clock': 3579545, 'feedback': 0x0009, 'width': 16 },
+}
+
+VOLUME_TABLE = [ 10.0 ** (-0.1 * v) for v in range(15) ] + [0.0]
+
+
+# bit 0 of the LFSR after each shift, as (sequence, index the sequence loops back to)
+def lfsr_sequence(width, feedback, white):
+	start = 1 << (width - 1)
+	seen = {}
+	bits = []
+	sr = start
+	while sr not in seen:
+		seen[sr] = len(bits)
+		if white:
+			f = bin(sr & feedback).count('1') & 1
+		else:
+			f = sr & 1
+		sr = (sr >> 1) | (f << (width - 1))
+		bits.append(sr & 1)
+	return numpy.array(bits, dtype = numpy.float64), seen[sr]
+
+
+class PsgRenderer:
+
+	def __init__(self, clock = 4000000, feedback = 0x0003, width = 15, sample_rate = 44100):
+		self.clock = clock
+		self.sample_rate = sample_rate
+		self.ticks_per_sample = clock / 16.0 / sample_rate
+
+		self.tone = [0, 0, 0]
+		self.volume = [15, 15, 15, 15]
+		self.noise = 0
+		self.latch = 0
+
+		self.tone_phase = [0.0, 0.0, 0.0]
+		self.noise_phase = 0.0
+
+		self.noise_sequences = [ lfsr_sequence(width, feedback, False), lfsr_sequence(width, feedback, True) ]
+
+
+	def write(self, b):
+		if b & 0x80:
+			self.latch = (b >> 4) & 7
+			data = b & 15
+			channel = self.latch >> 1
+			if self.latch & 1:
+				self.volume[channel] = data
+			elif channel == 3:
+				self.noise = data & 7
+				self.noise_phase = 0.0
+			else:
+				self.tone[channel] = (self.tone[channel] & 0x3F0) | data
+		else:
+			channel = self.latch >> 1
+			if self.latch & 1:
+				self.volume[channel] = b & 15
+			elif channel == 3:
+				self.noise = b & 7
+				self.noise_phase = 0.0
+			else:
+				self.tone[channel] = (self.tone[channel] & 15) | ((b & 0x3F) << 4)
+
+
+	def period(self, channel):
+		n = self.tone[channel]
+		if n == 0:
+			n = 0x400
+		return n
+
+
+	# the next count samples with the current register values, -1.0 to 1.0 per channel before mixing
+	def render(self, count):
+		out = numpy.zeros(count)
+		if count <= 0:
+			return out
+		steps = numpy.arange(1, count + 1, dtype = numpy.float64)
+
+		for channel in range(3):
+			amplitude = VOLUME_TABLE[self.volume[channel]]
+			flips = self.ticks_per_sample / self.period(channel)
+			if flips >= 1.0:
+				# above the Nyquist frequency - the output just sits high
+				out += amplitude
+				continue
+			pos = self.tone_phase[channel] + steps * flips
+			if amplitude > 0.0:
+				out += amplitude * (1.0 - 2.0 * (numpy.floor(pos) % 2.0))
+			self.tone_phase[channel] = pos[-1] % 2.0
+
+		rate = self.noise & 3
+		if rate == 3:
+			n = self.period(2)
+		else:
+			n = 0x10 << rate
+		pos = self.noise_phase + steps * (self.ticks_per_sample / (2 * n))
+		self.noise_phase = pos[-1]
+
+		amplitude = VOLUME_TABLE[self.volume[3]]
+		if amplitude > 0.0:
+			sequence, loop = self.noise_sequences[(self.noise >> 2) & 1]
+			index = numpy.floor(pos).astype(numpy.int64)
+			index = numpy.where(index < len(sequence), index, loop + (index - loop) % (len(sequence) - loop))
+			out += amplitude * (2.0 * sequence[index] - 1.0)
+
+		return out
+
+
+#-----------------------------------------------------------------------------
+
+# (VGM sample time, register writes) for each point the chip state changes in a VgmStream
+def vgm_events(vgm_stream):
+	events = []
+	t = 0
+	writes = []
+	for q in vgm_stream.command_list:
+		command = ord(q['command'])
+		wait = 0
+		if command == 0x50:
+			writes.append(ord(q['data']))
+		elif command == 0x61:
+			wait = struct.unpack('<H', q['data'])[0]
+		elif command == 0x62:
+			wait = 735
+		elif command == 0x63:
+			wait = 882
+		elif command >= 0x70 and command <= 0x7f:
+			wait = (command & 15) + 1
+		elif command == 0x66:
+			break
+
+		if wait > 0:
+			events.append((t, writes))
+			writes = []
+			t += wait
+
+	events.append((t, writes))
+	return events
+
+
+# (VGM sample time, register writes) for every packet in a write_binary raw file, and the play rate
+def raw_events(data):
+	data = bytearray(data)
+	header_size = data[0]
+	play_rate = data[1]
+	if play_rate == 0:
+		raise FatalError("Raw file has a play rate of 0")
+
+	# skip the header, title and author
+	pos = 1 + header_size
+	pos += 1 + data[pos]
+	pos += 1 + data[pos]
+
+	events = []
+	packet = 0
+	while pos < len(data) and data[pos] != 0xFF:
+		size = data[pos]
+		events.append((packet * VGM_FREQUENCY // play_rate, list(data[pos+1:pos+1+size])))
+		pos += 1 + size
+		packet += 1
+
+	if pos >= len(data):
+		raise FatalError("Raw file has no end marker")
+
+	events.append((packet * VGM_FREQUENCY // play_rate, []))
+	return events, play_rate
+
+
+def render_events(events, renderer):
+	rate = renderer.sample_rate
+	blocks = []
+	done = 0
+	for t, writes in events:
+		end = t * rate // VGM_FREQUENCY
+		if end > done:
+			blocks.append(renderer.render(end - done))
+			done = end
+		for b in writes:
+			renderer.write(b)
+
+	if len(blocks) == 0:
+		return numpy.zeros(0)
+	return numpy.concatenate(blocks)
+
+
+def vgm_model(vgm_stream):
+	clock = vgm_stream.metadata['sn76489_clock'] & 0x3FFFFFFF
+	feedback = vgm_stream.metadata.get('sn76489_feedback', 0)
+	width = vgm_stream.metadata.get('sn76489_shift_register_width', 0)
+	if feedback == 0 or width == 0:
+		# pre 1.10 VGMs don't say, they're Sega
+		feedback = PSG_MODELS['sega']['feedback']
+		width = PSG_MODELS['sega']['width']
+	return clock, feedback, width
+
+
+def render_vgm(vgm_stream, sample_rate = 44100):
+	clock, feedback, width = vgm_model(vgm_stream)
+	return render_events(vgm_events(vgm_stream), PsgRenderer(clock, feedback, width, sample_rate))
+
+
+def render_raw(data, sample_rate = 44100, clock = 4000000, feedback = 0x0003, width = 15):
+	events, play_rate = raw_events(data)
+	return render_events(events, PsgRenderer(clock, feedback, width, sample_rate))
+
+
+def write_wav(filename, samples, sample_rate = 44100):
+	# 4 channels at full volume peak at 4.0
+	pcm = numpy.clip(samples * (0.9 * 32767 / 4.0), -32768, 32767).astype('<i2')
+	wav = wave.open(filename, 'wb')
+	wav.setnchannels(1)
+	wav.setsampwidth(2)
+	wav.setframerate(sample_rate)
+	wav.writeframes(pcm.tostring())
+	wav.close()
+
+
+#-----------------------------------------------------------------------------
+
+if __name__ == '__main__':
+
+	if len(sys.argv) < 2 or sys.argv[1][0] == '-':
+		print "vgmrender.py <file.vgm | file.raw> [-o <file.wav>] [-raw] [-model bbc|sega] [-clock <hz>] [-rate <hz>]"
+		print "  -o      output WAV file (default <file>.wav)"
+		print "  -raw    the input is a raw packet file from vgmconverter -r (default for anything but .vgm / .vgz)"
+		print "  -model  PSG noise shift register, bbc (15 bit, taps 0x0003) or sega (16 bit, taps 0x0009)"
+		print "          (default from the VGM header, bbc for raw files)"
+		print "  -clock  PSG clock (default from the VGM header, 4000000 for raw files)"
+		print "  -rate   WAV sample rate (default 44100)"
+		exit()
+
+	argv = sys.argv
+	source_filename = argv[1]
+	option_output = None
+	option_raw = os.path.splitext(source_filename)[1].lower() not in [ '.vgm', '.vgz' ]
+	option_model = None
+	option_clock = None
+	option_rate = 44100
+
+	for i in range(2, len(argv)):
+		arg = argv[i]
+		if arg[0] == '-':
+			option = arg[1:].lower()
+			if option == 'o':
+				option_output = argv[i+1]
+			elif option == 'raw':
+				option_raw = True
+			elif option == 'model':
+				option_model = argv[i+1].lower()
+				if option_model not in PSG_MODELS:
+					print "ERROR: Unknown model '" + option_model + "'"
+					sys.exit(1)
+			elif option == 'clock':
+				option_clock = int(argv[i+1])
+			elif option == 'rate':
+				option_rate = int(argv[i+1])
+			else:
+				print "ERROR: Unrecognised option '" + arg + "'"
+
+	if option_output is None:
+		option_output = os.path.splitext(source_filename)[0] + ".wav"
+
+	t0 = time.time()
+
+	try:
+		if option_raw:
+			fh = open(source_filename, 'rb')
+			data = fh.read()
+			fh.close()
+			events, play_rate = raw_events(data)
+			model = PSG_MODELS[option_model or 'bbc']
+			clock, feedback, width = model['clock'], model['feedback'], model['width']
+		else:
+			vgm_stream = VgmStream(source_filename)
+			events = vgm_events(vgm_stream)
+			clock, feedback, width = vgm_model(vgm_stream)
+			if option_model is not None:
+				feedback = PSG_MODELS[option_model]['feedback']
+				width = PSG_MODELS[option_model]['width']
+	except (FatalError, IOError) as e:
+		print "ERROR: " + str(e)
+		sys.exit(1)
+
+	if option_clock is not None:
+		clock = option_clock
+
+	samples = render_events(events, PsgRenderer(clock, feedback, width, option_rate))
+	write_wav(option_output, samples, option_rate)
+
+	print "PSG clock = " + str(clock) + " Hz, noise " + str(width) + " bit shift register, taps 0x" + ("%04X" % feedback)
+	print "rendered " + ("%.1f" % (len(samples) / float(option_rate))) + " seconds to '" + option_output + "' in " + ("%.1f" % (time.time() - t0)) + "s"
@@ -0,0 +1,10 @@
+REM Usage: compare_dither_modes <short name/dir> [extra mode7video options eg. -n 5367 or -video <file>]
+@echo off
+rem encode the same frames with every dithering mode and compress each the same way as the build
+rem dithering noise turns directly into deltas so check the compressed sizes before switching modes
+FOR %%D IN (0 1 2 3) DO (
+	mode7video.exe -i %1 -d %%D -o %1\%1_dither%%D.bin %2 %3 %4 %5 %6 %7 %8 %9 > %1\%1_dither%%D.txt
+	bin\exomizer.exe raw -m 3072 -c %1\%1_dither%%D.bin -o %1\%1_dither%%D.bin.exo > NUL
+)
+FOR %%F IN (%1\%1_dither*.bin %1\%1_dither*.bin.exo) DO echo %%F %%~zF bytes
+findstr /C:"dither mode" /C:"total deltas" /C:"threshold" %1\%1_dither*.txt
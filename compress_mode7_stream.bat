@@ -1,11 +1,11 @@
 REM Usage: compress_mode7_stream <short name/dir>
 @echo off
-DEL /Q %1\files\*
 bin\exomizer.exe raw -m 3072 -c %1\%1_beeb.bin -o %1\%1_beeb.bin.exo
 
+rem the stream is now split on track boundaries by bin\m7vdisks.py when the disks are built (make_mode7_disks)
+rem so there is no need for split.exe & the per-file .inf files anymore
 
-
-
+rem DEL /Q %1\files\*
 
 rem 186880 is the first 73 tracks worth of video (2560 x 73)
 rem first 7 tracks of the disk are reserved
@@ -15,7 +15,6 @@ rem or first 6 tracks variant
 rem bin\split.exe --byte=189440 --numeric-suffixes %1\%1_beeb.bin.exo %1\files\%1_beeb_
 
 rem or first 8 tracks variant
-bin\split.exe --byte=184320 --numeric-suffixes %1\%1_beeb.bin.exo %1\files\%1_beeb_
-
+rem bin\split.exe --byte=184320 --numeric-suffixes %1\%1_beeb.bin.exo %1\files\%1_beeb_
 
-FOR %%F IN (%1\files\*) DO echo $.%1	000000 000000 > %%F.inf
+rem FOR %%F IN (%1\files\*) DO echo $.%1	000000 000000 > %%F.inf
@@ -1,5 +1,5 @@
 
-../bin/vgmconverter.py  "bbcapple-palsms-3_2.vgm" -t bbc -q 50  -o bbcapple.vgm -r bbcapple.bin -d >out.txt
+../bin/vgmconverter.py  "bbcapple-palsms-3_2.vgm" -t bbc -q 50  -o bbcapple.vgm -r bbcapple.bin -d out.txt
 
 
 
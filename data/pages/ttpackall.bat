@@ -1 +1 @@
-for %%x in (*.txt) do call ttpack.bat %%x
+..\..\bin\ttpack.py .
\ No newline at end of file
@@ -5,19 +5,23 @@ rem disk1 now created by beebasm
 rem del "%1\disks\%1_disk1.ssd"
 rem bin\bbcim -a "%1\disks\%1_disk1.ssd" "m7vplay"
 
-del "%1\disks\%1_disk2.ssd"
+rem video added to disk1 on track 8 onwards, disk2 & the .dsd written in one go
+python bin\m7vdisks.py %1
 
-CD files
+rem previous bbcim build, needed the stream split into files by compress_mode7_stream
+rem del "%1\disks\%1_disk2.ssd"
+
+rem CD files
 rem boot & track padding now compiled into demo 
 rem ..\bin\bbcim -a "..\%1\disks\%1_disk1.ssd" "Boot"
 rem ..\bin\bbcim -a "..\%1\disks\%1_disk1.ssd" "Dummy2"
-..\bin\bbcim -a "..\%1\disks\%1_disk2.ssd" "Readme"
-CD "..\%1\files"
-..\..\bin\bbcim -a "..\disks\%1_disk1.ssd" "%1_beeb_00"
-..\..\bin\bbcim -a "..\disks\%1_disk2.ssd" "%1_beeb_01"
-..\..\bin\bbcim -a "..\disks\%1_disk2.ssd" "%1_beeb_02"
-CD "..\..\files"
-..\bin\bbcim -a "..\%1\disks\%1_disk2.ssd" "help"
-CD "..\%1\disks"
-..\..\bin\bbcim -interss sd %1_disk1.ssd %1_disk2.ssd %1.dsd
-CD ..\..
+rem ..\bin\bbcim -a "..\%1\disks\%1_disk2.ssd" "Readme"
+rem CD "..\%1\files"
+rem ..\..\bin\bbcim -a "..\disks\%1_disk1.ssd" "%1_beeb_00"
+rem ..\..\bin\bbcim -a "..\disks\%1_disk2.ssd" "%1_beeb_01"
+rem ..\..\bin\bbcim -a "..\disks\%1_disk2.ssd" "%1_beeb_02"
+rem CD "..\..\files"
+rem ..\bin\bbcim -a "..\%1\disks\%1_disk2.ssd" "help"
+rem CD "..\%1\disks"
+rem ..\..\bin\bbcim -interss sd %1_disk1.ssd %1_disk2.ssd %1.dsd
+rem CD ..\..
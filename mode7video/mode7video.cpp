@@ -4,6 +4,16 @@
 //#include "stdafx.h"
 #include "CImg.h"
 
+#ifdef _WIN32
+#include <io.h>
+#include <fcntl.h>
+#define popen				_popen
+#define pclose				_pclose
+#define POPEN_READ			"rb"
+#else
+#define POPEN_READ			"r"
+#endif
+
 using namespace cimg_library;
 
 #define MODE7_COL0			151
@@ -45,8 +55,121 @@ static unsigned char prevmode7[MODE7_MAX_SIZE];
 static unsigned char delta[MODE7_MAX_SIZE];
 static unsigned char mode7[MODE7_MAX_SIZE];
 
+// Plain thresholded version of each frame used to report what dithering costs
+static CImg<unsigned char> ref;
+static unsigned char refmode7[MODE7_MAX_SIZE];
+static unsigned char prevrefmode7[MODE7_MAX_SIZE];
+static unsigned char refdelta[MODE7_MAX_SIZE];
+
+// Temporal stability filter state - greyscale input, last output pixels and the unfiltered result
+static CImg<unsigned char> grey;
+static CImg<unsigned char> stable;
+static CImg<unsigned char> unfiltered;
+static unsigned char unfilteredmode7[MODE7_MAX_SIZE];
+static unsigned char prevunfilteredmode7[MODE7_MAX_SIZE];
+
 static int savedwrites;
 
+// Frame source - either a directory of ripped images or a stream of raw 8-bit greyscale frames
+// (piped from ffmpeg, read from a file or from stdin) so no intermediate files are needed
+
+#define SOURCE_IMAGES		0
+#define SOURCE_RAW			1
+#define SOURCE_VIDEO		2
+
+static int source_type;
+static FILE *source_file;
+static int source_width;
+static int source_height;
+static unsigned char *source_frame;
+
+bool open_frame_source(const char *video, const char *raw, const char *ffmpeg, const char *fps, int width, int height)
+{
+	char command[1024];
+
+	source_type = SOURCE_IMAGES;
+	source_file = NULL;
+	source_width = width;
+	source_height = height;
+
+	if (video)
+	{
+		// ffmpeg scales to the target resolution and converts to greyscale for us
+		sprintf(command, "\"%s\" -loglevel error -i \"%s\" -r %s -s %dx%d -f rawvideo -pix_fmt gray -", ffmpeg, video, fps, width, height);
+		source_file = popen(command, POPEN_READ);
+		source_type = SOURCE_VIDEO;
+	}
+	else if (raw)
+	{
+		if (strcmp(raw, "-") == 0)
+		{
+#ifdef _WIN32
+			_setmode(_fileno(stdin), _O_BINARY);
+#endif
+			source_file = stdin;
+		}
+		else
+		{
+			source_file = fopen(raw, "rb");
+		}
+		source_type = SOURCE_RAW;
+	}
+	else
+	{
+		return true;
+	}
+
+	if (source_file == NULL)
+	{
+		printf("Failed to open frame source '%s'\n", video ? command : raw);
+		return false;
+	}
+
+	source_frame = (unsigned char *)malloc(width * height);
+	return true;
+}
+
+// Fetch frame n into src as a 3 channel image, returns false when the source has no more frames
+bool read_frame(int n, const char *directory, const char *shortname, const char *ext)
+{
+	char input[256];
+
+	if (source_type == SOURCE_IMAGES)
+	{
+		sprintf(input, "%s\\frames\\%s-%d.%s", directory, shortname, n, ext);
+		src.assign(input);
+		return true;
+	}
+
+	if (fread(source_frame, 1, source_width * source_height, source_file) != (size_t)(source_width * source_height))
+		return false;
+
+	src.assign(source_width, source_height, 1, 3);
+
+	for (int c = 0; c < 3; c++)
+	{
+		memcpy(src.data(0, 0, 0, c), source_frame, source_width * source_height);
+	}
+
+	return true;
+}
+
+void close_frame_source()
+{
+	if (source_type == SOURCE_VIDEO)
+	{
+		pclose(source_file);
+	}
+	else if (source_type == SOURCE_RAW && source_file != stdin)
+	{
+		fclose(source_file);
+	}
+
+	free(source_frame);
+	source_file = NULL;
+	source_frame = NULL;
+}
+
 int get_colour_from_rgb(unsigned char r, unsigned char g, unsigned char b)
 {
 	return (r ? 1 : 0) + (g ? 2 : 0) + (b ? 4 : 0);
@@ -80,7 +203,7 @@ unsigned char pixel_to_grey(int mode, unsigned char r, unsigned char g, unsigned
 	}
 }
 
-unsigned char get_graphic_char_from_image(int x7, int y7, int fg, int bg)
+unsigned char get_graphic_char_from_image(const CImg<unsigned char> &img, int x7, int y7, int fg, int bg)
 {
 	int x = (x7 - FRAME_FIRST_COLUMN) * 2;
 	int y = y7 * 3;
@@ -90,16 +213,141 @@ unsigned char get_graphic_char_from_image(int x7, int y7, int fg, int bg)
 		// Calculate graphic character - if pixel == bg colour then off else on
 
 		graphic_char = 32 +																				// bit 5 always set!
-			+(get_colour_from_rgb(src(x, y, 0), src(x, y, 1), src(x, y, 2)) == bg ? 0 : 1)						// (x,y) = bit 0
-			+ (get_colour_from_rgb(src(x + 1, y, 0), src(x + 1, y, 1), src(x + 1, y, 2)) == bg ? 0 : 2)					// (x+1,y) = bit 1
-			+ (get_colour_from_rgb(src(x, y + 1, 0), src(x, y + 1, 1), src(x, y + 1, 2)) == bg ? 0 : 4)					// (x,y+1) = bit 2
-			+ (get_colour_from_rgb(src(x + 1, y + 1, 0), src(x + 1, y + 1, 1), src(x + 1, y + 1, 2)) == bg ? 0 : 8)			// (x+1,y+1) = bit 3
-			+ (get_colour_from_rgb(src(x, y + 2, 0), src(x, y + 2, 1), src(x, y + 2, 2)) == bg ? 0 : 16)				// (x,y+2) = bit 4
-			+ (get_colour_from_rgb(src(x + 1, y + 2, 0), src(x + 1, y + 2, 1), src(x + 1, y + 2, 2)) == bg ? 0 : 64);			// (x+1,y+2) = bit 6
+			+(get_colour_from_rgb(img(x, y, 0), img(x, y, 1), img(x, y, 2)) == bg ? 0 : 1)						// (x,y) = bit 0
+			+ (get_colour_from_rgb(img(x + 1, y, 0), img(x + 1, y, 1), img(x + 1, y, 2)) == bg ? 0 : 2)					// (x+1,y) = bit 1
+			+ (get_colour_from_rgb(img(x, y + 1, 0), img(x, y + 1, 1), img(x, y + 1, 2)) == bg ? 0 : 4)					// (x,y+1) = bit 2
+			+ (get_colour_from_rgb(img(x + 1, y + 1, 0), img(x + 1, y + 1, 1), img(x + 1, y + 1, 2)) == bg ? 0 : 8)			// (x+1,y+1) = bit 3
+			+ (get_colour_from_rgb(img(x, y + 2, 0), img(x, y + 2, 1), img(x, y + 2, 2)) == bg ? 0 : 16)				// (x,y+2) = bit 4
+			+ (get_colour_from_rgb(img(x + 1, y + 2, 0), img(x + 1, y + 2, 1), img(x + 1, y + 2, 2)) == bg ? 0 : 64);			// (x+1,y+2) = bit 6
 
 	return graphic_char;
 }
 
+// Dithering modes applied before the sixel conversion
+
+#define DITHER_NONE			0
+#define DITHER_FLOYD		1
+#define DITHER_ATKINSON		2
+#define DITHER_BAYER		3
+#define DITHER_MAX			DITHER_BAYER
+
+static const char *dither_names[] = { "threshold", "floyd-steinberg", "atkinson", "bayer 2x3" };
+
+// Ordered dither matrix the size of one MODE 7 cell (2x3 sixels)
+static const int bayer_2x3[3][2] =
+{
+	{ 0, 3 },
+	{ 4, 1 },
+	{ 2, 5 },
+};
+
+static CImg<int> dither_error;
+
+void dither_channel(CImg<unsigned char> &img, int c, int mode, int thresh)
+{
+	const int w = img._width;
+	const int h = img._height;
+
+	if (mode == DITHER_BAYER)
+	{
+		// Threshold per sixel position is spread evenly around the B&W threshold
+		cimg_forXY(img, x, y)
+		{
+			int t = thresh - 128 + ((2 * bayer_2x3[y % 3][x % 2] + 1) * 256) / 12;
+			img(x, y, c) = THRESHOLD(img(x, y, c), t);
+		}
+		return;
+	}
+
+	if (mode != DITHER_FLOYD && mode != DITHER_ATKINSON)
+	{
+		cimg_forXY(img, x, y)
+		{
+			img(x, y, c) = THRESHOLD(img(x, y, c), thresh);
+		}
+		return;
+	}
+
+	// Error diffusion - 2 pixel border so the kernels never need bounds checks
+	dither_error.assign(w + 4, h + 2, 1, 1, 0);
+
+	int *e = dither_error.data();
+	const int stride = w + 4;
+
+	for (int y = 0; y < h; y++)
+	{
+		int *row = e + y * stride + 2;
+		const unsigned char *in = img.data(0, y, 0, c);
+		unsigned char *out = img.data(0, y, 0, c);
+
+		for (int x = 0; x < w; x++)
+		{
+			int v = in[x] + row[x];
+			int o = v >= thresh ? 255 : 0;
+			int err = v - o;
+
+			out[x] = (unsigned char)o;
+
+			if (mode == DITHER_FLOYD)
+			{
+				row[x + 1] += (err * 7) / 16;
+				row[x + stride - 1] += (err * 3) / 16;
+				row[x + stride] += (err * 5) / 16;
+				row[x + stride + 1] += err / 16;
+			}
+			else
+			{
+				// Atkinson only diffuses 6/8 of the error which keeps flat areas clean
+				err /= 8;
+				row[x + 1] += err;
+				row[x + 2] += err;
+				row[x + stride - 1] += err;
+				row[x + stride] += err;
+				row[x + stride + 1] += err;
+				row[x + stride * 2] += err;
+			}
+		}
+	}
+}
+
+void dither_image(CImg<unsigned char> &img, int mode, int thresh)
+{
+	for (int c = 0; c < 3; c++)
+	{
+		dither_channel(img, c, mode, thresh);
+	}
+}
+
+// Hysteresis - a pixel whose input is within strength of the threshold keeps its previous state
+// so edges hovering around the threshold stop flickering and generating deltas every frame
+void stabilise_image(CImg<unsigned char> &img, const CImg<unsigned char> &in, const CImg<unsigned char> &prev, int thresh, int strength)
+{
+	cimg_forXYC(img, x, y, c)
+	{
+		int v = in(x, y, c);
+
+		if (v > thresh - strength && v < thresh + strength)
+		{
+			img(x, y, c) = prev(x, y, c);
+		}
+	}
+}
+
+void convert_to_mode7(const CImg<unsigned char> &img, unsigned char *screen, bool sep)
+{
+	for (int y7 = 0; y7 < FRAME_HEIGHT; y7++)
+	{
+		screen[y7 * MODE7_WIDTH] = MODE7_COL0; // graphic white
+		screen[1 + (y7 * MODE7_WIDTH)] = MODE7_COL1; // graphic white
+
+		// Copy the resulting character data into MODE 7 screen
+		for (int x7 = FRAME_FIRST_COLUMN; x7 < MODE7_WIDTH; x7++)
+		{
+			screen[(y7 * MODE7_WIDTH) + (x7)] = get_graphic_char_from_image(img, x7, y7, 7, 0);
+		}
+	}
+}
+
 int flushcode(unsigned char curcode, int curcount, unsigned char **p)
 {
 	switch (curcode)
@@ -218,25 +466,77 @@ int calc_steve_size(unsigned char *screen, unsigned char *delta, unsigned char b
 	return numbytes;
 }
 
+// Number of deltas and the bytes the encoder would emit for screen given the previous screen
+int calc_frame_size(unsigned char *screen, unsigned char *prevscreen, unsigned char *deltabuf, int *numdeltas)
+{
+	int count = 0;
+
+	for (int i = 0; i < FRAME_SIZE; i++)
+	{
+		deltabuf[i] = (screen[i] == prevscreen[i]) ? 0 : screen[i];
+		if (deltabuf[i]) count++;
+	}
+
+	*numdeltas = count;
+
+	if (count == 0)
+		return 1;
+
+	// Don't let a what-if frame count towards the saved writes stat
+	int saved = savedwrites;
+	int stevebytes = calc_steve_size(screen, deltabuf, MODE7_BLANK, NULL);
+	savedwrites = saved;
+
+	return 1 + (count * BYTES_PER_DELTA < stevebytes ? count * BYTES_PER_DELTA : stevebytes);
+}
+
 int main(int argc, char **argv)
 {
 	cimg_usage("MODE 7 video convertor.\n\nUsage : mode7video [options]");
-	const int frames = cimg_option("-n", 0, "Last frame number");
+	int frames = cimg_option("-n", 0, "Last frame number (0 = until the end of a video or raw stream)");
 	const int start = cimg_option("-s", 1, "Start frame number");
 	const char *const shortname = cimg_option("-i", (char*)0, "Input (directory / short name)");
 	const char *const ext = cimg_option("-e", (char*)"png", "Image format file extension");
 	const int gmode = cimg_option("-g", 0, "Colour to greyscale conversion (0=none, 1=red only, 2=green only, 3=blue only, 4=simple average, 5=luminence preserving");
 	const int thresh = cimg_option("-t", 127, "B&W threshold value");
+	const int dither = cimg_option("-d", 0, "Dithering (0=threshold only, 1=Floyd-Steinberg, 2=Atkinson, 3=ordered Bayer per 2x3 cell)");
+	const int hyst = cimg_option("-hyst", 0, "Temporal stability filter strength (0=off, pixels within this of the threshold keep their previous state)");
+	const char *const output = cimg_option("-o", (char*)0, "Output stream filename (default <dir>\\<name>_beeb.bin)");
 	const bool save = cimg_option("-save", false, "Save individual MODE7 frames");
 	const bool simg = cimg_option("-simg", false, "Save individual image frames");
 	const bool sep = cimg_option("-sep", false, "Separated graphics");
 	const bool verbose = cimg_option("-v", false, "Verbose output");
+	const char *const video = cimg_option("-video", (char*)0, "Stream frames from a video file through ffmpeg instead of reading ripped images");
+	const char *const raw = cimg_option("-raw", (char*)0, "Stream raw 8-bit greyscale frames from a file ('-' = stdin)");
+	const char *const ffmpeg = cimg_option("-ffmpeg", (char*)"bin\\ffmpeg.exe", "Path to ffmpeg used by -video");
+	const char *const fps = cimg_option("-r", (char*)"22.99", "Frame rate used by -video");
+	const int width = cimg_option("-width", 76, "Frame width in pixels for -video / -raw (2 per MODE 7 cell)");
+	const int height = cimg_option("-height", 66, "Frame height in pixels for -video / -raw (3 per MODE 7 cell)");
 
 	if (cimg_option("-h", false, 0)) std::exit(0);
 	if (shortname == NULL)  std::exit(0);
 
 	char filename[256];
-	char input[256];
+
+	if (dither < 0 || dither > DITHER_MAX)
+	{
+		printf("Unknown dithering mode %d\n", dither);
+		std::exit(1);
+	}
+
+	if (hyst < 0 || hyst > 128)
+	{
+		printf("Stability filter strength %d out of range (0-128)\n", hyst);
+		std::exit(1);
+	}
+
+	if (!open_frame_source(video, raw, ffmpeg, fps, width, height)) std::exit(1);
+
+	if (source_type == SOURCE_IMAGES && frames == 0)
+	{
+		printf("Last frame number (-n) must be given when reading images\n");
+		std::exit(1);
+	}
 
 	int totaldeltas = 0;
 	int totalbytes = 0;
@@ -247,15 +547,18 @@ int main(int argc, char **argv)
 	int totalsteved = 0;
 	int totalmin = 0;
 
-	unsigned char *beeb = (unsigned char *) malloc(MODE7_MAX_SIZE * NUM_FRAMES);
+	// Streamed sources don't know their length up front so grow the output as we go
+	int capacity = NUM_FRAMES ? NUM_FRAMES + 1 : 1024;
+
+	unsigned char *beeb = (unsigned char *) malloc(MODE7_MAX_SIZE * capacity);
 	unsigned char *ptr = beeb;
 
-	int *delta_counts = (int *)malloc(sizeof(int) * (NUM_FRAMES+1));
+	int *delta_counts = (int *)malloc(sizeof(int) * (capacity+1));
 
 	memset(mode7, 0, MODE7_MAX_SIZE);
 	memset(prevmode7, 0, MODE7_MAX_SIZE);
 	memset(delta, 0, MODE7_MAX_SIZE);
-	memset(delta_counts, 0, sizeof(int) * (NUM_FRAMES+1));
+	memset(delta_counts, 0, sizeof(int) * (capacity+1));
 
 	int totalblanks = 0;
 	int totaldeltaf = 0;
@@ -264,6 +567,13 @@ int main(int argc, char **argv)
 	int totaldeltab = 0;
 	int totalsteveb = 0;
 
+	int totalrefdeltas = 0;
+	int totalrefbytes = 0;
+	int totaldeltaframebytes = 0;
+
+	int totalunfiltereddeltas = 0;
+	int totalunfilteredbytes = 0;
+
 	savedwrites = 0;
 
 	FILE *file;
@@ -290,12 +600,26 @@ int main(int argc, char **argv)
 #else
 		prevmode7[i] = MODE7_BLANK;
 #endif
+		prevrefmode7[i] = prevmode7[i];
+		prevunfilteredmode7[i] = prevmode7[i];
 	}
 
-	for (int n = start; n <= NUM_FRAMES; n++)
+	int n;
+
+	for (n = start; NUM_FRAMES == 0 || n <= NUM_FRAMES; n++)
 	{
-		sprintf(input, "%s\\frames\\%s-%d.%s", DIRECTORY, FILENAME, n, ext);
-		src.assign(input);
+		if (!read_frame(n, DIRECTORY, FILENAME, ext))
+			break;
+
+		if (n - start + 1 >= capacity)
+		{
+			int used = ptr - beeb;
+
+			capacity *= 2;
+			beeb = (unsigned char *)realloc(beeb, MODE7_MAX_SIZE * capacity);
+			ptr = beeb + used;
+			delta_counts = (int *)realloc(delta_counts, sizeof(int) * (capacity+1));
+		}
 
 		// Convert to greyscale from RGB
 
@@ -311,11 +635,31 @@ int main(int argc, char **argv)
 
 		// Dithering
 
-		cimg_forXY(src, x, y)
+		if (dither != DITHER_NONE)
+		{
+			ref = src;
+			dither_image(ref, DITHER_NONE, thresh);
+		}
+
+		if (hyst)
+		{
+			grey = src;
+		}
+
+		dither_image(src, dither, thresh);
+
+		// Temporal stability
+
+		if (hyst)
 		{
-			src(x, y, 0) = THRESHOLD(src(x, y, 0), thresh);
-			src(x, y, 1) = THRESHOLD(src(x, y, 1), thresh);
-			src(x, y, 2) = THRESHOLD(src(x, y, 2), thresh);
+			unfiltered = src;
+
+			if (n != start)
+			{
+				stabilise_image(src, grey, stable, thresh, hyst);
+			}
+
+			stable = src;
 		}
 
 		if (simg)
@@ -326,22 +670,26 @@ int main(int argc, char **argv)
 
 		// Conversion to MODE 7
 
-		cimg_forY(src, y)
-		{
-			int y7 = y / 3;
-			mode7[y7 * MODE7_WIDTH] = MODE7_COL0; // graphic white
-			mode7[1 + (y7 * MODE7_WIDTH)] = MODE7_COL1; // graphic white
+		convert_to_mode7(src, mode7, sep);
 
+		if (dither != DITHER_NONE)
+		{
+			int refdeltas;
 
-			// Copy the resulting character data into MODE 7 screen
-			for (int x7 = FRAME_FIRST_COLUMN; x7 < MODE7_WIDTH; x7++)
-			{
-				mode7[(y7 * MODE7_WIDTH) + (x7)] = get_graphic_char_from_image(x7, y7, 7, 0);
-			}
+			convert_to_mode7(ref, refmode7, sep);
+			totalrefbytes += calc_frame_size(refmode7, prevrefmode7, refdelta, &refdeltas);
+			totalrefdeltas += refdeltas;
+			memcpy(prevrefmode7, refmode7, MODE7_MAX_SIZE);
+		}
 
-			// printf("\n");
+		if (hyst)
+		{
+			int unfiltereddeltas;
 
-			y += 2;
+			convert_to_mode7(unfiltered, unfilteredmode7, sep);
+			totalunfilteredbytes += calc_frame_size(unfilteredmode7, prevunfilteredmode7, refdelta, &unfiltereddeltas);
+			totalunfiltereddeltas += unfiltereddeltas;
+			memcpy(prevunfilteredmode7, unfilteredmode7, MODE7_MAX_SIZE);
 		}
 
 //		for (int i = 0; i < 1000; i++)
@@ -358,6 +706,8 @@ int main(int argc, char **argv)
 			totalbytes += 2;
 		}
 
+		unsigned char *frameptr = ptr;
+
 		// How many deltas?
 		int numdeltas = 0;
 		int numdeltabytes = 0;
@@ -378,7 +728,7 @@ int main(int argc, char **argv)
 
 		totaldeltas += numdeltas;
 		if (numdeltas > maxdeltas) maxdeltas = numdeltas;
-		delta_counts[n] = numdeltas;
+		delta_counts[n - start] = numdeltas;
 		numdeltabytes = numdeltas * BYTES_PER_DELTA;
 
 		int stevebytes = calc_steve_size(mode7, delta, MODE7_BLANK, NULL);
@@ -497,14 +847,20 @@ int main(int argc, char **argv)
 		}
 
 
+		totaldeltaframebytes += ptr - frameptr;
+
 		if (verbose)
 		{
 			printf("Frame: %d  numdeltas=%d (%d) stevebytes=%d stevedbytes=%d\n", n, numdeltas, numdeltabytes, stevebytes, stevedbytes);
 		}
-		else
+		else if (NUM_FRAMES)
 		{
 			printf("\rFrame: %d/%d", n, NUM_FRAMES);
 		}
+		else
+		{
+			printf("\rFrame: %d", n);
+		}
 
 		totalmin += 2 + (numdeltabytes < minsteve ? numdeltabytes : minsteve);
 
@@ -549,7 +905,9 @@ int main(int argc, char **argv)
 
 	*ptr++ = 0xff;					// end of stream
 
-	int total_frames = NUM_FRAMES - start + 1;
+	close_frame_source();
+
+	int total_frames = n - start;
 	printf("\ntotal frames = %d\n", total_frames);
 	printf("frame size = %d\n", FRAME_SIZE);
 	printf("total deltas = %d\n", totaldeltas);
@@ -575,7 +933,31 @@ int main(int argc, char **argv)
 
 	printf("saved writes = %d\n", savedwrites);
 
-	sprintf(filename, "%s\\%s_beeb.bin", DIRECTORY, FILENAME);
+	printf("dither mode = %s\n", dither_names[dither]);
+
+	if (dither != DITHER_NONE)
+	{
+		// Dithering noise shows up directly as extra deltas in the stream
+		printf("threshold deltas = %d (%+d with dithering, %+.1f%%)\n", totalrefdeltas, totaldeltas - totalrefdeltas, totalrefdeltas ? 100.0f * (totaldeltas - totalrefdeltas) / (float)totalrefdeltas : 0.0f);
+		printf("threshold frame bytes = %d (%+d with dithering, %+.1f%%)\n", totalrefbytes, totaldeltaframebytes - totalrefbytes, totalrefbytes ? 100.0f * (totaldeltaframebytes - totalrefbytes) / (float)totalrefbytes : 0.0f);
+	}
+
+	if (hyst)
+	{
+		// What the stability filter saved against the same frames without it
+		printf("stability filter strength = %d\n", hyst);
+		printf("unfiltered deltas = %d (%d removed, %f / second)\n", totalunfiltereddeltas, totalunfiltereddeltas - totaldeltas, 25.0f * (totalunfiltereddeltas - totaldeltas) / (float)total_frames);
+		printf("unfiltered frame bytes = %d (%d removed, %f bytes / second)\n", totalunfilteredbytes, totalunfilteredbytes - totaldeltaframebytes, 25.0f * (totalunfilteredbytes - totaldeltaframebytes) / (float)total_frames);
+	}
+
+	if (output)
+	{
+		strcpy(filename, output);
+	}
+	else
+	{
+		sprintf(filename, "%s\\%s_beeb.bin", DIRECTORY, FILENAME);
+	}
 	file = fopen((const char*)filename, "wb");
 
 	if (file)
@@ -0,0 +1,7 @@
+REM Usage: stream_mode7_video <input file> <output short name/dir> [extra mode7video options]
+@echo off
+md %2
+md %2\files
+md %2\disks
+rem frames are piped straight from ffmpeg into the encoder, no frames\*.png are written
+mode7video.exe -i %2 -video %1 -ffmpeg bin\ffmpeg.exe -r 22.99 -width 76 -height 66 %3 %4 %5 %6 %7 %8 %9
@@ -0,0 +1,4 @@
+REM Usage: verify_mode7_stream <short name/dir> [extra m7vcodec options eg. -s <start frame> -sep]
+@echo off
+rem decode the stream as the player would and check every frame against the -save dumps in <dir>\bin
+python bin\m7vcodec.py %1\%1_beeb.bin -i %1 %2 %3 %4 %5